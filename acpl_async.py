@@ -0,0 +1,238 @@
+import os
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import as_completed
+from urllib.parse import urlsplit
+import acpl_protocol
+from acpl_protocol import (
+    BASE_URL, API_URL, HEADERS, WARM_UP_HEADERS, ACPL_TIMEOUT, ACPL_MAX_CONCURRENCY, CookieState,
+    tracking_form, is_rejected
+)
+from acpl_tracker import parse_tracking_response
+from response_capture import capture_response
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is optional, only needed for the async client
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# 'auto' looks up batches (TRACK with several numbers, shipment polling) on the
+# process's shared async client when aiohttp is installed, 'off' on the thread pool
+ACPL_ASYNC = os.environ.get('ACPL_ASYNC', 'auto').lower()
+
+
+class AsyncACPLClient:
+    """
+    asyncio client for ACPL tracking that runs many lookups on one event loop.
+
+    Requests to each host are limited by a concurrency semaphore and by the
+    token bucket the blocking session uses too, so a large batch of lookups
+    cannot flood acplcargo.com.
+
+    Usage:
+        async with AsyncACPLClient() as client:
+            result = await client.track("2504500644")
+    """
+
+    def __init__(self, max_concurrency=ACPL_MAX_CONCURRENCY, rate_limiter=None):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for the async ACPL client (pip install aiohttp)")
+        self.max_concurrency = max_concurrency
+        self._semaphores = defaultdict(lambda: asyncio.Semaphore(max_concurrency))
+        self._rate_limiter = rate_limiter or acpl_protocol.rate_limiter
+        self._session = None
+        self._warm_up_lock = asyncio.Lock()
+        self._cookies = CookieState()
+
+    async def open(self):
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_concurrency)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=ACPL_TIMEOUT)
+        )
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, url, **kwargs):
+        """Send a request under the per-host concurrency and rate limits"""
+        host = urlsplit(url).hostname
+        async with self._semaphores[host]:
+            await self._rate_limiter.acquire_async()
+            async with self._session.request(method, url, **kwargs) as response:
+                return response.status, await response.text()
+
+    async def _warm_up(self, force=False):
+        async with self._warm_up_lock:
+            if not force and not self._cookies.stale():
+                return
+            logger.info("Accessing ACPL tracking page")
+            status, _ = await self._request('GET', BASE_URL, headers=WARM_UP_HEADERS)
+            if status >= 400:
+                raise aiohttp.ClientError(f"Warm-up request failed with HTTP {status}")
+            self._cookies.fetched()
+
+    async def _post_tracking_number(self, tracking_number):
+        return await self._request('POST', API_URL, data=tracking_form(tracking_number), headers=HEADERS)
+
+    async def fetch_tracking_page(self, tracking_number):
+        """
+        Fetch the tracking HTML fragment for a GC number
+
+        Args:
+            tracking_number (str): The tracking number to look up
+
+        Returns:
+            str: The response body of the tracking API
+        """
+        await self._warm_up()
+        status, text = await self._post_tracking_number(tracking_number)
+
+        if is_rejected(status, text):
+            logger.info("ACPL rejected the tracking request, refreshing session cookies")
+            await self._warm_up(force=True)
+            status, text = await self._post_tracking_number(tracking_number)
+
+        if status >= 400:
+            raise aiohttp.ClientError(f"Tracking request failed with HTTP {status}")
+        return text
+
+    async def track(self, tracking_number):
+        """
+        Track ACPL cargo using the tracking number.
+
+        Args:
+            tracking_number (str): The tracking number to look up
+
+        Returns:
+            dict: The tracking result in the format returned by track_acpl_cargo
+        """
+        try:
+            html = await self.fetch_tracking_page(tracking_number)
+            result = parse_tracking_response(html, tracking_number)
+            capture_response(tracking_number, html, result)
+            return result
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Error tracking ACPL cargo: {str(e)}")
+            return {
+                "success": False,
+                "message": f"Error connecting to ACPL tracking: {str(e)}"
+            }
+        except Exception as e:
+            logger.error(f"Unexpected error tracking ACPL cargo: {str(e)}")
+            return {
+                "success": False,
+                "message": f"Unexpected error: {str(e)}"
+            }
+
+    async def track_many(self, tracking_numbers):
+        """
+        Look up several GC numbers concurrently
+
+        Args:
+            tracking_numbers (list): The GC numbers to look up, duplicates are looked up once
+
+        Yields:
+            tuple: (tracking_number, result) in completion order
+        """
+        unique_numbers = list(dict.fromkeys(n.strip() for n in tracking_numbers if n and n.strip()))
+
+        async def lookup(tracking_number):
+            return tracking_number, await self.track(tracking_number)
+
+        tasks = [asyncio.ensure_future(lookup(n)) for n in unique_numbers]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+_start_lock = threading.Lock()
+_started_pid = None
+_loop = None
+_client = None
+
+
+def enabled():
+    """True when batches are looked up on the shared async client"""
+    return aiohttp is not None and ACPL_ASYNC != 'off'
+
+
+def _shared_client():
+    """Get the event loop thread and client of this process, starting them on first use"""
+    global _started_pid, _loop, _client
+    with _start_lock:
+        # Threads do not survive a fork, so start again in each gunicorn worker
+        if _started_pid != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='acpl-async', daemon=True).start()
+            client = AsyncACPLClient()
+            asyncio.run_coroutine_threadsafe(client.open(), loop).result()
+            _loop, _client, _started_pid = loop, client, os.getpid()
+            logger.info(f"Started async ACPL client in process {os.getpid()}")
+        return _loop, _client
+
+
+def track_acpl_cargo_sync(tracking_number):
+    """Track a single GC number on the shared client, blocking until it is done"""
+    loop, client = _shared_client()
+    return asyncio.run_coroutine_threadsafe(client.track(tracking_number), loop).result()
+
+
+async def track_acpl_cargo_async(tracking_number):
+    """Track a single GC number on the shared client, from any event loop"""
+    loop, client = _shared_client()
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.track(tracking_number), loop))
+
+
+def lookup_many(tracking_numbers):
+    """
+    Look up several GC numbers on the shared client, for synchronous callers
+
+    All lookups of the process share one event loop thread, its concurrency
+    limit and the ACPL rate limit, however many callers there are.
+
+    Args:
+        tracking_numbers (list): The GC numbers to look up, duplicates are looked up once
+
+    Yields:
+        tuple: (tracking_number, result) in completion order
+    """
+    loop, client = _shared_client()
+    unique_numbers = list(dict.fromkeys(n.strip() for n in tracking_numbers if n and n.strip()))
+    futures = {asyncio.run_coroutine_threadsafe(client.track(n), loop): n for n in unique_numbers}
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # Drop lookups that are still waiting if the caller stops early
+        for future in futures:
+            future.cancel()
+
+
+def track_many_async(tracking_numbers):
+    """
+    Look up many GC numbers on the shared client, for synchronous callers
+
+    Args:
+        tracking_numbers (list): The GC numbers to look up
+
+    Returns:
+        dict: tracking_number -> result
+    """
+    return dict(lookup_many(tracking_numbers))
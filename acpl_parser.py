@@ -0,0 +1,277 @@
+import os
+import logging
+from bs4 import BeautifulSoup, NavigableString
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:  # lxml is optional, the BeautifulSoup parser is used without it
+    etree = None
+    lxml_html = None
+
+logger = logging.getLogger(__name__)
+
+# 'auto' uses the single-pass lxml parser when lxml is installed, 'legacy' always uses BeautifulSoup
+ACPL_PARSER = os.environ.get('ACPL_PARSER', 'auto').lower()
+
+# Class names the extraction patterns look for
+INFO_CLASSES = frozenset(['info', 'tracking-info', 'result', 'data-row'])
+LABEL_CLASSES = frozenset(['label', 'title', 'field-name'])
+VALUE_CLASSES = frozenset(['value', 'data', 'field-value'])
+
+
+def parse_tracking_html(html, tracking_number):
+    """
+    Extract key/value tracking fields from an ACPL response with the best available engine
+
+    Args:
+        html (str): The response body of poc.php
+        tracking_number (str): The tracking number that was looked up
+
+    Returns:
+        tuple: (tracking_info dict, page text or None). The page text is only
+        extracted when no fields beyond the GC number were found.
+    """
+    if lxml_html is not None and ACPL_PARSER != 'legacy':
+        return parse_tracking_html_lxml(html, tracking_number)
+    return parse_tracking_html_legacy(html, tracking_number)
+
+
+def parse_tracking_html_legacy(html, tracking_number):
+    """Extract tracking fields with BeautifulSoup, one tree walk per pattern"""
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Initialize tracking info with the GC number
+    tracking_info = {
+        "GC Number": tracking_number
+    }
+
+    # Extract information from the tracking results
+
+    # 1. First check for tables (most common format for shipping info)
+    tables = soup.find_all('table')
+    logger.info("Found %d tables in the response", len(tables))
+
+    if tables:
+        for table in tables:
+            rows = table.find_all('tr')
+            for row in rows:
+                cells = row.find_all(['th', 'td'])
+                if len(cells) >= 2:
+                    key = cells[0].get_text(strip=True)
+                    value = cells[1].get_text(strip=True)
+                    if key and value:
+                        tracking_info[key] = value
+
+    # 2. Look for div elements with shipping information 
+    # ACPL often uses div elements with specific classes
+    info_divs = soup.find_all('div', class_=['info', 'tracking-info', 'result', 'data-row'])
+    for div in info_divs:
+        # Look for nested divs with key-value pairs
+        label_divs = div.find_all(['div', 'span', 'label'], class_=['label', 'title', 'field-name'])
+        for label_div in label_divs:
+            key = label_div.get_text(strip=True)
+            # Get the next sibling which might be the value
+            value_elem = label_div.find_next(['div', 'span', 'p'], class_=['value', 'data', 'field-value'])
+            if value_elem:
+                value = value_elem.get_text(strip=True)
+                if key and value:
+                    tracking_info[key] = value
+
+    # 3. Look for definition lists
+    dls = soup.find_all('dl')
+    for dl in dls:
+        dts = dl.find_all('dt')
+        dds = dl.find_all('dd')
+        for i in range(min(len(dts), len(dds))):
+            key = dts[i].get_text(strip=True)
+            value = dds[i].get_text(strip=True)
+            if key and value:
+                tracking_info[key] = value
+
+    # 4. Check for structured data in paragraphs with strong/bold elements
+    paragraphs = soup.find_all('p')
+    for p in paragraphs:
+        strongs = p.find_all(['strong', 'b'])
+        for strong in strongs:
+            key = strong.get_text(strip=True).rstrip(':')
+            # Get the text right after the strong tag
+            next_node = strong.next_sibling
+            if next_node and isinstance(next_node, NavigableString):
+                value = next_node.strip()
+                if key and value:
+                    tracking_info[key] = value
+
+    if len(tracking_info) > 1:
+        return tracking_info, None
+    return tracking_info, soup.get_text(separator='\n', strip=True)
+
+
+def page_text_legacy(html):
+    """The page text parse_tracking_html_legacy falls back to when it finds no fields"""
+    return BeautifulSoup(html, 'html.parser').get_text(separator='\n', strip=True)
+
+
+# Text nodes BeautifulSoup's get_text keeps: not those of scripts and
+# stylesheets (comments are not text nodes in lxml). The tree itself is left
+# as it is, so the text following such a node stays where it is.
+_VISIBLE_TEXT = 'text()[not(ancestor::script or ancestor::style)]'
+
+
+def _lxml_root(html):
+    return lxml_html.fromstring(html)
+
+
+def _lxml_page_text(root):
+    return '\n'.join(t.strip() for t in root.xpath('//' + _VISIBLE_TEXT) if t.strip())
+
+
+def page_text_lxml(html):
+    """The page text parse_tracking_html_lxml falls back to when it finds no fields"""
+    if not html.strip():
+        return ''
+    return _lxml_page_text(_lxml_root(html))
+
+
+def _text(element):
+    """Equivalent of BeautifulSoup's get_text(strip=True) for an lxml element"""
+    return ''.join(text.strip() for text in element.xpath('.//' + _VISIBLE_TEXT))
+
+
+def _next_string(element):
+    """
+    The text of an element's next sibling if BeautifulSoup's next_sibling
+    would be a NavigableString there, else None
+
+    That is the text right after the element, or a comment directly after it
+    (Comment is a NavigableString too); an element such as a script is not.
+    """
+    if element.tail:
+        return element.tail
+    sibling = element.getnext()
+    if sibling is not None and sibling.tag is etree.Comment:
+        return sibling.text or ''
+    return None
+
+
+def parse_tracking_html_lxml(html, tracking_number):
+    """
+    Extract tracking fields with lxml in a single walk over the tree.
+
+    The four patterns of the legacy parser (table rows, labelled values in info
+    divs, definition lists and bold labels in paragraphs) are collected in one
+    pass and then merged in the same order the legacy parser applies them, so
+    both produce the same fields.
+    """
+    if not html.strip():
+        return {"GC Number": tracking_number}, ''
+    root = _lxml_root(html)
+
+    tables = []         # per <table>: its rows, each a list of cells
+    info_divs = []      # per info div: its label records [label, value element]
+    dls = []            # per <dl>: ([dt elements], [dd elements])
+    paragraphs = []     # per <p>: its strong/b elements
+    open_tables, open_rows, open_info_divs, open_dls, open_paragraphs = [], [], [], [], []
+    pending_labels = []  # labels still waiting for the next value element
+
+    for event, element in etree.iterwalk(root, events=('start', 'end')):
+        tag = element.tag
+        if not isinstance(tag, str):
+            continue  # comments and processing instructions
+
+        if event == 'end':
+            for stack in (open_tables, open_rows, open_info_divs, open_dls, open_paragraphs):
+                if stack and stack[-1][0] is element:
+                    stack.pop()
+            continue
+
+        # Tables: every row of every (possibly nested) table, with all its cells
+        if tag == 'table':
+            rows = []
+            tables.append(rows)
+            open_tables.append((element, rows))
+        elif tag == 'tr':
+            cells = []
+            for _, rows in open_tables:
+                rows.append(cells)
+            open_rows.append((element, cells))
+        elif tag in ('th', 'td'):
+            for _, cells in open_rows:
+                cells.append(element)
+
+        # Info divs: a label's value is the next value element anywhere after it
+        class_attr = element.get('class')
+        if class_attr:
+            classes = set(class_attr.split())
+            if tag in ('div', 'span', 'p') and classes & VALUE_CLASSES:
+                for record in pending_labels:
+                    record[1] = element
+                pending_labels = []
+            if tag in ('div', 'span', 'label') and classes & LABEL_CLASSES and open_info_divs:
+                record = [element, None]
+                for _, labels in open_info_divs:
+                    labels.append(record)
+                pending_labels.append(record)
+            if tag == 'div' and classes & INFO_CLASSES:
+                labels = []
+                info_divs.append(labels)
+                open_info_divs.append((element, labels))
+
+        # Definition lists
+        if tag == 'dl':
+            terms = ([], [])
+            dls.append(terms)
+            open_dls.append((element, terms))
+        elif tag == 'dt':
+            for _, terms in open_dls:
+                terms[0].append(element)
+        elif tag == 'dd':
+            for _, terms in open_dls:
+                terms[1].append(element)
+
+        # Paragraphs with bold labels
+        if tag == 'p':
+            strongs = []
+            paragraphs.append(strongs)
+            open_paragraphs.append((element, strongs))
+        elif tag in ('strong', 'b'):
+            for _, strongs in open_paragraphs:
+                strongs.append(element)
+
+    tracking_info = {
+        "GC Number": tracking_number
+    }
+
+    for rows in tables:
+        for cells in rows:
+            if len(cells) >= 2:
+                key = _text(cells[0])
+                value = _text(cells[1])
+                if key and value:
+                    tracking_info[key] = value
+
+    for labels in info_divs:
+        for label, value_element in labels:
+            if value_element is not None:
+                key = _text(label)
+                value = _text(value_element)
+                if key and value:
+                    tracking_info[key] = value
+
+    for terms, descriptions in dls:
+        for term, description in zip(terms, descriptions):
+            key = _text(term)
+            value = _text(description)
+            if key and value:
+                tracking_info[key] = value
+
+    for strongs in paragraphs:
+        for strong in strongs:
+            key = _text(strong).rstrip(':')
+            value = (_next_string(strong) or '').strip()
+            if key and value:
+                tracking_info[key] = value
+
+    if len(tracking_info) > 1:
+        return tracking_info, None
+    return tracking_info, _lxml_page_text(root)
@@ -0,0 +1,70 @@
+import os
+import time
+from rate_limit import TokenBucket
+
+# How a GC number is looked up on acplcargo.com, shared by the blocking
+# session (acpl_tracker.py) and the async client (acpl_async.py)
+
+BASE_URL = "https://acplcargo.com/GCTRACKING.php"
+API_URL = "https://acplcargo.com/poc.php"  # This is the API endpoint called by searchGC() function
+
+# Seconds the cookies from the warm-up GET are reused before fetching them again
+ACPL_COOKIE_TTL = int(os.environ.get('ACPL_COOKIE_TTL', 900))
+ACPL_TIMEOUT = float(os.environ.get('ACPL_TIMEOUT', 15))
+# Requests per second sent to acplcargo.com per process, with bursts of up to ACPL_BURST
+# (by the blocking session and the async client together)
+ACPL_RATE_LIMIT = float(os.environ.get('ACPL_RATE_LIMIT', 5))
+ACPL_BURST = int(os.environ.get('ACPL_BURST', 10))
+# Requests in flight to acplcargo.com at once (used by the async client)
+ACPL_MAX_CONCURRENCY = int(os.environ.get('ACPL_MAX_CONCURRENCY', 5))
+
+# Headers to simulate a browser request
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
+    'Origin': 'https://acplcargo.com',
+    'Referer': BASE_URL,
+    'X-Requested-With': 'XMLHttpRequest',  # This indicates it's an AJAX request
+    'Content-Type': 'application/x-www-form-urlencoded'
+}
+# Headers of the warm-up GET of the tracking page
+WARM_UP_HEADERS = {'User-Agent': HEADERS['User-Agent']}
+
+# Status codes that mean the POST was rejected because the session cookies are missing or stale
+REJECTED_STATUS_CODES = (401, 403, 419, 440)
+
+rate_limiter = TokenBucket(ACPL_RATE_LIMIT, ACPL_BURST)
+
+
+def tracking_form(tracking_number):
+    """Form data of the tracking POST, as sent by the page's searchGC() function"""
+    # The correct parameter is 'gcnumber' based on the form and JavaScript code
+    return {
+        'gcnumber': tracking_number,  # This matches the form field id="gcnumber"
+        'etransGCNumber': '',         # These additional parameters are in the JavaScript
+        'mode': ''
+    }
+
+
+def is_rejected(status, text):
+    """True if the tracking POST needs fresh session cookies and one more try"""
+    return status in REJECTED_STATUS_CODES or not text.strip()
+
+
+class CookieState:
+    """
+    When the session cookies were fetched by the warm-up GET
+
+    Callers hold their own (thread or asyncio) lock around the check and the
+    warm-up.
+    """
+
+    def __init__(self, ttl=ACPL_COOKIE_TTL):
+        self.ttl = ttl
+        self.fetched_at = 0.0
+
+    def stale(self, cookie_expired=False):
+        """True if the warm-up GET has to run before the next POST"""
+        return cookie_expired or not self.fetched_at or time.monotonic() - self.fetched_at > self.ttl
+
+    def fetched(self):
+        self.fetched_at = time.monotonic()
@@ -1,158 +1,186 @@
+import os
 import logging
+import threading
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from acpl_parser import parse_tracking_html
+from shipment import Shipment
+from response_capture import capture_response
+from acpl_protocol import (
+    BASE_URL, API_URL, HEADERS, WARM_UP_HEADERS, ACPL_TIMEOUT, CookieState,
+    rate_limiter, tracking_form, is_rejected
+)
 
 logger = logging.getLogger(__name__)
 
+# Keep-alive connections kept open to acplcargo.com per process
+ACPL_POOL_SIZE = int(os.environ.get('ACPL_POOL_SIZE', 10))
+
+_session = None
+_session_lock = threading.Lock()
+_warm_up_lock = threading.Lock()
+_cookies = CookieState()
+
+
+def _get_session():
+    """Get the shared keep-alive session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=ACPL_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def _warm_up(session, force=False):
+    """
+    Load the tracking page to obtain session cookies, unless the current ones are still fresh
+
+    Args:
+        session (requests.Session): The shared session
+        force (bool): Fetch new cookies even if the current ones look fresh
+    """
+    with _warm_up_lock:
+        if not force and not _cookies.stale(any(cookie.is_expired() for cookie in session.cookies)):
+            return
+        logger.info("Accessing ACPL tracking page")
+        rate_limiter.acquire()
+        initial_response = session.get(BASE_URL, headers=WARM_UP_HEADERS, timeout=ACPL_TIMEOUT)
+        initial_response.raise_for_status()
+        _cookies.fetched()
+
+
+def _post_tracking_number(session, tracking_number):
+    # Submit the tracking request to the API (simulating the searchGC() function)
+    logger.info("Sending AJAX request to %s", API_URL)
+    rate_limiter.acquire()
+    return session.post(API_URL, data=tracking_form(tracking_number), headers=HEADERS, timeout=ACPL_TIMEOUT)
+
+
+def fetch_tracking_page(tracking_number):
+    """
+    Fetch the tracking HTML fragment for a GC number over the shared keep-alive session.
+
+    The warm-up GET of the tracking page only happens when the cookies are stale,
+    or once more when the POST is rejected.
+
+    Args:
+        tracking_number (str): The tracking number to look up
+
+    Returns:
+        requests.Response: The successful response of the tracking API
+    """
+    session = _get_session()
+    _warm_up(session)
+
+    logger.info("Submitting tracking number: %s", tracking_number)
+    response = _post_tracking_number(session, tracking_number)
+
+    if is_rejected(response.status_code, response.text):
+        logger.info("ACPL rejected the tracking request, refreshing session cookies")
+        _warm_up(session, force=True)
+        response = _post_tracking_number(session, tracking_number)
+
+    response.raise_for_status()
+    return response
+
+
+def parse_tracking_numbers(text):
+    """
+    Split a list of GC numbers separated by spaces and/or commas.
+
+    Args:
+        text (str): The text after the TRACK keyword, e.g. "123, 456 789"
+
+    Returns:
+        list: The unique tracking numbers in the order they were given
+    """
+    numbers = text.replace(',', ' ').split()
+    return list(dict.fromkeys(numbers))
+
+
+def parse_tracking_response(html, tracking_number):
+    """
+    Parse the HTML fragment returned by the ACPL tracking API.
+    
+    Args:
+        html (str): The response body of poc.php
+        tracking_number (str): The tracking number that was looked up
+        
+    Returns:
+        dict: A dictionary containing the tracking information or error message.
+        Structured results also include the parsed Shipment under "shipment".
+    """
+    # Check if tracking info is found
+    if "No Tracking Information available" in html or "No Record Found" in html:
+        return {
+            "success": False,
+            "message": f"No tracking information found for number {tracking_number}",
+            "not_found": True
+        }
+
+    # Parse the result HTML (this will be the HTML fragment returned by the API)
+    logger.info("Parsing tracking results")
+    tracking_info, page_content = parse_tracking_html(html, tracking_number)
+
+    # If we found tracking data beyond just the GC number, return it
+    if len(tracking_info) > 1:
+        logger.debug("Extracted tracking data: %s", tracking_info)
+        return {
+            "success": True,
+            "message": "Tracking information retrieved",
+            "tracking_data": tracking_info,
+            "shipment": Shipment.from_tracking_data(tracking_info)
+        }
+
+    # If we couldn't find structured data, return the raw content
+    logger.info("No structured tracking data found, returning raw content")
+
+    # Check if the raw content actually has some useful information
+    if len(page_content.strip()) > 20:  # Arbitrary length to ensure it's not just whitespace or a tiny error
+        return {
+            "success": True,
+            "message": "Retrieved tracking information as text",
+            "raw_content": page_content
+        }
+    else:
+        return {
+            "success": False,
+            "message": f"No tracking information found for number {tracking_number}",
+            "not_found": True
+        }
+
+
 def track_acpl_cargo(tracking_number):
     """
     Track ACPL cargo using the tracking number.
     
+    Runs on the process's shared async client when it is enabled, and over
+    the blocking keep-alive session otherwise.
+    
     Args:
         tracking_number (str): The tracking number to look up
         
     Returns:
         dict: A dictionary containing the tracking information or error message
     """
-    # Step 1: Go to the ACPL tracking page
-    base_url = "https://acplcargo.com/GCTRACKING.php"
-    api_url = "https://acplcargo.com/poc.php"  # This is the API endpoint called by searchGC() function
+    import acpl_async
+    if acpl_async.enabled():
+        return acpl_async.track_acpl_cargo_sync(tracking_number)
     
     try:
-        # Create a session to maintain cookies
-        session = requests.Session()
-        
-        # First, let's get the initial page to simulate browser behavior
-        logger.info("Accessing ACPL tracking page")
-        initial_response = session.get(base_url)
-        initial_response.raise_for_status()
-        
-        # Now, submit the tracking number directly to the API endpoint that's used by searchGC()
-        logger.info(f"Submitting tracking number: {tracking_number}")
-        
-        # The correct parameter is 'gcnumber' based on the form and JavaScript code
-        payload = {
-            'gcnumber': tracking_number,  # This matches the form field id="gcnumber"
-            'etransGCNumber': '',         # These additional parameters are in the JavaScript
-            'mode': ''
-        }
-        
-        # Headers to simulate a browser request
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36',
-            'Origin': 'https://acplcargo.com',
-            'Referer': base_url,
-            'X-Requested-With': 'XMLHttpRequest',  # This indicates it's an AJAX request
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        
-        # Submit the tracking request to the API (simulating the searchGC() function)
-        logger.info(f"Sending AJAX request to {api_url}")
-        response = session.post(api_url, data=payload, headers=headers)
-        response.raise_for_status()
-        
-        # Save the response for debugging
-        with open('tracking_response.html', 'w') as f:
-            f.write(response.text)
-        logger.info("Saved tracking response to tracking_response.html")
+        response = fetch_tracking_page(tracking_number)
         
-        # Check if tracking info is found
-        if "No Tracking Information available" in response.text or "No Record Found" in response.text:
-            return {
-                "success": False,
-                "message": f"No tracking information found for number {tracking_number}"
-            }
-        
-        # Parse the result HTML (this will be the HTML fragment returned by the API)
-        logger.info("Parsing tracking results")
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Initialize tracking info with the GC number
-        tracking_info = {
-            "GC Number": tracking_number
-        }
+        result = parse_tracking_response(response.text, tracking_number)
         
-        # Extract information from the tracking results
+        # Keep the raw response for diagnosing parser breakages (opt-in and sampled)
+        capture_response(tracking_number, response.text, result)
         
-        # 1. First check for tables (most common format for shipping info)
-        tables = soup.find_all('table')
-        logger.info(f"Found {len(tables)} tables in the response")
-        
-        if tables:
-            for table in tables:
-                rows = table.find_all('tr')
-                for row in rows:
-                    cells = row.find_all(['th', 'td'])
-                    if len(cells) >= 2:
-                        key = cells[0].get_text(strip=True)
-                        value = cells[1].get_text(strip=True)
-                        if key and value:
-                            tracking_info[key] = value
-        
-        # 2. Look for div elements with shipping information 
-        # ACPL often uses div elements with specific classes
-        info_divs = soup.find_all('div', class_=['info', 'tracking-info', 'result', 'data-row'])
-        for div in info_divs:
-            # Look for nested divs with key-value pairs
-            label_divs = div.find_all(['div', 'span', 'label'], class_=['label', 'title', 'field-name'])
-            for label_div in label_divs:
-                key = label_div.get_text(strip=True)
-                # Get the next sibling which might be the value
-                value_elem = label_div.find_next(['div', 'span', 'p'], class_=['value', 'data', 'field-value'])
-                if value_elem:
-                    value = value_elem.get_text(strip=True)
-                    if key and value:
-                        tracking_info[key] = value
-        
-        # 3. Look for definition lists
-        dls = soup.find_all('dl')
-        for dl in dls:
-            dts = dl.find_all('dt')
-            dds = dl.find_all('dd')
-            for i in range(min(len(dts), len(dds))):
-                key = dts[i].get_text(strip=True)
-                value = dds[i].get_text(strip=True)
-                if key and value:
-                    tracking_info[key] = value
-        
-        # 4. Check for structured data in paragraphs with strong/bold elements
-        paragraphs = soup.find_all('p')
-        for p in paragraphs:
-            strongs = p.find_all(['strong', 'b'])
-            for strong in strongs:
-                key = strong.get_text(strip=True).rstrip(':')
-                # Get the text right after the strong tag
-                next_node = strong.next_sibling
-                if next_node and hasattr(next_node, 'strip'):
-                    value = next_node.strip()
-                    if key and value:
-                        tracking_info[key] = value
-        
-        # If we found tracking data beyond just the GC number, return it
-        if len(tracking_info) > 1:
-            logger.info(f"Successfully extracted tracking data: {tracking_info}")
-            return {
-                "success": True,
-                "message": "Tracking information retrieved",
-                "tracking_data": tracking_info
-            }
-        
-        # If we couldn't find structured data, return the raw content
-        logger.info("No structured tracking data found, returning raw content")
-        page_content = soup.get_text(separator='\n', strip=True)
-        
-        # Check if the raw content actually has some useful information
-        if len(page_content.strip()) > 20:  # Arbitrary length to ensure it's not just whitespace or a tiny error
-            return {
-                "success": True,
-                "message": "Retrieved tracking information as text",
-                "raw_content": page_content
-            }
-        else:
-            return {
-                "success": False,
-                "message": f"No tracking information found for number {tracking_number}"
-            }
+        return result
         
     except requests.exceptions.RequestException as e:
         logger.error(f"Error tracking ACPL cargo: {str(e)}")
@@ -181,153 +209,29 @@ def format_tracking_result(result):
         return f"❌ *Tracking Error*: {result.get('message', 'Unknown error')}"
     
     if "tracking_data" in result and result["tracking_data"]:
-        # Format structured data
-        message = "📦 *ACPL Cargo Tracking Information*\n\n"
-        
-        # Process the tracking data for better formatting
-        tracking_data = result["tracking_data"]
-        
-        # Extract and display the GC Number first
-        gc_number = tracking_data.get("GC Number", tracking_data.get("GCNumber", "Unknown"))
-        message += f"*Tracking Number*: {gc_number}\n"
-        
-        # Extract booking/sent date if available
-        booking_date = None
-        for key, value in tracking_data.items():
-            if key.lower() in ["booking date", "sent date", "date of booking"] or (
-                isinstance(key, str) and key.isdigit() and isinstance(value, str) and 
-                ("/" in value or "-" in value)
-            ):
-                booking_date = value
-                message += f"*Booking Date*: {value}\n"
-                break
+        # Results from track_acpl_cargo carry the parsed shipment; build it for older cached results
+        shipment = result.get("shipment") or Shipment.from_tracking_data(result["tracking_data"])
         
-        # Extract current location if available
-        current_location = None
-        # First check for explicitly labeled current location
-        location_keys = ["current location", "location", "present location", "last scan"]
-        for key, value in tracking_data.items():
-            if isinstance(key, str) and any(loc_key in key.lower() for loc_key in location_keys):
-                current_location = value
-                message += f"*Current Location*: {value}\n"
-                break
-                
-        # If no explicit location found, use the most recent date's location
-        if not current_location:
-            date_locations = []
-            for key, value in tracking_data.items():
-                if isinstance(key, str) and ("/" in key or "-" in key):
-                    # Parse the date format (DD/MM/YYYY or YYYY-MM-DD)
-                    try:
-                        if "/" in key:
-                            day, month, year = map(int, key.split("/"))
-                            date_key = f"{year:04d}{month:02d}{day:02d}"  # Convert to sortable string YYYYMMDD
-                        elif "-" in key:
-                            year, month, day = map(int, key.split("-"))
-                            date_key = f"{year:04d}{month:02d}{day:02d}"
-                        else:
-                            date_key = key
-                        date_locations.append((date_key, key, value))
-                    except:
-                        # If date parsing fails, just use the original string
-                        date_locations.append(("0", key, value))
-            
-            # Sort dates in descending order (newest first)
-            date_locations.sort(reverse=True)
-            if date_locations:
-                # Use the newest date's location
-                _, newest_date, location = date_locations[0]
-                current_location = location
-                message += f"*Current Location*: {location} (as of {newest_date})\n"
-            
-        message += "\n*Shipment Movement*:\n"
-        
-        # Organize movement history by dates (newest first) using robust date parsing
-        movement_history = []
-        
-        for key, value in tracking_data.items():
-            # Skip the items we've already processed
-            if key == "GC Number" or key == "GCNumber" or value == booking_date or value == current_location:
-                continue
-                
-            # Check if key is a date (contains / or -) or value is a location
-            if isinstance(key, str) and ("/" in key or "-" in key):
-                # Parse the date for proper sorting
-                try:
-                    if "/" in key:
-                        day, month, year = map(int, key.split("/"))
-                        date_key = f"{year:04d}{month:02d}{day:02d}"  # Convert to sortable string YYYYMMDD
-                    elif "-" in key:
-                        year, month, day = map(int, key.split("-"))
-                        date_key = f"{year:04d}{month:02d}{day:02d}"
-                    else:
-                        date_key = "0"  # Default for non-parseable dates
-                    
-                    movement_history.append((date_key, key, value))
-                except:
-                    # If date parsing fails, just use a default sort key
-                    movement_history.append(("0", key, value))
-            elif isinstance(value, str) and ("/" in value or "-" in value):
-                # If value is a date, swap them for consistency
-                try:
-                    if "/" in value:
-                        day, month, year = map(int, value.split("/"))
-                        date_key = f"{year:04d}{month:02d}{day:02d}"
-                    elif "-" in value:
-                        year, month, day = map(int, value.split("-"))
-                        date_key = f"{year:04d}{month:02d}{day:02d}"
-                    else:
-                        date_key = "0"
-                        
-                    movement_history.append((date_key, value, key))
-                except:
-                    movement_history.append(("0", value, key))
+        # Format structured data
+        lines = ["📦 *ACPL Cargo Tracking Information*\n", f"*Tracking Number*: {shipment.gc_number}"]
         
-        # Sort movement history by parsed date (newest first)
-        movement_history.sort(reverse=True)
-            
-        # Add movement history to the message
-        for entry in movement_history:
-            # Each entry is now (sort_key, date_string, location)
-            _, date_string, location = entry
-            message += f"📅 *{date_string}*: {location}\n"
+        if shipment.booking_date is not None:
+            lines.append(f"*Booking Date*: {shipment.booking_date}")
         
-        # Add any remaining fields that haven't been included yet
-        remaining_fields = []
+        if shipment.current_location_as_of is not None:
+            lines.append(f"*Current Location*: {shipment.current_location} (as of {shipment.current_location_as_of})")
+        elif shipment.current_location is not None:
+            lines.append(f"*Current Location*: {shipment.current_location}")
         
-        # Create sets of keys and values that are already part of movement history
-        movement_history_dates = {entry[1] for entry in movement_history}
-        movement_history_locations = {entry[2] for entry in movement_history}
+        # Movement history, newest first
+        lines.append("\n*Shipment Movement*:")
+        lines.extend(f"📅 *{event.date}*: {event.location}" for event in shipment.movements)
         
-        for key, value in tracking_data.items():
-            # Skip fields we've already processed or that don't provide additional value
-            if key in ["GC Number", "GCNumber", "GC No", "Date", gc_number]:
-                continue
-                
-            # Skip if this key is a date we've already processed 
-            if key in movement_history_dates:
-                continue
-                
-            # Skip if this value is a location we've already processed
-            if value in movement_history_locations:
-                continue
-            
-            # Skip if this is the current location we already displayed
-            if value == current_location:
-                continue
-                
-            # Skip if this is the booking date we already displayed
-            if value == booking_date:
-                continue
-                
-            remaining_fields.append((key, value))
+        if shipment.extra_fields:
+            lines.append("\n*Additional Information*:")
+            lines.extend(f"• *{key}*: {value}" for key, value in shipment.extra_fields)
         
-        if remaining_fields:
-            message += "\n*Additional Information*:\n"
-            for key, value in remaining_fields:
-                message += f"• *{key}*: {value}\n"
-        
-        return message
+        return "\n".join(lines) + "\n"
     
     elif "raw_content" in result and result["raw_content"]:
         # Format raw text data
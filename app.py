@@ -5,9 +5,10 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from log_config import configure_logging
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (LOG_LEVEL, LOG_FORMAT, ...; see log_config.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 class Base(DeclarativeBase):
@@ -37,6 +38,12 @@ with app.app_context():
 
     db.create_all()
     logger.info("Database tables created")
+
+    # Bring tables that already existed up to date
+    from migrations import run_migrations
+    applied = run_migrations()
+    if applied:
+        logger.info(f"Applied {applied} database migrations")
     
     # Create default automations if they don't exist
     if Automation.query.filter_by(trigger_type='keyword', trigger_value='help').count() == 0:
@@ -49,6 +56,8 @@ with app.app_context():
                 "Here are commands you can use:\n\n"
                 "*TRACK <number>* - Track an ACPL cargo shipment\n"
                 "Example: TRACK 1234567890\n\n"
+                "*SUBSCRIBE <number>* - Get a message whenever the shipment moves\n"
+                "*UNSUBSCRIBE <number>* - Stop shipment updates\n\n"
                 "*HELP* - Show this help message\n\n"
                 "Need more assistance? Contact support."
             ),
@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from sqlalchemy import select
+from app import db
+from models import Automation, CacheVersion
+from db_utils import upsert_insert
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks whether another worker changed the automations
+AUTOMATION_INDEX_CHECK_SECONDS = float(os.environ.get('AUTOMATION_INDEX_CHECK_SECONDS', 5))
+
+VERSION_NAME = 'automations'
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton that finds all keywords occurring in a text in one pass"""
+
+    def __init__(self, keywords):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+
+        for index, keyword in enumerate(keywords):
+            node = 0
+            for char in keyword:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                node = next_node
+            # An empty keyword ends at the root and matches every text
+            self._output[node].add(index)
+
+        # Breadth-first pass to link each node to its longest proper suffix in the trie
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] |= self._output[self._fail[child]]
+
+    def find(self, text):
+        """
+        Find which keywords occur in a text
+
+        Returns:
+            set: Indexes of the matching keywords
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set(output[0])
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found |= output[node]
+        return found
+
+
+class AutomationEntry:
+    __slots__ = ('id', 'name', 'response_text')
+
+    def __init__(self, automation):
+        self.id = automation.id
+        self.name = automation.name
+        self.response_text = automation.response_text
+
+
+class AutomationIndex:
+    """Active keyword automations compiled into a single keyword matcher"""
+
+    def __init__(self, automations, version):
+        self.version = version
+        self.entries = [AutomationEntry(a) for a in automations]
+        keywords = []
+        self._keyword_entries = []  # keyword index -> entry index
+        for entry_index, automation in enumerate(automations):
+            if automation.trigger_value is None:
+                continue
+            for keyword in automation.trigger_value.split(','):
+                keywords.append(keyword.strip().lower())
+                self._keyword_entries.append(entry_index)
+        self._matcher = KeywordMatcher(keywords)
+
+    def match(self, text):
+        """
+        Get the automations triggered by a message
+
+        Args:
+            text (str): The message content
+
+        Returns:
+            list: AutomationEntry objects in automation id order
+        """
+        hits = {self._keyword_entries[k] for k in self._matcher.find(text.lower())}
+        return [self.entries[i] for i in sorted(hits)]
+
+
+_index = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _current_version():
+    version = db.session.execute(
+        select(CacheVersion.version).where(CacheVersion.name == VERSION_NAME)
+    ).scalar()
+    return version or 0
+
+
+def _build(version):
+    automations = Automation.query.filter_by(
+        trigger_type='keyword',
+        is_active=True
+    ).order_by(Automation.id).all()
+    logger.info(f"Built automation index with {len(automations)} keyword automations (version {version})")
+    return AutomationIndex(automations, version)
+
+
+def get_index():
+    """
+    Get the automation index, rebuilding it when the automations changed.
+
+    The shared version counter is read at most every AUTOMATION_INDEX_CHECK_SECONDS,
+    so changes made through another worker show up after that delay.
+    """
+    global _index, _checked_at
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < AUTOMATION_INDEX_CHECK_SECONDS:
+        return _index
+
+    with _lock:
+        if _index is None or now - _checked_at >= AUTOMATION_INDEX_CHECK_SECONDS:
+            version = _current_version()
+            if _index is None or _index.version != version:
+                _index = _build(version)
+            _checked_at = now
+    return _index
+
+
+def match_automations(message_content):
+    """Get the keyword automations triggered by a message"""
+    return get_index().match(message_content)
+
+
+def invalidate():
+    """
+    Record that the automations changed: bumps the shared version counter so all
+    workers rebuild their index, and drops this worker's index right away.
+    """
+    global _index
+    stmt = upsert_insert(CacheVersion).values(name=VERSION_NAME, version=1)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CacheVersion.name],
+        set_={'version': CacheVersion.version + 1}
+    )
+    db.session.execute(stmt)
+    db.session.commit()
+    with _lock:
+        _index = None
@@ -0,0 +1,178 @@
+"""
+Benchmark the hot Message/Contact queries before and after the index migrations.
+
+Fills a scratch database with a synthetic message history, then runs each query
+without the indexes, applies the migrations and runs it again, printing the
+query plan and the mean time of both runs.
+
+Usage:
+    python benchmarks/bench_message_queries.py [--rows N] [--contacts N] [--repeat N] [--database-url URL]
+
+The default is a 1M message SQLite file in a temporary directory; use
+--rows 10000000 for the full-size run. --database-url points the benchmark at
+an empty PostgreSQL database instead (its tables are dropped and recreated).
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INDEXES = [
+    'uq_contact_phone_number',
+    'uq_message_stats_date',
+    'ix_message_timestamp_direction',
+    'ix_message_contact_id_timestamp',
+]
+
+DAYS = 365
+END = datetime(2025, 6, 1)
+START = END - timedelta(days=DAYS)
+
+
+def queries(contacts):
+    day = END - timedelta(days=30)
+    # Parameters are passed as strings, which both SQLite and PostgreSQL compare as timestamps/dates
+    return [
+        # process_incoming_message: find the sender
+        ('contact by phone number',
+         "SELECT id FROM contact WHERE phone_number = :phone",
+         {'phone': phone_number(contacts // 2)}),
+        # /messages and /api/messages
+        ('latest messages',
+         "SELECT id FROM message ORDER BY timestamp DESC LIMIT 50",
+         {}),
+        # dashboard chart, one day and direction as a timestamp range
+        ('messages per day and direction',
+         "SELECT count(*) FROM message WHERE timestamp >= :start AND timestamp < :end AND direction = :direction",
+         {'start': str(day), 'end': str(day + timedelta(days=1)), 'direction': 'incoming'}),
+        # the same filter written with date(), which no index can serve
+        ('messages per day and direction (date())',
+         "SELECT count(*) FROM message WHERE date(timestamp) = :day AND direction = :direction",
+         {'day': str(day.date()), 'direction': 'incoming'}),
+        # a contact's conversation
+        ('contact conversation',
+         "SELECT id FROM message WHERE contact_id = :contact_id ORDER BY timestamp DESC LIMIT 50",
+         {'contact_id': contacts // 2}),
+        # update_stats
+        ('message stats by date',
+         "SELECT id FROM message_stats WHERE date = :day",
+         {'day': str(day.date())}),
+    ]
+
+
+def phone_number(i):
+    return f"+9190{i:08d}"
+
+
+def populate(db, rows, contacts, batch=50000):
+    from models import Contact, Message, MessageStats
+
+    db.session.execute(Contact.__table__.insert(), [
+        {'id': i, 'phone_number': phone_number(i), 'first_interaction': START, 'last_interaction': END}
+        for i in range(1, contacts + 1)
+    ])
+    db.session.execute(MessageStats.__table__.insert(), [
+        {'date': (START + timedelta(days=d)).date(), 'messages_received': 0, 'messages_sent': 0, 'unique_contacts': 0}
+        for d in range(DAYS)
+    ])
+
+    rng = random.Random(42)
+    span = int((END - START).total_seconds())
+    for offset in range(0, rows, batch):
+        db.session.execute(Message.__table__.insert(), [
+            {
+                'contact_id': rng.randint(1, contacts),
+                'content': 'TRACK 2504500644',
+                'timestamp': START + timedelta(seconds=rng.randrange(span)),
+                'direction': 'incoming' if i % 2 else 'outgoing',
+                'message_type': 'text',
+                'status': 'received' if i % 2 else 'sent',
+            }
+            for i in range(offset, min(offset + batch, rows))
+        ])
+        db.session.commit()
+        print(f"\r  {min(offset + batch, rows):,} / {rows:,} messages", end='', flush=True)
+    print()
+
+
+def explain(db, sql, params):
+    from sqlalchemy import text
+    from db_utils import is_postgres
+
+    prefix = 'EXPLAIN' if is_postgres() else 'EXPLAIN QUERY PLAN'
+    rows = db.session.execute(text(f"{prefix} {sql}"), params).all()
+    # SQLite returns (id, parent, notused, detail), PostgreSQL one line per row
+    return [row[-1] for row in rows]
+
+
+def run(db, sql, params, repeat):
+    from sqlalchemy import text
+
+    statement = text(sql)
+    db.session.execute(statement, params).all()  # warm up the cache
+    start = time.perf_counter()
+    for _ in range(repeat):
+        db.session.execute(statement, params).all()
+    return (time.perf_counter() - start) / repeat
+
+
+def measure(db, contacts, repeat):
+    results = {}
+    for name, sql, params in queries(contacts):
+        results[name] = (explain(db, sql, params), run(db, sql, params, repeat))
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rows', type=int, default=1000000, help='synthetic messages')
+    arg_parser.add_argument('--contacts', type=int, default=20000, help='synthetic contacts')
+    arg_parser.add_argument('--repeat', type=int, default=20, help='runs per query and phase')
+    arg_parser.add_argument('--database-url', help='scratch database (default: temporary SQLite file)')
+    args = arg_parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    from sqlalchemy import text
+    from app import app, db
+    from models import SchemaMigration
+    from migrations import run_migrations
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # Start from the schema before the index migrations
+        for index in INDEXES:
+            db.session.execute(text(f"DROP INDEX IF EXISTS {index}"))
+        db.session.execute(SchemaMigration.__table__.delete())
+        db.session.commit()
+
+        print(f"Loading {args.rows:,} messages for {args.contacts:,} contacts into {db.engine.url.render_as_string()}")
+        populate(db, args.rows, args.contacts)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+
+        before = measure(db, args.contacts, args.repeat)
+        start = time.perf_counter()
+        run_migrations()
+        print(f"Migrations applied in {time.perf_counter() - start:.1f}s")
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        after = measure(db, args.contacts, args.repeat)
+
+    for name, (plan_before, time_before) in before.items():
+        plan_after, time_after = after[name]
+        print(f"\n{name}: {time_before * 1000:.3f} ms -> {time_after * 1000:.3f} ms "
+              f"({time_before / time_after:.1f}x)")
+        print("  before: " + "\n          ".join(plan_before))
+        print("  after:  " + "\n          ".join(plan_after))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
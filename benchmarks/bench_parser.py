@@ -0,0 +1,107 @@
+"""
+Benchmark the ACPL tracking HTML parsers.
+
+Compares the legacy BeautifulSoup parser with the single-pass lxml parser on a
+corpus of saved ACPL responses: parse time per response and whether both
+engines extract exactly the same fields and the same fallback page text.
+
+Usage:
+    python benchmarks/bench_parser.py [FILE_OR_DIR ...] [--repeat N] [--synthetic-rows N]
+
+Files may be plain .html or gzip-compressed .html.gz (the format written by
+ACPL_CAPTURE_ARCHIVE_DIR). Without arguments, tracking_response.html from the
+repository root is used.
+"""
+import os
+import sys
+import gzip
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acpl_parser import (  # noqa: E402
+    parse_tracking_html_legacy, parse_tracking_html_lxml, page_text_legacy, page_text_lxml, lxml_html
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_corpus(paths):
+    corpus = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(('.html', '.html.gz')))
+        else:
+            files = [path]
+        for filename in files:
+            opener = gzip.open if filename.endswith('.gz') else open
+            with opener(filename, 'rt', encoding='utf-8') as f:
+                corpus.append((os.path.basename(filename), f.read()))
+    return corpus
+
+
+def synthetic_response(rows):
+    """A large response in the ACPL layout with `rows` dispatch rows"""
+    body = ''.join(
+        f"<tr><td>{(i % 28) + 1:02d}/05/2025</td><td>HUB {i}</td><td>Arrived</td></tr>"
+        for i in range(rows)
+    )
+    return (
+        '<style>.table { width: 100%; }</style><script>window.dataLayer = [];</script>'
+        '<div class="table-responsive"><table class="table"><thead><h3>DISPATCH DETAILS</h3>'
+        '<tr><th>Date</th><th>Current Location</th><th>Status</th></tr></thead>'
+        f'<tbody>{body}</tbody></table></div>'
+        '<dl><dt>Weight</dt><dd>190</dd></dl><p><strong>Status:</strong> Delivered</p>'
+        '<p><b>Remarks:</b><script>track();</script> Left at hub<!-- r --></p>'
+    )
+
+
+def time_parser(parser, html, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = parser(html, 'BENCH')
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('paths', nargs='*', default=[os.path.join(REPO_ROOT, 'tracking_response.html')])
+    arg_parser.add_argument('--repeat', type=int, default=200, help='parses per response and engine')
+    arg_parser.add_argument('--synthetic-rows', type=int, default=0,
+                            help='also benchmark a generated response with this many table rows')
+    args = arg_parser.parse_args()
+
+    if lxml_html is None:
+        print("lxml is not installed; only the legacy parser is available (pip install lxml)")
+        return 1
+
+    corpus = load_corpus(args.paths)
+    if args.synthetic_rows:
+        corpus.append((f"synthetic-{args.synthetic_rows}-rows", synthetic_response(args.synthetic_rows)))
+
+    print(f"{'response':40} {'bytes':>8} {'legacy ms':>10} {'lxml ms':>9} {'speedup':>8}  same output")
+    total_legacy = total_lxml = 0.0
+    mismatches = 0
+    for name, html in corpus:
+        legacy_time, legacy_result = time_parser(parse_tracking_html_legacy, html, args.repeat)
+        lxml_time, lxml_result = time_parser(parse_tracking_html_lxml, html, args.repeat)
+        # Same fields in the same order, and the same page text whether or not fields were found
+        same = (
+            list(legacy_result[0].items()) == list(lxml_result[0].items())
+            and legacy_result[1] == lxml_result[1]
+            and page_text_legacy(html) == page_text_lxml(html)
+        )
+        mismatches += not same
+        total_legacy += legacy_time
+        total_lxml += lxml_time
+        print(f"{name[:40]:40} {len(html):>8} {legacy_time * 1000:>10.3f} {lxml_time * 1000:>9.3f} "
+              f"{legacy_time / lxml_time:>7.1f}x  {'yes' if same else 'NO'}")
+
+    if corpus:
+        print(f"\n{len(corpus)} responses, overall speedup {total_legacy / total_lxml:.1f}x, {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
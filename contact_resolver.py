@@ -0,0 +1,163 @@
+import os
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, update, bindparam, func
+from app import db
+from models import Contact
+from db_utils import upsert_insert, greatest
+
+logger = logging.getLogger(__name__)
+
+# Contact ids remembered per process, by phone number
+CONTACT_CACHE_SIZE = int(os.environ.get('CONTACT_CACHE_SIZE', 10000))
+# Seconds between writes of the last_interaction times collected in this process
+CONTACT_FLUSH_SECONDS = float(os.environ.get('CONTACT_FLUSH_SECONDS', 5))
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # phone number -> (contact id, profile name), least recently used first
+_pending = {}  # contact id -> latest last_interaction not written yet
+
+_contacts = Contact.__table__
+
+# Only ever moves last_interaction forward, whatever order the flushes run in
+_touch_contact = update(_contacts).where(
+    _contacts.c.id == bindparam('b_id')
+).values(
+    last_interaction=greatest(func.coalesce(_contacts.c.last_interaction, bindparam('b_at')), bindparam('b_at'))
+)
+
+
+def _cached(phone_number):
+    with _lock:
+        entry = _cache.get(phone_number)
+        if entry is not None:
+            _cache.move_to_end(phone_number)
+        return entry
+
+
+def _remember(phone_number, contact_id, profile_name):
+    # Only ids of committed rows are cached, an insert may still roll back
+    with _lock:
+        _cache[phone_number] = (contact_id, profile_name)
+        _cache.move_to_end(phone_number)
+        while len(_cache) > CONTACT_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _touch(contact_id, timestamp):
+    with _lock:
+        if _pending.get(contact_id) is None or timestamp > _pending[contact_id]:
+            _pending[contact_id] = timestamp
+
+
+def resolve(messages):
+    """
+    Get the contacts of a batch of incoming messages, creating new ones.
+
+    Known senders cost no query once cached; their last_interaction is
+    written by the next flush(). New senders (and changed profile names)
+    are written in the caller's transaction with one upsert, so concurrent
+    first messages from a number never create two contacts.
+
+    Args:
+        messages (iterable): (phone_number, timestamp, profile_name) per message
+
+    Returns:
+        tuple: (contact ids by phone number, set of the phone numbers that are new contacts)
+    """
+    senders = {}
+    for phone_number, timestamp, profile_name in messages:
+        sender = senders.setdefault(phone_number, {
+            'phone_number': phone_number,
+            'profile_name': None,
+            'first_interaction': timestamp,
+            'last_interaction': timestamp
+        })
+        sender['first_interaction'] = min(sender['first_interaction'], timestamp)
+        sender['last_interaction'] = max(sender['last_interaction'], timestamp)
+        sender['profile_name'] = profile_name or sender['profile_name']
+
+    contact_ids = {}
+    unknown = []
+    for phone_number, sender in senders.items():
+        entry = _cached(phone_number)
+        if entry is not None and sender['profile_name'] in (None, entry[1]):
+            contact_ids[phone_number] = entry[0]
+        else:
+            unknown.append(phone_number)
+
+    new_numbers, written = set(), set()
+    if unknown:
+        found = db.session.execute(
+            select(Contact.id, Contact.phone_number, Contact.profile_name).where(Contact.phone_number.in_(unknown))
+        ).all()
+        for contact_id, phone_number, profile_name in found:
+            _remember(phone_number, contact_id, profile_name)
+            if senders[phone_number]['profile_name'] in (None, profile_name):
+                contact_ids[phone_number] = contact_id
+        found_numbers = {row.phone_number for row in found}
+
+        writes = [senders[phone_number] for phone_number in unknown if phone_number not in contact_ids]
+        if writes:
+            written = {sender['phone_number'] for sender in writes}
+            stmt = upsert_insert(Contact).values(writes)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Contact.phone_number],
+                set_={
+                    'last_interaction': greatest(
+                        func.coalesce(Contact.last_interaction, stmt.excluded.last_interaction),
+                        stmt.excluded.last_interaction
+                    ),
+                    'profile_name': func.coalesce(stmt.excluded.profile_name, Contact.profile_name)
+                }
+            ).returning(Contact.id, Contact.phone_number, Contact.first_interaction)
+            for contact_id, phone_number, first_interaction in db.session.execute(stmt):
+                contact_ids[phone_number] = contact_id
+                # A concurrent first message may have created the contact since the
+                # SELECT; the update keeps that one's first_interaction
+                if phone_number not in found_numbers and first_interaction == senders[phone_number]['first_interaction']:
+                    new_numbers.add(phone_number)
+
+    for phone_number, sender in senders.items():
+        if phone_number not in written:
+            _touch(contact_ids[phone_number], sender['last_interaction'])
+    return contact_ids, new_numbers
+
+
+def flush():
+    """
+    Write the last_interaction times collected in this process
+
+    Returns:
+        int: Number of contacts updated
+    """
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return 0
+
+    try:
+        db.session.execute(_touch_contact, [
+            {'b_id': contact_id, 'b_at': timestamp} for contact_id, timestamp in pending.items()
+        ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for contact_id, timestamp in pending.items():
+            _touch(contact_id, timestamp)
+        raise
+    return len(pending)
+
+
+def flush_at_exit(app):
+    """Write the remaining last_interaction times when the process shuts down"""
+    def _flush():
+        try:
+            with app.app_context():
+                flush()
+        except Exception as e:
+            logger.error(f"Error flushing contact interactions at exit: {str(e)}")
+    atexit.register(_flush)
@@ -0,0 +1,232 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from app import db
+from models import ConversationState
+from db_utils import upsert_insert, is_postgres
+from acpl_tracker import parse_tracking_numbers
+
+logger = logging.getLogger(__name__)
+
+# Tracking numbers a contact may look up per minute (TRACK and SUBSCRIBE), and in a burst
+CONTACT_TRACK_RATE_PER_MINUTE = float(os.environ.get('CONTACT_TRACK_RATE_PER_MINUTE', 10))
+CONTACT_TRACK_BURST = float(os.environ.get('CONTACT_TRACK_BURST', 20))
+# Seconds a "which shipment?" prompt waits for its answer
+CONVERSATION_PROMPT_SECONDS = int(os.environ.get('CONVERSATION_PROMPT_SECONDS', 300))
+# Sessions kept in memory per process; sessions idle this many seconds are dropped
+CONVERSATION_MAX_SESSIONS = int(os.environ.get('CONVERSATION_MAX_SESSIONS', 10000))
+CONVERSATION_IDLE_SECONDS = int(os.environ.get('CONVERSATION_IDLE_SECONDS', 1800))
+# Also keep the last command and open prompt in the conversation_state table
+CONVERSATION_PERSIST = os.environ.get('CONVERSATION_PERSIST', '').lower() in ('1', 'true', 'yes')
+
+# Key of the PostgreSQL advisory locks (one per contact, with the contact id as
+# second key) held while a contact's next message is answered
+CONVERSATION_LOCK_KEY = 7255003
+# Commands decided per contact that a retried reply job gets again instead of deciding anew
+DECIDED_COMMANDS_KEPT = 16
+
+# Commands that take tracking numbers; the first two look them up on the ACPL site
+NUMBER_COMMANDS = ('TRACK', 'SUBSCRIBE', 'UNSUBSCRIBE')
+RATE_LIMITED_COMMANDS = ('TRACK', 'SUBSCRIBE')
+
+PROMPTS = {
+    'TRACK': "📦 Which shipment? Please send the tracking number.",
+    'SUBSCRIBE': "🔔 Which shipment should I send you updates for? Please send the tracking number.",
+    'UNSUBSCRIBE': "🔕 Which shipment should I stop sending updates for? Please send the tracking number.",
+}
+
+# What to do with a message: name is a command from NUMBER_COMMANDS or None
+# for the automations, text the message to process. replies, when not None,
+# are sent instead of processing the message.
+Command = namedtuple('Command', ('name', 'text', 'replies'))
+
+
+class ContactSession:
+    """Conversation state of one contact in this process"""
+
+    __slots__ = ('contact_id', 'last_command', 'pending', 'pending_until',
+                 'tokens', 'tokens_updated_at', 'throttled', 'last_seen', 'decided')
+
+    def __init__(self, contact_id, last_command=None, pending=None, pending_until=None):
+        self.contact_id = contact_id
+        self.last_command = last_command
+        self.pending = pending
+        self.pending_until = pending_until
+        self.tokens = CONTACT_TRACK_BURST
+        self.tokens_updated_at = time.monotonic()
+        self.throttled = False  # told about the limit since the tokens ran out
+        self.last_seen = time.monotonic()
+        self.decided = OrderedDict()  # message id -> Command, oldest first
+
+    def take(self, count):
+        """
+        Take `count` tokens from the contact's bucket
+
+        Returns:
+            float: 0 if they were taken, else the seconds until they are available
+        """
+        now = time.monotonic()
+        rate = CONTACT_TRACK_RATE_PER_MINUTE / 60
+        self.tokens = min(CONTACT_TRACK_BURST, self.tokens + (now - self.tokens_updated_at) * rate)
+        self.tokens_updated_at = now
+        # A request larger than the burst is allowed once the bucket is full
+        count = min(count, CONTACT_TRACK_BURST)
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0.0
+        return (count - self.tokens) / rate if rate > 0 else float('inf')
+
+
+_lock = threading.Lock()
+_sessions = OrderedDict()  # contact id -> ContactSession, least recently seen first
+_contact_locks = [threading.Lock() for _ in range(64)]  # by contact id, shared by several contacts
+
+
+@contextmanager
+def contact_lock(contact_id):
+    """
+    Answer one message of a contact at a time, across threads and (on
+    PostgreSQL) processes
+
+    The database lock is held until the caller's transaction ends, so the
+    caller commits inside the block.
+    """
+    with _contact_locks[contact_id % len(_contact_locks)]:
+        if is_postgres():
+            db.session.execute(
+                text("SELECT pg_advisory_xact_lock(:key, :contact_id)"),
+                {'key': CONVERSATION_LOCK_KEY, 'contact_id': contact_id}
+            )
+        yield
+
+
+def _evict(now):
+    idle_before = now - CONVERSATION_IDLE_SECONDS
+    while _sessions:
+        session = next(iter(_sessions.values()))
+        if session.last_seen >= idle_before and len(_sessions) <= CONVERSATION_MAX_SESSIONS:
+            break
+        _sessions.popitem(last=False)
+
+
+def _load(contact_id):
+    if CONVERSATION_PERSIST:
+        state = db.session.get(ConversationState, contact_id)
+        if state is not None:
+            return ContactSession(contact_id, state.last_command, state.pending, state.pending_until)
+    return ContactSession(contact_id)
+
+
+def get_session(contact_id):
+    """Get the session of a contact, loading or starting it"""
+    with _lock:
+        session = _sessions.get(contact_id)
+        if session is not None:
+            _sessions.move_to_end(contact_id)
+    if session is None:
+        # Loaded outside the lock; if two threads race, the first one stored wins
+        loaded = _load(contact_id)
+        with _lock:
+            session = _sessions.setdefault(contact_id, loaded)
+    with _lock:
+        session.last_seen = time.monotonic()
+        _evict(session.last_seen)
+    return session
+
+
+def _save(session):
+    # Written in the caller's transaction, committed with the replies
+    if not CONVERSATION_PERSIST:
+        return
+    values = {
+        'contact_id': session.contact_id,
+        'last_command': session.last_command,
+        'pending': session.pending,
+        'pending_until': session.pending_until,
+        'updated_at': datetime.utcnow(),
+    }
+    stmt = upsert_insert(ConversationState).values(**values)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[ConversationState.contact_id],
+        set_={key: value for key, value in values.items() if key != 'contact_id'}
+    ))
+
+
+def _looks_like_numbers(text):
+    tokens = text.replace(',', ' ').split()
+    return bool(tokens) and all(any(c.isdigit() for c in token) for token in tokens)
+
+
+def next_command(contact_id, content, message_id=None):
+    """
+    Decide what to do with a message, given the contact's conversation so far
+
+    - "TRACK" (or SUBSCRIBE/UNSUBSCRIBE) without numbers asks which shipment,
+      and the tracking numbers sent next complete the command
+    - Tracking numbers alone repeat the contact's last TRACK
+    - Lookups beyond the contact's rate limit are refused once, then ignored
+      until tokens are available again, before anything is scraped
+
+    A message is decided once: asked again for the same message_id (a retried
+    job), the same command is returned without charging the rate limit again.
+
+    Returns:
+        Command: What to process, or the replies to send instead
+    """
+    text = content.strip()
+    keyword, _, rest = text.partition(' ')
+    keyword = keyword.upper()
+    session = get_session(contact_id)
+
+    with _lock:
+        if message_id is not None and message_id in session.decided:
+            return session.decided[message_id]
+        before = (session.last_command, session.pending, session.pending_until)
+        now = datetime.utcnow()
+        if keyword in NUMBER_COMMANDS and not parse_tracking_numbers(rest):
+            session.pending = keyword
+            session.pending_until = now + timedelta(seconds=CONVERSATION_PROMPT_SECONDS)
+            command = Command(keyword, text, [PROMPTS[keyword]])
+        else:
+            name = keyword if keyword in NUMBER_COMMANDS else None
+            if name is None and _looks_like_numbers(text):
+                if session.pending and session.pending_until and session.pending_until > now:
+                    name = session.pending
+                elif session.last_command == 'TRACK':
+                    name = 'TRACK'
+                if name is not None:
+                    text = f"{name} {text}"
+            # Any other message cancels an open prompt
+            session.pending = session.pending_until = None
+            command = Command(name, text, None)
+
+        if command.replies is None and command.name in RATE_LIMITED_COMMANDS:
+            count = len(parse_tracking_numbers(text.partition(' ')[2]))
+            wait = session.take(count)
+            if wait and session.throttled:
+                command = Command(command.name, text, [])
+            elif wait:
+                session.throttled = True
+                command = Command(command.name, text, [
+                    f"⏳ You have sent a lot of tracking requests. Please try again in {int(wait) + 1} seconds."
+                ])
+                logger.warning("Rate limited %s requests from contact %s", command.name, contact_id)
+            else:
+                session.throttled = False
+
+        if command.name is not None:
+            session.last_command = command.name
+        if message_id is not None:
+            session.decided[message_id] = command
+            if len(session.decided) > DECIDED_COMMANDS_KEPT:
+                session.decided.popitem(last=False)
+        changed = (session.last_command, session.pending, session.pending_until) != before
+
+    if changed:
+        _save(session)
+    return command
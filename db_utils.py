@@ -0,0 +1,55 @@
+import logging
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import ReturnTypeFromArgs
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+def dialect_name():
+    """
+    Get the name of the SQL dialect the app is connected to
+
+    Returns:
+        str: The dialect name, e.g. 'postgresql' or 'sqlite'
+    """
+    return db.engine.dialect.name
+
+
+def is_postgres():
+    """Return True when the database is PostgreSQL"""
+    return dialect_name() == 'postgresql'
+
+
+def upsert_insert(model):
+    """
+    Build a dialect-specific INSERT that supports ON CONFLICT clauses
+
+    Args:
+        model: The SQLAlchemy model (or Table) to insert into
+
+    Returns:
+        Insert: An insert construct with on_conflict_do_update/on_conflict_do_nothing
+    """
+    if is_postgres():
+        return postgresql.insert(model)
+    if dialect_name() == 'sqlite':
+        return sqlite.insert(model)
+    raise NotImplementedError(f"Upserts are not supported on {dialect_name()}")
+
+
+class greatest(ReturnTypeFromArgs):
+    """
+    The largest of its arguments, GREATEST() on PostgreSQL and the
+    multi-argument max() on SQLite.
+
+    PostgreSQL skips NULL arguments while SQLite returns NULL if any
+    argument is NULL, so pass arguments that are never NULL.
+    """
+    inherit_cache = True
+
+
+@compiles(greatest, 'sqlite')
+def _compile_greatest_sqlite(element, compiler, **kw):
+    return f"max({compiler.process(element.clauses, **kw)})"
@@ -0,0 +1,213 @@
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, update, delete, or_, and_
+from app import db
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+# Number of background worker threads per process (0 processes jobs inline)
+JOB_QUEUE_WORKERS = int(os.environ.get('JOB_QUEUE_WORKERS', 2))
+# Seconds an idle worker waits before polling the queue table again
+JOB_QUEUE_POLL_INTERVAL = float(os.environ.get('JOB_QUEUE_POLL_INTERVAL', 1.0))
+JOB_QUEUE_BATCH_SIZE = int(os.environ.get('JOB_QUEUE_BATCH_SIZE', 5))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+# Seconds after which a 'running' job is considered abandoned (e.g. the worker crashed)
+JOB_LOCK_TIMEOUT = int(os.environ.get('JOB_LOCK_TIMEOUT', 300))
+
+_handlers = {}
+_wakeup = threading.Event()
+_start_lock = threading.Lock()
+_started_pid = None
+_app = None
+
+
+def register_handler(kind, func):
+    """
+    Register the function that processes jobs of a given kind
+
+    Args:
+        kind (str): The job kind, e.g. 'webhook'
+        func (callable): Called with the job payload inside an app context
+    """
+    _handlers[kind] = func
+
+
+def enqueue(kind, payload, delay=0):
+    """
+    Persist a job so that a background worker picks it up
+
+    Args:
+        kind (str): The job kind, must have a registered handler
+        payload (dict): JSON-serializable job data
+        delay (int): Seconds to wait before the job becomes available
+
+    Returns:
+        int: The id of the queued job, or None if it was processed inline
+    """
+    if JOB_QUEUE_WORKERS <= 0:
+        # No workers configured, keep the old synchronous behaviour
+        _handlers[kind](payload)
+        return None
+
+    job = Job(
+        kind=kind,
+        payload=payload,
+        status='pending',
+        attempts=0,
+        available_at=datetime.utcnow() + timedelta(seconds=delay)
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    ensure_workers()
+    _wakeup.set()
+    return job.id
+
+
+def enqueue_many(kind, payloads):
+    """
+    Persist several jobs with one INSERT in the caller's transaction and commit it
+
+    Rows the caller added and the jobs that process them are committed
+    together, so neither is ever stored without the other.
+
+    Args:
+        kind (str): The job kind, must have a registered handler
+        payloads (list): JSON-serializable job data, one job each
+
+    Returns:
+        int: Number of jobs queued (or processed inline)
+    """
+    if JOB_QUEUE_WORKERS <= 0:
+        db.session.commit()
+        for payload in payloads:
+            _handlers[kind](payload)
+        return len(payloads)
+
+    if payloads:
+        now = datetime.utcnow()
+        db.session.execute(insert(Job), [
+            {'kind': kind, 'payload': payload, 'status': 'pending', 'attempts': 0, 'available_at': now}
+            for payload in payloads
+        ])
+    db.session.commit()
+
+    ensure_workers()
+    _wakeup.set()
+    return len(payloads)
+
+
+def claim_jobs(limit=JOB_QUEUE_BATCH_SIZE):
+    """
+    Atomically claim up to `limit` available jobs for this worker.
+
+    On PostgreSQL the candidate rows are selected with FOR UPDATE SKIP LOCKED so
+    concurrent workers never block on or claim the same job. SQLite serializes
+    writers, so the single UPDATE statement is already atomic there.
+
+    Returns:
+        list: Rows of (id, kind, payload, attempts)
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=JOB_LOCK_TIMEOUT)
+
+    candidates = select(Job.id).where(
+        or_(
+            and_(Job.status == 'pending', Job.available_at <= now),
+            and_(Job.status == 'running', Job.locked_at < stale_before)
+        )
+    ).order_by(Job.id).limit(limit).with_for_update(skip_locked=True)
+
+    stmt = update(Job).where(
+        Job.id.in_(candidates)
+    ).values(
+        status='running',
+        locked_at=now,
+        attempts=Job.attempts + 1
+    ).returning(
+        Job.id, Job.kind, Job.payload, Job.attempts
+    ).execution_options(synchronize_session=False)
+
+    rows = db.session.execute(stmt).all()
+    db.session.commit()
+    return rows
+
+
+def run_job(job_id, kind, payload, attempts):
+    """Run a claimed job and record its outcome"""
+    handler = _handlers.get(kind)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{kind}'")
+
+        handler(payload)
+
+        # Finished jobs are removed so the queue table stays small
+        db.session.execute(delete(Job).where(Job.id == job_id))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Job {job_id} ({kind}) failed on attempt {attempts}: {str(e)}")
+
+        values = {'last_error': str(e), 'locked_at': None}
+        if attempts >= JOB_MAX_ATTEMPTS or handler is None:
+            values['status'] = 'failed'
+        else:
+            # Exponential backoff: 2, 4, 8, ... seconds, capped at 5 minutes
+            backoff = min(2 ** attempts, 300)
+            values['status'] = 'pending'
+            values['available_at'] = datetime.utcnow() + timedelta(seconds=backoff)
+
+        db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+        db.session.commit()
+
+
+def _worker_loop(app):
+    while True:
+        jobs = []
+        with app.app_context():
+            try:
+                jobs = claim_jobs()
+                for job_id, kind, payload, attempts in jobs:
+                    run_job(job_id, kind, payload, attempts)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Job worker error: {str(e)}")
+
+        if not jobs:
+            _wakeup.wait(JOB_QUEUE_POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def start_workers(app):
+    """
+    Start the background worker threads for this process
+
+    Args:
+        app: The Flask application, used to push an app context per job batch
+    """
+    global _app, _started_pid
+    _app = app
+    if JOB_QUEUE_WORKERS <= 0:
+        return
+
+    with _start_lock:
+        # Threads do not survive a fork, so start again in each gunicorn worker
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+
+        for i in range(JOB_QUEUE_WORKERS):
+            thread = threading.Thread(target=_worker_loop, args=(app,), name=f"job-worker-{i}", daemon=True)
+            thread.start()
+
+    logger.info(f"Started {JOB_QUEUE_WORKERS} job queue workers in process {os.getpid()}")
+
+
+def ensure_workers():
+    """Make sure workers are running in the current process"""
+    if _app is not None and _started_pid != os.getpid():
+        start_workers(_app)
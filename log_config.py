@@ -0,0 +1,192 @@
+import os
+import re
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from datetime import datetime, timezone
+from flask import has_request_context, request
+
+# Minimum level of the application's log records
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 'json' writes one JSON object per line, 'text' a plain line for local development
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+# Share of DEBUG/INFO records kept per route (Flask endpoint) or logger name,
+# e.g. "webhook=0.05,acpl_tracker=0.2"; warnings and errors are always kept
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')
+# Mask phone numbers and message bodies in log output
+LOG_REDACT = os.environ.get('LOG_REDACT', 'true').lower() in ('1', 'true', 'yes')
+# Records waiting to be written; when full, new records are dropped instead of blocking
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+# WhatsApp addresses, international numbers and Meta wa_ids (11-15 digits);
+# 10-digit GC numbers are left readable
+PHONE_PATTERN = re.compile(r'(?:whatsapp:)?\+\d[\d -]{6,}\d|\b\d{11,15}\b')
+# Extra fields whose values are message text
+REDACTED_FIELDS = ('body', 'Body', 'content', 'text')
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_start_lock = threading.Lock()
+_started_pid = None
+_queue = None
+_listener = None
+_dropped = 0
+
+
+def _mask(match):
+    number = match.group()
+    return re.sub(r'\d', '*', number[:-4]) + number[-4:]
+
+
+def redact(text):
+    """Mask all but the last 4 digits of the phone numbers in a string"""
+    return PHONE_PATTERN.sub(_mask, text)
+
+
+def _parse_sample_rates(value):
+    rates = {}
+    for item in value.split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a share of the DEBUG/INFO records of a route or logger
+
+    Runs in the logging thread before a record is queued, so a dropped
+    record is never formatted.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if not hasattr(record, 'route'):
+            record.route = request.endpoint if has_request_context() else None
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rates.get(record.route, self.rates.get(record.name, 1.0))
+        return rate >= 1.0 or random.random() < rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with the extra= fields as keys"""
+
+    def __init__(self, redact_pii=True):
+        super().__init__()
+        self.redact_pii = redact_pii
+
+    def format(self, record):
+        message = record.getMessage()
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact(message) if self.redact_pii else message,
+        }
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRIBUTES or value is None:
+                continue
+            if self.redact_pii and key in REDACTED_FIELDS:
+                value = '[redacted]'
+            entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Plain log lines, redacted like the JSON ones"""
+
+    def __init__(self, redact_pii=True):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+        self.redact_pii = redact_pii
+
+    def format(self, record):
+        line = super().format(record)
+        return redact(line) if self.redact_pii else line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to the listener thread without formatting or blocking
+
+    The queue is in-process, so records are queued as they are instead of
+    being formatted first; arguments are formatted on the listener thread
+    and should not be mutated after logging them.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        # The listener thread does not survive a fork, so start one in each gunicorn worker
+        if _started_pid != os.getpid():
+            _start_listener()
+        try:
+            _queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+    def emit(self, record):
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+
+def _start_listener():
+    global _started_pid, _queue, _listener
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+
+        formatter_class = JSONFormatter if LOG_FORMAT == 'json' else TextFormatter
+        output = logging.StreamHandler()
+        output.setFormatter(formatter_class(redact_pii=LOG_REDACT))
+        _queue = queue.Queue(LOG_QUEUE_SIZE)
+        _listener = logging.handlers.QueueListener(_queue, output, respect_handler_level=True)
+        _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None and _started_pid == os.getpid():
+        _listener.stop()
+
+
+def dropped_records():
+    """Number of records dropped in this process because the queue was full"""
+    return _dropped
+
+
+def configure_logging():
+    """
+    Send all log records through a queue to one writer thread per process
+
+    Replaces the root logger's handlers; safe to call more than once.
+    """
+    root = logging.getLogger()
+    if any(isinstance(handler, NonBlockingQueueHandler) for handler in root.handlers):
+        return
+
+    handler = NonBlockingQueueHandler(None)
+    handler.addFilter(SamplingFilter(_parse_sample_rates(LOG_SAMPLE_RATES)))
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    _start_listener()
+    # Write what is still queued when the process exits
+    atexit.register(_stop_listener)
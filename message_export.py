@@ -0,0 +1,178 @@
+import io
+import csv
+import json
+import zlib
+import logging
+from sqlalchemy import select
+from app import db
+from models import Contact, Message
+from message_query import apply_filters
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched from the server-side cursor and written per chunk
+EXPORT_BATCH_SIZE = 2000
+
+COLUMNS = ('id', 'timestamp', 'direction', 'phone_number', 'contact_name',
+           'message_type', 'status', 'message_sid', 'content')
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def export_query(filters):
+    """Plain column select of the messages to export, oldest first"""
+    stmt = select(
+        Message.id,
+        Message.timestamp,
+        Message.direction,
+        Contact.phone_number,
+        Contact.name,
+        Message.message_type,
+        Message.status,
+        Message.message_id,
+        Message.content
+    ).outerjoin(Contact, Message.contact_id == Contact.id)
+    return apply_filters(stmt, filters).order_by(Message.id)
+
+
+def _batches(filters):
+    # yield_per streams from a server-side cursor on PostgreSQL, so only one
+    # batch of rows is in memory at a time
+    result = db.session.execute(export_query(filters).execution_options(yield_per=EXPORT_BATCH_SIZE))
+    yield from result.partitions()
+
+
+def _csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in batches:
+        for row in rows:
+            writer.writerow((row.id, row.timestamp.isoformat() if row.timestamp else None, *row[2:]))
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(batches):
+    for rows in batches:
+        lines = []
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            if record['timestamp']:
+                record['timestamp'] = record['timestamp'].isoformat()
+            lines.append(json.dumps(record, ensure_ascii=False))
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out whatever was written since the last take()"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_chunks(batches):
+    schema = pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('timestamp', pyarrow.timestamp('us')),
+        ('direction', pyarrow.string()),
+        ('phone_number', pyarrow.string()),
+        ('contact_name', pyarrow.string()),
+        ('message_type', pyarrow.string()),
+        ('status', pyarrow.string()),
+        ('message_sid', pyarrow.string()),
+        ('content', pyarrow.string()),
+    ])
+    sink = _ChunkSink()
+    # One row group per batch; each is sent as soon as it is written
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression='snappy') as writer:
+        for rows in batches:
+            columns = list(zip(*rows))
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.take()
+    yield sink.take()
+
+
+def _gzip(chunks):
+    # wbits=31 writes a gzip header, so the result is a regular .gz file
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _gzipped(fmt, compress):
+    # Parquet is compressed internally already
+    return compress and fmt != 'parquet'
+
+
+def file_type(fmt, compress=False):
+    """
+    Get the content type and file extension of an export
+
+    Returns:
+        tuple: (mimetype, extension)
+    """
+    if _gzipped(fmt, compress):
+        return 'application/gzip', f"{fmt}.gz"
+    return FORMATS[fmt], fmt
+
+
+def export_messages(filters, fmt='csv', compress=False):
+    """
+    Stream messages as CSV, NDJSON or Parquet
+
+    Args:
+        filters (dict): From message_query.parse_filters
+        fmt (str): 'csv', 'ndjson' or 'parquet' (requires pyarrow)
+        compress (bool): gzip the output (ignored for Parquet, which is compressed already)
+
+    Returns:
+        generator: Chunks of bytes; memory use does not depend on the number of rows
+
+    Raises:
+        ValueError: If the format is unknown or not available
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt} (expected {', '.join(FORMATS)})")
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    chunks = {'csv': _csv_chunks, 'ndjson': _ndjson_chunks, 'parquet': _parquet_chunks}[fmt](_batches(filters))
+    if _gzipped(fmt, compress):
+        chunks = _gzip(chunks)
+    return chunks
@@ -0,0 +1,151 @@
+import json
+import base64
+from datetime import datetime, timedelta
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import joinedload
+from models import Contact, Message
+
+# Messages per page of /messages and maximum of /api/messages
+MESSAGES_PER_PAGE = 20
+MAX_MESSAGES_PER_PAGE = 100
+
+DIRECTIONS = ('incoming', 'outgoing')
+
+
+def encode_cursor(message):
+    """Encode the position after a message as an opaque cursor"""
+    raw = json.dumps([message.timestamp.isoformat(), message.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor from encode_cursor
+
+    Returns:
+        tuple: (timestamp, id) of the last message of the previous page
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, message_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _parse_time(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError(f"Invalid {name}: {value} (expected YYYY-MM-DD or an ISO timestamp)") from e
+
+
+def parse_filters(args):
+    """
+    Read message filters from request arguments
+
+    Args:
+        args: Mapping with optional 'contact' (contact id or phone number),
+            'direction', 'since' and 'until' (dates or ISO timestamps;
+            since is inclusive, until exclusive, and a date for until
+            includes that whole day)
+
+    Returns:
+        dict: The filters that were given, for apply_filters and page links
+
+    Raises:
+        ValueError: If a filter value is invalid
+    """
+    filters = {}
+    contact = (args.get('contact') or '').strip()
+    if contact:
+        filters['contact'] = contact
+
+    direction = (args.get('direction') or '').strip()
+    if direction:
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Invalid direction: {direction} (expected incoming or outgoing)")
+        filters['direction'] = direction
+
+    for name in ('since', 'until'):
+        value = (args.get(name) or '').strip()
+        if value:
+            _parse_time(value, name)
+            filters[name] = value
+    return filters
+
+
+def apply_filters(query, filters):
+    """Restrict a Message query (or select()) to the filters from parse_filters"""
+    contact = filters.get('contact')
+    if contact:
+        if contact.isdigit():
+            query = query.filter(Message.contact_id == int(contact))
+        else:
+            query = query.filter(Message.contact_id.in_(
+                select(Contact.id).where(Contact.phone_number == contact)
+            ))
+
+    if filters.get('direction'):
+        query = query.filter(Message.direction == filters['direction'])
+
+    # Half-open range on the raw column so the timestamp indexes apply
+    if filters.get('since'):
+        query = query.filter(Message.timestamp >= _parse_time(filters['since'], 'since'))
+    if filters.get('until'):
+        until = _parse_time(filters['until'], 'until')
+        if len(filters['until']) == len('YYYY-MM-DD'):
+            # A plain date includes that whole day
+            until += timedelta(days=1)
+        query = query.filter(Message.timestamp < until)
+    return query
+
+
+def page_messages(filters, cursor=None, limit=MESSAGES_PER_PAGE):
+    """
+    Get one page of messages, newest first, with their contacts loaded
+
+    Pages are keyed on (timestamp, id) instead of an OFFSET, so every page
+    is an index range scan however far back it is.
+
+    Args:
+        filters (dict): From parse_filters
+        cursor (str): next_cursor of the previous page, None for the first page
+        limit (int): Messages per page
+
+    Returns:
+        tuple: (messages, next_cursor); next_cursor is None on the last page
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    query = apply_filters(Message.query, filters).options(joinedload(Message.contact))
+    if cursor:
+        query = query.filter(tuple_(Message.timestamp, Message.id) < decode_cursor(cursor))
+
+    messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    if len(messages) > limit:
+        messages = messages[:limit]
+        return messages, encode_cursor(messages[-1])
+    return messages, None
+
+
+def message_to_dict(message):
+    """Serialize a message with its contact for the JSON APIs"""
+    contact = message.contact
+    return {
+        'id': message.id,
+        'contact': {
+            'id': contact.id,
+            'phone_number': contact.phone_number,
+            'name': contact.name,
+        } if contact is not None else None,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat() if message.timestamp else None,
+        'direction': message.direction,
+        'message_type': message.message_type,
+        'status': message.status
+    }
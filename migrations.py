@@ -0,0 +1,391 @@
+# Schema migrations for existing databases.
+#
+# db.create_all() creates missing tables with all their indexes but never changes
+# a table that already exists. Such changes are numbered migrations here, applied
+# once and in order at startup and recorded in the schema_migration table. They
+# must also be no-ops on a database create_all() just created (IF NOT EXISTS).
+#
+# On large PostgreSQL tables an index can be built beforehand without blocking
+# writes (CREATE INDEX CONCURRENTLY, same name); the migration then skips it.
+import logging
+from time import monotonic
+from datetime import datetime, time, timedelta
+from sqlalchemy import (
+    select, insert, update, delete, func, text, inspect, distinct,
+    table, column, Integer, String, Date, DateTime, JSON
+)
+from app import db
+from models import SchemaMigration
+from db_utils import is_postgres, upsert_insert
+from payload_store import BACKFILL_JOB_KIND
+import job_queue
+
+logger = logging.getLogger(__name__)
+
+# Key of the PostgreSQL advisory lock held while migrating, so that gunicorn
+# workers starting at the same time do not run migrations concurrently
+MIGRATION_LOCK_KEY = 7255001
+
+MIGRATIONS = []  # (version, name, func)
+
+# Job that fills the rollups of the days before migration 5, ROLLUP_BACKFILL_DAYS
+# days per transaction
+ROLLUP_BACKFILL_JOB_KIND = 'rollup_backfill'
+ROLLUP_BACKFILL_DAYS = 7
+# Seconds a backfill job runs before it re-queues itself, well below JOB_LOCK_TIMEOUT
+ROLLUP_BACKFILL_SLICE_SECONDS = 60
+
+
+def migration(version, name):
+    """Register a function as the migration with the given version"""
+    def decorator(func):
+        MIGRATIONS.append((version, name, func))
+        return func
+    return decorator
+
+
+def create_index(name, table, columns, unique=False):
+    """Create an index unless an index of that name already exists"""
+    db.session.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+    ))
+
+
+def add_column(table, name, ddl):
+    """Add a column unless the table already has it (e.g. it was just created)"""
+    columns = {c['name'] for c in inspect(db.session.connection()).get_columns(table)}
+    if name not in columns:
+        db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def truncate_timestamp(column, unit):
+    """Truncate a timestamp column to the start of its 'day' or 'hour'"""
+    if is_postgres():
+        return func.date_trunc(unit, column)
+    return func.strftime('%Y-%m-%d 00:00:00' if unit == 'day' else '%Y-%m-%d %H:00:00', column)
+
+
+def _as_datetime(value):
+    # SQLite returns truncated timestamps as text
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def run_migrations():
+    """
+    Apply all pending migrations in one transaction
+
+    Returns:
+        int: Number of migrations applied
+    """
+    if is_postgres():
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+
+    applied = set(db.session.execute(select(SchemaMigration.version)).scalars())
+    pending = [m for m in sorted(MIGRATIONS, key=lambda m: m[0]) if m[0] not in applied]
+    for version, name, func in pending:
+        logger.info(f"Applying migration {version}: {name}")
+        func()
+        # Another process without the lock (SQLite) may have recorded it meanwhile
+        db.session.execute(
+            upsert_insert(SchemaMigration).values(version=version, name=name).on_conflict_do_nothing()
+        )
+    db.session.commit()
+    return len(pending)
+
+
+# Migrations describe the tables as they are at their version with table() and
+# column() instead of using the models, which may already have columns that a
+# later migration adds.
+contact_v1 = table(
+    'contact',
+    column('id', Integer),
+    column('phone_number', String),
+    column('name', String),
+    column('profile_name', String),
+    column('first_interaction', DateTime),
+    column('last_interaction', DateTime),
+)
+message_v1 = table(
+    'message',
+    column('id', Integer),
+    column('contact_id', Integer),
+    column('timestamp', DateTime),
+    column('direction', String),
+)
+subscription_v1 = table(
+    'subscription',
+    column('id', Integer),
+    column('contact_id', Integer),
+    column('shipment_id', Integer),
+)
+message_stats_v1 = table(
+    'message_stats',
+    column('id', Integer),
+    column('date', Date),
+    column('messages_received', Integer),
+    column('messages_sent', Integer),
+    column('unique_contacts', Integer),
+    column('response_time_avg', Integer),
+)
+message_stats_v4 = table(
+    'message_stats',
+    *(column(c.name, c.type) for c in message_stats_v1.c),
+    column('new_contacts', Integer),
+)
+message_hourly_stats_v5 = table(
+    'message_hourly_stats',
+    column('id', Integer),
+    column('hour', DateTime),
+    column('direction', String),
+    column('count', Integer),
+)
+message_v7 = table(
+    'message',
+    column('id', Integer),
+    column('message_metadata', JSON),
+)
+job_v7 = table(
+    'job',
+    column('id', Integer),
+    column('kind', String),
+    column('payload', JSON),
+    column('status', String),
+    column('attempts', Integer),
+    column('available_at', DateTime),
+    column('created_at', DateTime),
+)
+
+
+@migration(1, 'unique contact phone numbers')
+def _unique_contact_phone_numbers():
+    contact, message, subscription = contact_v1.c, message_v1.c, subscription_v1.c
+    duplicates = db.session.execute(
+        select(contact.phone_number).group_by(contact.phone_number).having(func.count() > 1)
+    ).scalars().all()
+
+    for phone_number in duplicates:
+        contacts = db.session.execute(
+            select(contact_v1).where(contact.phone_number == phone_number).order_by(contact.id)
+        ).all()
+        keep, other_ids = contacts[0].id, [c.id for c in contacts[1:]]
+
+        # Merge the duplicates into the oldest contact
+        db.session.execute(update(contact_v1).where(contact.id == keep).values(
+            name=next((c.name for c in contacts if c.name), None),
+            profile_name=next((c.profile_name for c in contacts if c.profile_name), None),
+            first_interaction=min((c.first_interaction for c in contacts if c.first_interaction), default=None),
+            last_interaction=max((c.last_interaction for c in contacts if c.last_interaction), default=None),
+        ))
+        db.session.execute(update(message_v1).where(message.contact_id.in_(other_ids)).values(contact_id=keep))
+        # Subscriptions the kept contact already has would violate uq_subscription_contact_shipment
+        kept_shipments = select(subscription.shipment_id).where(subscription.contact_id == keep)
+        db.session.execute(delete(subscription_v1).where(
+            subscription.contact_id.in_(other_ids),
+            subscription.shipment_id.in_(kept_shipments)
+        ))
+        db.session.execute(
+            update(subscription_v1).where(subscription.contact_id.in_(other_ids)).values(contact_id=keep)
+        )
+        db.session.execute(delete(contact_v1).where(contact.id.in_(other_ids)))
+
+    if duplicates:
+        logger.info(f"Merged duplicate contacts for {len(duplicates)} phone numbers")
+    create_index('uq_contact_phone_number', 'contact', ['phone_number'], unique=True)
+
+
+@migration(2, 'unique message stats dates')
+def _unique_message_stats_dates():
+    stats = message_stats_v1.c
+    duplicates = db.session.execute(
+        select(stats.date).group_by(stats.date).having(func.count() > 1)
+    ).scalars().all()
+
+    for date in duplicates:
+        rows = db.session.execute(
+            select(message_stats_v1).where(stats.date == date).order_by(stats.id)
+        ).all()
+        db.session.execute(update(message_stats_v1).where(stats.id == rows[0].id).values(
+            messages_received=sum(r.messages_received or 0 for r in rows),
+            messages_sent=sum(r.messages_sent or 0 for r in rows),
+            unique_contacts=max(r.unique_contacts or 0 for r in rows),
+            response_time_avg=next((r.response_time_avg for r in rows if r.response_time_avg is not None), None),
+        ))
+        db.session.execute(delete(message_stats_v1).where(stats.id.in_([r.id for r in rows[1:]])))
+
+    if duplicates:
+        logger.info(f"Merged duplicate message stats for {len(duplicates)} dates")
+    create_index('uq_message_stats_date', 'message_stats', ['date'], unique=True)
+
+
+@migration(3, 'message timestamp indexes')
+def _message_timestamp_indexes():
+    # Date range queries filtered by direction (dashboard, message list)
+    create_index('ix_message_timestamp_direction', 'message', ['timestamp', 'direction'])
+    # A contact's conversation in time order
+    create_index('ix_message_contact_id_timestamp', 'message', ['contact_id', 'timestamp'])
+
+
+@migration(4, 'message stats new contacts')
+def _message_stats_new_contacts():
+    add_column('message_stats', 'new_contacts', 'INTEGER DEFAULT 0')
+    # Active contacts on the dashboard
+    create_index('ix_contact_last_interaction', 'contact', ['last_interaction'])
+
+
+@migration(5, 'backfill message rollups')
+def _backfill_message_rollups():
+    # Today is filled right away, since the live counters add to its rows from
+    # now on. Scanning all earlier messages would hold up startup, so the job
+    # workers fill the days before today a few at a time.
+    today = datetime.combine(datetime.utcnow().date(), time.min)
+    filled = _backfill_rollups(today, today + timedelta(days=1))
+    logger.info(f"Backfilled message stats for {filled} dates")
+
+    contact, message = contact_v1.c, message_v1.c
+    older = (
+        db.session.execute(select(message.id).where(message.timestamp < today).limit(1)).first() or
+        db.session.execute(select(contact.id).where(contact.first_interaction < today).limit(1)).first()
+    )
+    if older:
+        db.session.execute(insert(job_v7).values(
+            kind=ROLLUP_BACKFILL_JOB_KIND, payload={'until': today.date().isoformat()}, status='pending',
+            attempts=0, available_at=datetime.utcnow(), created_at=datetime.utcnow()
+        ))
+        logger.info("Queued the backfill of earlier message stats")
+
+
+def _backfill_rollups(start, end):
+    """
+    Fill the daily and hourly rollups of [start, end) from the messages and contacts
+
+    Dates that already have stats only get their new_contacts set, and hours
+    that already have a count are left as they are, so a range can be filled
+    again without counting anything twice.
+
+    Returns:
+        int: Number of dates added
+    """
+    contact, message, stats = contact_v1.c, message_v1.c, message_stats_v4.c
+    existing = set(db.session.execute(
+        select(stats.date).where(stats.date >= start.date(), stats.date < end.date())
+    ).scalars())
+    in_range = (message.timestamp >= start, message.timestamp < end)
+    directions = message.direction.in_(('incoming', 'outgoing'))
+
+    # Dates from before MessageStats was kept
+    day = truncate_timestamp(message.timestamp, 'day')
+    counts = db.session.execute(
+        select(day, message.direction, func.count()).where(*in_range, directions).group_by(day, message.direction)
+    ).all()
+    missing = {}
+    for value, direction, count in counts:
+        date = _as_datetime(value).date()
+        if date in existing:
+            continue
+        row = missing.setdefault(date, {
+            'date': date, 'messages_received': 0, 'messages_sent': 0, 'unique_contacts': 0, 'new_contacts': 0
+        })
+        row['messages_received' if direction == 'incoming' else 'messages_sent'] += count
+    if missing:
+        unique_contacts = db.session.execute(
+            select(day, func.count(distinct(message.contact_id))).where(*in_range).group_by(day)
+        ).all()
+        for value, count in unique_contacts:
+            row = missing.get(_as_datetime(value).date())
+            if row is not None:
+                row['unique_contacts'] = count
+
+    first_day = truncate_timestamp(contact.first_interaction, 'day')
+    new_contacts = db.session.execute(
+        select(first_day, func.count()).where(
+            contact.first_interaction >= start, contact.first_interaction < end
+        ).group_by(first_day)
+    ).all()
+    for value, count in new_contacts:
+        date = _as_datetime(value).date()
+        if date in existing:
+            db.session.execute(update(message_stats_v4).where(stats.date == date).values(new_contacts=count))
+        else:
+            missing.setdefault(date, {
+                'date': date, 'messages_received': 0, 'messages_sent': 0, 'unique_contacts': 0, 'new_contacts': 0
+            })['new_contacts'] = count
+    if missing:
+        db.session.execute(insert(message_stats_v4), list(missing.values()))
+
+    hour = truncate_timestamp(message.timestamp, 'hour')
+    counts = db.session.execute(
+        select(hour, message.direction, func.count()).where(*in_range, directions).group_by(hour, message.direction)
+    ).all()
+    if counts:
+        db.session.execute(upsert_insert(message_hourly_stats_v5).values([
+            {'hour': _as_datetime(value), 'direction': direction, 'count': count}
+            for value, direction, count in counts
+        ]).on_conflict_do_nothing())
+
+    return len(missing)
+
+
+def backfill_rollups(payload):
+    """
+    Job queue handler: fill the rollups of the days before migration 5
+
+    Every ROLLUP_BACKFILL_DAYS days are committed on their own and filling
+    a day again changes nothing, so an interrupted job continues where it
+    stopped when the queue retries it.
+    """
+    contact, message = contact_v1.c, message_v1.c
+    until = datetime.fromisoformat(payload['until'])
+    if 'start' in payload:
+        start = datetime.fromisoformat(payload['start'])
+    else:
+        first = [
+            value for value in (
+                db.session.execute(select(func.min(message.timestamp))).scalar(),
+                db.session.execute(select(func.min(contact.first_interaction))).scalar(),
+            ) if value is not None
+        ]
+        start = datetime.combine(min(first).date(), time.min) if first else until
+
+    deadline = monotonic() + ROLLUP_BACKFILL_SLICE_SECONDS
+    filled = 0
+    while start < until:
+        if job_queue.JOB_QUEUE_WORKERS > 0 and monotonic() >= deadline:
+            # Continue in a new queue job instead of holding this worker
+            job_queue.enqueue(ROLLUP_BACKFILL_JOB_KIND, {'start': start.isoformat(), 'until': payload['until']})
+            break
+        end = min(start + timedelta(days=ROLLUP_BACKFILL_DAYS), until)
+        filled += _backfill_rollups(start, end)
+        db.session.commit()
+        start = end
+    logger.info("Backfilled message stats for %d dates (up to %s)", filled, start.date())
+
+
+@migration(6, 'response time columns')
+def _response_time_columns():
+    add_column('message_stats', 'response_time_total', 'INTEGER DEFAULT 0')
+    add_column('message_stats', 'response_count', 'INTEGER DEFAULT 0')
+    add_column('outbox_entry', 'reply_to_timestamp', 'TIMESTAMP')
+
+
+@migration(7, 'compact message payloads')
+def _compact_message_payloads():
+    add_column('message', 'payload_id', 'INTEGER REFERENCES message_payload (id)')
+    # Rewriting every message would hold up startup; the job workers convert
+    # the existing payloads in batches once the migration is committed
+    message = message_v7.c
+    if db.session.execute(select(message.id).where(message.message_metadata.is_not(None)).limit(1)).first():
+        db.session.execute(insert(job_v7).values(
+            kind=BACKFILL_JOB_KIND, payload={'last_id': 0}, status='pending', attempts=0,
+            available_at=datetime.utcnow(), created_at=datetime.utcnow()
+        ))
+        logger.info("Queued the conversion of stored webhook payloads")
+
+
+@migration(8, 'message received_at')
+def _message_received_at():
+    add_column('message', 'received_at', 'TIMESTAMP')
+
+
+@migration(9, 'tracked shipment failed polls')
+def _tracked_shipment_failed_polls():
+    add_column('tracked_shipment', 'failed_polls', 'INTEGER DEFAULT 0')
@@ -25,6 +25,11 @@ class Contact(db.Model):
     last_interaction = db.Column(db.DateTime, default=datetime.utcnow)
     messages = db.relationship('Message', backref='contact', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('uq_contact_phone_number', 'phone_number', unique=True),
+        db.Index('ix_contact_last_interaction', 'last_interaction'),
+    )
+
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -32,11 +37,26 @@ class Message(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'))
     content = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)  # for Meta messages, the sender's timestamp
+    received_at = db.Column(db.DateTime)  # when the webhook of an incoming message arrived
     direction = db.Column(db.String(10))  # 'incoming' or 'outgoing'
     message_type = db.Column(db.String(20))  # 'text', 'image', 'video', etc.
-    status = db.Column(db.String(20))  # 'sent', 'delivered', 'read', 'failed'
+    status = db.Column(db.String(20))  # 'sent', 'delivered', 'read', 'failed'; incoming: 'new' until answered, then 'received'
     message_metadata = db.Column(db.JSON)  # Changed from 'metadata' since it's a reserved keyword
+    payload_id = db.Column(db.Integer, db.ForeignKey('message_payload.id'))  # webhook payload, see payload_store.py
+
+    __table_args__ = (
+        db.Index('ix_message_timestamp_direction', 'timestamp', 'direction'),
+        db.Index('ix_message_contact_id_timestamp', 'contact_id', 'timestamp'),
+    )
+
+
+class MessagePayload(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.String(64), unique=True, nullable=False)  # sha256 of the uncompressed JSON
+    encoding = db.Column(db.String(10), nullable=False)  # 'zstd' or 'gzip'
+    data = db.Column(db.LargeBinary, nullable=False)  # compressed JSON, shared by identical payloads
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class Automation(db.Model):
@@ -59,3 +79,120 @@ class MessageStats(db.Model):
     messages_sent = db.Column(db.Integer, default=0)
     unique_contacts = db.Column(db.Integer, default=0)
     response_time_avg = db.Column(db.Integer)  # in seconds
+    new_contacts = db.Column(db.Integer, default=0)  # contacts whose first message was on this date
+    response_time_total = db.Column(db.Integer, default=0)  # seconds, over response_count replies
+    response_count = db.Column(db.Integer, default=0)
+
+    __table_args__ = (
+        db.Index('uq_message_stats_date', 'date', unique=True),
+    )
+
+
+class DailyContact(db.Model):
+    # Contacts that sent a message on a date, for MessageStats.unique_contacts
+    date = db.Column(db.Date, primary_key=True)
+    contact_id = db.Column(db.Integer, primary_key=True)
+
+
+class MessageHourlyStats(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False)  # start of the hour (UTC)
+    direction = db.Column(db.String(10), nullable=False)  # 'incoming' or 'outgoing'
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('hour', 'direction', name='uq_message_hourly_stats_hour_direction'),
+    )
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)  # handler name, e.g. 'webhook'
+    payload = db.Column(db.JSON)
+    status = db.Column(db.String(20), default='pending')  # 'pending', 'running', 'failed'
+    attempts = db.Column(db.Integer, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    __table_args__ = (
+        db.Index('ix_job_status_available_at', 'status', 'available_at'),
+    )
+
+
+class TrackingCacheEntry(db.Model):
+    gc_number = db.Column(db.String(32), primary_key=True)
+    result = db.Column(db.JSON)  # result dict returned by track_acpl_cargo
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class TrackedShipment(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    gc_number = db.Column(db.String(32), unique=True, nullable=False)
+    snapshot = db.Column(db.JSON)  # Shipment.to_dict() of the last successful poll
+    status = db.Column(db.String(20), default='active')  # 'active', 'delivered', 'expired', 'failed', 'unsubscribed'
+    poll_interval = db.Column(db.Integer)  # seconds until the next poll
+    failed_polls = db.Column(db.Integer, default=0)  # lookups that failed in a row
+    next_poll_at = db.Column(db.DateTime, index=True)  # None once polling stopped
+    last_polled_at = db.Column(db.DateTime)
+    last_changed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    subscriptions = db.relationship('Subscription', backref='shipment', lazy='dynamic')
+
+
+class Subscription(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), nullable=False)
+    shipment_id = db.Column(db.Integer, db.ForeignKey('tracked_shipment.id'), nullable=False)
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    contact = db.relationship('Contact', backref=db.backref('subscriptions', lazy='dynamic'))
+    __table_args__ = (
+        db.UniqueConstraint('contact_id', 'shipment_id', name='uq_subscription_contact_shipment'),
+    )
+
+
+class CacheVersion(db.Model):
+    name = db.Column(db.String(64), primary_key=True)  # e.g. 'automations'
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class OutboxEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)  # the queued outgoing Message
+    phone_number = db.Column(db.String(20), nullable=False)
+    message = db.relationship('Message')
+    reply_to_timestamp = db.Column(db.DateTime)  # incoming message this is the first reply to
+    locked_at = db.Column(db.DateTime)  # set while a dispatcher is sending it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True)  # see migrations.py
+    name = db.Column(db.String(120), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class RetentionJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    mode = db.Column(db.String(10), nullable=False)  # 'delete' messages or 'strip' their metadata
+    cutoff = db.Column(db.DateTime, nullable=False)  # messages older than this are cleaned up
+    archive_path = db.Column(db.String(255))  # gzip NDJSON of the affected messages, if archived
+    status = db.Column(db.String(20), default='pending')  # 'pending', 'running', 'done'
+    max_id = db.Column(db.Integer)  # highest message id to clean up, fixed when the job starts
+    last_id = db.Column(db.Integer, default=0)  # messages up to this id are done
+    total = db.Column(db.Integer)  # messages to clean up, counted when the job starts
+    processed = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+class ConversationState(db.Model):
+    contact_id = db.Column(db.Integer, db.ForeignKey('contact.id'), primary_key=True)
+    last_command = db.Column(db.String(20))  # e.g. 'TRACK'
+    pending = db.Column(db.String(20))  # command waiting for its tracking numbers
+    pending_until = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,170 @@
+import os
+import math
+import time
+import queue
+import random
+import logging
+import threading
+from concurrent.futures import Future
+from requests.exceptions import ConnectionError, ConnectTimeout
+from urllib3.exceptions import ProtocolError
+from twilio.base.exceptions import TwilioRestException
+import twilio_api
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Sender threads per process
+OUTBOUND_WORKERS = int(os.environ.get('OUTBOUND_WORKERS', 4))
+# Messages waiting to be sent per process before submit() blocks
+OUTBOUND_QUEUE_SIZE = int(os.environ.get('OUTBOUND_QUEUE_SIZE', 1000))
+# Messages per second (and burst) sent from one Twilio number
+TWILIO_RATE_LIMIT = float(os.environ.get('TWILIO_RATE_LIMIT', 10))
+TWILIO_BURST = int(os.environ.get('TWILIO_BURST', 20))
+# Retries of rate limited (429), server-side (5xx) and connection failures
+OUTBOUND_MAX_RETRIES = int(os.environ.get('OUTBOUND_MAX_RETRIES', 4))
+OUTBOUND_RETRY_BASE_SECONDS = float(os.environ.get('OUTBOUND_RETRY_BASE_SECONDS', 1.0))
+OUTBOUND_RETRY_MAX_SECONDS = 30.0
+
+
+def _is_retryable(error):
+    if isinstance(error, TwilioRestException):
+        return error.status == 429 or (error.status or 0) >= 500
+    # Only a failed connect is known to have left the message unsent. After a
+    # read timeout, a dropped connection or an unknown error Twilio may already
+    # have accepted it, and a retry could deliver it twice.
+    if isinstance(error, ConnectTimeout):
+        return True
+    if isinstance(error, ConnectionError):
+        return not (error.args and isinstance(error.args[0], ProtocolError))
+    return False
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(OUTBOUND_RETRY_MAX_SECONDS, OUTBOUND_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def max_send_seconds(messages, workers=OUTBOUND_WORKERS):
+    """
+    Upper bound on the time the sender takes for `messages` submitted at once
+
+    Every retried attempt failed to connect within the Twilio timeout; the
+    last attempt may also wait for the response. Messages are sent one at a
+    time per worker thread.
+
+    Returns:
+        float: Seconds until the last of the messages has its outcome
+    """
+    backoff = sum(min(OUTBOUND_RETRY_MAX_SECONDS, OUTBOUND_RETRY_BASE_SECONDS * 2 ** attempt)
+                  for attempt in range(OUTBOUND_MAX_RETRIES))
+    per_message = (OUTBOUND_MAX_RETRIES + 2) * twilio_api.TWILIO_TIMEOUT + backoff
+    pacing = max(messages - TWILIO_BURST, 0) / TWILIO_RATE_LIMIT
+    return math.ceil(messages / workers) * per_message + pacing
+
+
+class OutboundSender:
+    """
+    Sends WhatsApp messages from an in-process queue on a pool of worker threads.
+
+    All workers share the long-lived Twilio client (one pooled keep-alive
+    connection set per credential set). Sends from each Twilio number are paced
+    by a token bucket, and rate limited or failed requests are retried with
+    jittered exponential backoff.
+    """
+
+    def __init__(self, workers=OUTBOUND_WORKERS):
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _bucket_for(self, from_number):
+        with self._buckets_lock:
+            bucket = self._buckets.get(from_number)
+            if bucket is None:
+                bucket = self._buckets[from_number] = TokenBucket(TWILIO_RATE_LIMIT, TWILIO_BURST)
+            return bucket
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so start again in each gunicorn worker
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+            self._threads = [
+                threading.Thread(target=self._worker_loop, name=f"outbound-sender-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, to_phone_number, message_text):
+        """
+        Queue a WhatsApp message for sending
+
+        Args:
+            to_phone_number (str): The recipient's phone number in international format
+            message_text (str): The message text to send
+
+        Returns:
+            Future: Resolves to the status dict returned by send_whatsapp_message
+        """
+        future = Future()
+        if not twilio_api.TWILIO_ACCOUNT_SID or not twilio_api.TWILIO_AUTH_TOKEN:
+            # Without credentials there is nothing to send over the network
+            future.set_result(twilio_api.send_whatsapp_message(to_phone_number, message_text))
+            return future
+
+        self._ensure_started()
+        self._queue.put((future, to_phone_number, message_text))
+        return future
+
+    def _send(self, to_phone_number, message_text):
+        bucket = self._bucket_for(twilio_api.TWILIO_PHONE_NUMBER)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            try:
+                return twilio_api.create_message(to_phone_number, message_text)
+            except Exception as e:
+                if attempt >= OUTBOUND_MAX_RETRIES or not _is_retryable(e):
+                    logger.error(f"Error sending WhatsApp message after {attempt + 1} attempts: {str(e)}")
+                    result = {"success": False, "error": str(e)}
+                    if isinstance(e, TwilioRestException):
+                        result["error"] = f"Twilio API error: {str(e)}"
+                        result["error_code"] = e.code
+                    return result
+                delay = _backoff(attempt)
+                logger.warning("Sending WhatsApp message failed (%s), retrying in %.1fs", e, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def _worker_loop(self):
+        while True:
+            future, to_phone_number, message_text = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._send(to_phone_number, message_text))
+            except Exception as e:
+                future.set_exception(e)
+
+
+_sender = OutboundSender()
+
+
+def send_async(to_phone_number, message_text):
+    """
+    Send a WhatsApp message without blocking on the network
+
+    Returns:
+        Future: Resolves to the status dict returned by send_whatsapp_message
+    """
+    return _sender.submit(to_phone_number, message_text)
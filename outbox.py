@@ -0,0 +1,238 @@
+import os
+import math
+import logging
+import threading
+from concurrent.futures import wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, bindparam, or_
+from app import db
+from models import Message, OutboxEntry
+from outbound_sender import send_async, max_send_seconds
+import stats_counter
+
+logger = logging.getLogger(__name__)
+
+# Dispatcher threads per process
+OUTBOX_DISPATCHERS = int(os.environ.get('OUTBOX_DISPATCHERS', 1))
+# Seconds an idle dispatcher waits before polling the outbox again
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1.0))
+# Messages claimed, sent and written back per batch
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+# Seconds after which a claimed entry is considered abandoned (e.g. the process
+# died). It must outlast the sends of every batch in flight, retries included,
+# or another dispatcher would claim and send them a second time.
+_MAX_BATCH_SECONDS = max_send_seconds(OUTBOX_DISPATCHERS * OUTBOX_BATCH_SIZE)
+OUTBOX_LOCK_TIMEOUT = int(os.environ.get('OUTBOX_LOCK_TIMEOUT', max(300, math.ceil(_MAX_BATCH_SECONDS) + 60)))
+if OUTBOX_LOCK_TIMEOUT <= _MAX_BATCH_SECONDS:
+    raise ValueError(
+        f"Invalid OUTBOX_LOCK_TIMEOUT: {OUTBOX_LOCK_TIMEOUT} (sending a batch can take up to "
+        f"{_MAX_BATCH_SECONDS:.0f}s; lower OUTBOX_BATCH_SIZE or OUTBOUND_MAX_RETRIES, or raise the timeout)"
+    )
+
+_wakeup = threading.Event()
+_start_lock = threading.Lock()
+_started_pid = None
+_app = None
+
+_messages = Message.__table__
+
+# Status writes for the sends that completed together run as two executemany
+# statements. The 'sending' guard keeps them from overwriting a status that
+# was already moved on (e.g. by a delivery callback).
+_mark_sent = update(_messages).where(
+    _messages.c.id == bindparam('b_id'),
+    _messages.c.status == 'sending'
+).values(status='sent', message_id=bindparam('b_sid'))
+
+_mark_failed = update(_messages).where(
+    _messages.c.id == bindparam('b_id'),
+    _messages.c.status == 'sending'
+).values(status='failed', message_metadata=bindparam('b_error'))
+
+
+def queue_message(contact, text, reply_to=None):
+    """
+    Add an outgoing message to the current transaction.
+
+    Nothing is sent until the caller commits; the dispatcher then picks the
+    message up, so the send can never happen for a rolled back transaction.
+
+    Args:
+        contact (Contact): The recipient
+        text (str): The message text
+        reply_to (Message): The incoming message this answers, for the response time stats;
+            they are measured from when its webhook arrived, as a Meta message's
+            own timestamp is set by the sender
+
+    Returns:
+        Message: The queued outgoing message
+    """
+    message = Message(
+        contact=contact,
+        content=text,
+        direction='outgoing',
+        message_type='text',
+        status='queued'
+    )
+    db.session.add(message)
+    db.session.add(OutboxEntry(
+        message=message,
+        phone_number=contact.phone_number,
+        reply_to_timestamp=_received_at(reply_to) if reply_to is not None else None
+    ))
+    return message
+
+
+def _received_at(message):
+    # Messages stored before received_at existed: their timestamp, but never a future one
+    if message.received_at is not None:
+        return message.received_at
+    return min(message.timestamp, datetime.utcnow())
+
+
+def wake():
+    """Tell this process' dispatcher that new messages were committed"""
+    ensure_dispatcher()
+    _wakeup.set()
+
+
+def claim_batch(limit=OUTBOX_BATCH_SIZE):
+    """
+    Claim up to `limit` unsent outbox entries and mark their messages 'sending'.
+
+    Candidates are selected with FOR UPDATE SKIP LOCKED on PostgreSQL so
+    dispatchers in other processes claim disjoint batches.
+
+    Returns:
+        list: Rows of (outbox id, message id, phone number, content, reply_to_timestamp)
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=OUTBOX_LOCK_TIMEOUT)
+
+    candidates = select(OutboxEntry.id).where(
+        or_(OutboxEntry.locked_at.is_(None), OutboxEntry.locked_at < stale_before)
+    ).order_by(OutboxEntry.id).limit(limit).with_for_update(skip_locked=True)
+
+    claimed = db.session.execute(
+        update(OutboxEntry).where(
+            OutboxEntry.id.in_(candidates)
+        ).values(
+            locked_at=now
+        ).returning(
+            OutboxEntry.id, OutboxEntry.message_id, OutboxEntry.phone_number, OutboxEntry.reply_to_timestamp
+        ).execution_options(synchronize_session=False)
+    ).all()
+    if not claimed:
+        db.session.commit()
+        return []
+
+    message_ids = [row.message_id for row in claimed]
+    db.session.execute(
+        update(Message).where(Message.id.in_(message_ids)).values(status='sending')
+        .execution_options(synchronize_session=False)
+    )
+    content = dict(db.session.execute(
+        select(Message.id, Message.content).where(Message.id.in_(message_ids))
+    ).all())
+    db.session.commit()
+    return [
+        (row.id, row.message_id, row.phone_number, content.get(row.message_id), row.reply_to_timestamp)
+        for row in claimed
+    ]
+
+
+def dispatch_batch():
+    """
+    Send one batch of queued messages and record the outcomes.
+
+    Outcomes are written as the sends complete, so a message's SID is stored
+    before its delivery callbacks are likely to arrive, even while the rest
+    of the batch is still paced or retried.
+
+    Returns:
+        int: Number of messages handled
+    """
+    batch = claim_batch()
+    if not batch:
+        return 0
+
+    # The sender paces and retries the messages on its own threads
+    pending = {
+        send_async(phone, text): (outbox_id, message_id, reply_to_timestamp)
+        for outbox_id, message_id, phone, text, reply_to_timestamp in batch
+    }
+
+    total_sent = total_failed = 0
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        handled, sent, failed, response_times = [], [], [], []
+        for future in done:
+            outbox_id, message_id, reply_to_timestamp = pending.pop(future)
+            handled.append(outbox_id)
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+            if result.get('success'):
+                sent.append({'b_id': message_id, 'b_sid': result.get('message_sid')})
+                if reply_to_timestamp is not None:
+                    response_times.append((datetime.utcnow() - reply_to_timestamp).total_seconds())
+            else:
+                logger.error("Outgoing message %s failed: %s", message_id, result.get('error'))
+                failed.append({'b_id': message_id, 'b_error': {'error': result.get('error')}})
+
+        if sent:
+            db.session.execute(_mark_sent, sent)
+        if failed:
+            db.session.execute(_mark_failed, failed)
+        db.session.execute(delete(OutboxEntry).where(OutboxEntry.id.in_(handled)))
+        db.session.commit()
+        stats_counter.record_sent(len(sent), response_times)
+        total_sent += len(sent)
+        total_failed += len(failed)
+
+    logger.info("Dispatched %d outgoing messages (%d failed)", total_sent, total_failed)
+    return len(batch)
+
+
+def _dispatcher_loop(app):
+    while True:
+        handled = 0
+        with app.app_context():
+            try:
+                handled = dispatch_batch()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Outbox dispatcher error: {str(e)}")
+
+        if not handled:
+            _wakeup.wait(OUTBOX_POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def start_dispatcher(app):
+    """
+    Start the outbox dispatcher threads for this process
+
+    Args:
+        app: The Flask application, used to push an app context per batch
+    """
+    global _app, _started_pid
+    _app = app
+    with _start_lock:
+        # Threads do not survive a fork, so start again in each gunicorn worker
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+
+        for i in range(OUTBOX_DISPATCHERS):
+            thread = threading.Thread(target=_dispatcher_loop, args=(app,), name=f"outbox-dispatcher-{i}", daemon=True)
+            thread.start()
+
+    logger.info(f"Started {OUTBOX_DISPATCHERS} outbox dispatchers in process {os.getpid()}")
+
+
+def ensure_dispatcher():
+    """Make sure the dispatcher is running in the current process"""
+    if _app is not None and _started_pid != os.getpid():
+        start_dispatcher(_app)
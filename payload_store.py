@@ -0,0 +1,274 @@
+import os
+import copy
+import gzip
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import select, update, bindparam, null
+from app import db
+from models import Contact, Message, MessagePayload
+from db_utils import upsert_insert
+from ttl_cache import TTLCache
+import job_queue
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Compression level of new payloads (zstd when zstandard is installed, else gzip)
+PAYLOAD_COMPRESSION_LEVEL = int(os.environ.get('PAYLOAD_COMPRESSION_LEVEL', 6))
+# Payloads (and their ids by hash) kept in memory per process
+PAYLOAD_CACHE_SIZE = int(os.environ.get('PAYLOAD_CACHE_SIZE', 256))
+
+# Stored payloads never change, the TTL only bounds how long a deleted one is remembered
+_CACHE_TTL = 24 * 3600
+
+# Job that moves payloads stored before migration 7 out of message_metadata,
+# BACKFILL_BATCH_SIZE messages per transaction
+BACKFILL_JOB_KIND = 'payload_backfill'
+BACKFILL_BATCH_SIZE = 1000
+# Seconds a backfill job runs before it re-queues itself, well below JOB_LOCK_TIMEOUT
+BACKFILL_SLICE_SECONDS = 60
+
+# Twilio form fields that are kept in Message and Contact columns
+TWILIO_FIELDS = ('MessageSid', 'SmsMessageSid', 'SmsSid', 'Body', 'From', 'WaId', 'ProfileName')
+
+_ids = TTLCache(PAYLOAD_CACHE_SIZE)  # hash -> payload id
+_envelopes = TTLCache(PAYLOAD_CACHE_SIZE)  # payload id -> envelope
+
+
+def _meta_changes(data):
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            yield change.get('value', {})
+
+
+def compact_payload(data, message_id):
+    """
+    Remove the fields of a webhook payload that the Message and Contact
+    columns already hold.
+
+    What is left (the envelope) is mostly the same for every message, so
+    identical envelopes are stored once.
+
+    Args:
+        data (dict): Twilio form fields or a Meta webhook body
+        message_id (str): Id of the message stored from the payload; other
+            messages of a Meta payload are kept whole
+
+    Returns:
+        tuple: (envelope, profile_name of the sender or None)
+    """
+    if 'Body' in data:
+        envelope = {key: value for key, value in data.items() if key not in TWILIO_FIELDS}
+        envelope['_stripped'] = [key for key in TWILIO_FIELDS if key in data]
+        return envelope, data.get('ProfileName') or None
+
+    envelope = copy.deepcopy(data)
+    profile_name = None
+    for value in _meta_changes(envelope):
+        sender = None
+        for msg in value.get('messages', []):
+            if msg.get('id') != message_id:
+                continue
+            sender = msg.pop('from', None)
+            msg.pop('id')
+            msg.pop('timestamp', None)
+            if msg.get('type', 'text') == 'text':
+                msg.pop('text', None)
+            msg['_stripped'] = True
+        if sender is None:
+            continue
+        for contact in value.get('contacts', []):
+            if contact.get('wa_id') == sender:
+                profile_name = contact.pop('profile', {}).get('name') or None
+                contact.pop('wa_id')
+                contact['_stripped'] = True
+    return envelope, profile_name
+
+
+def restore_payload(envelope, message, phone_number, profile_name=None):
+    """
+    Put the fields removed by compact_payload back into an envelope
+
+    Returns:
+        dict: The payload as it was received
+    """
+    data = copy.deepcopy(envelope)
+    if '_stripped' in data:
+        stripped = data.pop('_stripped')
+        values = {
+            'MessageSid': message.message_id,
+            'SmsMessageSid': message.message_id,
+            'SmsSid': message.message_id,
+            'Body': message.content,
+            'From': f"whatsapp:{phone_number}",
+            'WaId': phone_number.lstrip('+'),
+            'ProfileName': profile_name,
+        }
+        data.update((key, values[key]) for key in stripped)
+        return data
+
+    for value in _meta_changes(data):
+        for msg in value.get('messages', []):
+            if msg.pop('_stripped', False):
+                msg['id'] = message.message_id
+                msg['from'] = phone_number
+                msg['timestamp'] = str(int(message.timestamp.replace(tzinfo=timezone.utc).timestamp()))
+                if msg.get('type', 'text') == 'text':
+                    msg['text'] = {'body': message.content}
+        for contact in value.get('contacts', []):
+            if contact.pop('_stripped', False):
+                contact['profile'] = {'name': profile_name}
+                contact['wa_id'] = phone_number
+    return data
+
+
+def _encode(envelope):
+    return json.dumps(envelope, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def payload_row(raw, digest):
+    """
+    Build the MessagePayload column values of an encoded envelope
+
+    Returns:
+        dict: hash, encoding and compressed data
+    """
+    if zstandard is not None:
+        encoding, data = 'zstd', zstandard.ZstdCompressor(level=PAYLOAD_COMPRESSION_LEVEL).compress(raw)
+    else:
+        encoding, data = 'gzip', gzip.compress(raw, PAYLOAD_COMPRESSION_LEVEL, mtime=0)
+    return {'hash': digest, 'encoding': encoding, 'data': data, 'created_at': datetime.utcnow()}
+
+
+def _decode(encoding, data):
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Reading this payload requires zstandard (pip install zstandard)")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    else:
+        raw = gzip.decompress(data)
+    return json.loads(raw)
+
+
+def store_payload(envelope):
+    """
+    Store an envelope once, in the caller's transaction
+
+    Returns:
+        int: The id of the MessagePayload holding it
+    """
+    raw = _encode(envelope)
+    digest = hashlib.sha256(raw).hexdigest()
+    payload_id = _ids.get(digest)
+    if payload_id is not None:
+        # Known envelope: nothing to compress or write
+        return payload_id
+
+    row = payload_row(raw, digest)
+    payload_id = db.session.execute(
+        upsert_insert(MessagePayload).values(**row).on_conflict_do_nothing().returning(MessagePayload.id)
+    ).scalar()
+    if payload_id is None:
+        # Already stored; only ids of committed rows are cached, an insert may still roll back
+        payload_id = db.session.execute(select(MessagePayload.id).where(MessagePayload.hash == digest)).scalar()
+        _ids.set(digest, payload_id, _CACHE_TTL)
+    return payload_id
+
+
+def load_envelope(payload_id):
+    """Get a stored envelope, decompressing it on first use"""
+    envelope = _envelopes.get(payload_id)
+    if envelope is None:
+        payload = db.session.get(MessagePayload, payload_id)
+        if payload is None:
+            return None
+        envelope = _decode(payload.encoding, payload.data)
+        _envelopes.set(payload_id, envelope, _CACHE_TTL)
+    return envelope
+
+
+def load_payload(message):
+    """
+    Get the webhook payload a message was received with
+
+    Returns:
+        dict: The payload, or the message's metadata if it has no stored payload
+    """
+    if message.payload_id is None:
+        return message.message_metadata
+    envelope = load_envelope(message.payload_id)
+    if envelope is None:
+        return None
+    contact = message.contact
+    return restore_payload(envelope, message, contact.phone_number, contact.profile_name)
+
+
+# The messages and contacts of a backfill batch are updated with one executemany statement each
+_messages = Message.__table__
+_contacts = Contact.__table__
+_set_payload = update(_messages).where(_messages.c.id == bindparam('b_id')).values(
+    payload_id=bindparam('b_payload_id'), message_metadata=null()
+)
+_set_profile_name = update(_contacts).where(
+    _contacts.c.id == bindparam('b_id'), _contacts.c.profile_name.is_(None)
+).values(profile_name=bindparam('b_profile_name'))
+
+
+def _backfill_batch(last_id):
+    rows = db.session.execute(
+        select(Message.id, Message.message_id, Message.contact_id, Message.message_metadata).where(
+            Message.id > last_id, Message.payload_id.is_(None), Message.message_metadata.is_not(None)
+        ).order_by(Message.id).limit(BACKFILL_BATCH_SIZE)
+    ).all()
+
+    updates, profile_names = [], {}
+    for row in rows:
+        data = row.message_metadata
+        # Only webhook payloads; e.g. send errors of outgoing messages stay metadata
+        if not isinstance(data, dict) or not ('Body' in data or 'entry' in data):
+            continue
+        envelope, profile_name = compact_payload(data, row.message_id)
+        updates.append({'b_id': row.id, 'b_payload_id': store_payload(envelope)})
+        if profile_name and row.contact_id:
+            profile_names[row.contact_id] = profile_name
+
+    if updates:
+        db.session.execute(_set_payload, updates)
+    if profile_names:
+        db.session.execute(_set_profile_name, [
+            {'b_id': contact_id, 'b_profile_name': name} for contact_id, name in profile_names.items()
+        ])
+    db.session.commit()
+    return (rows[-1].id if rows else None), len(updates)
+
+
+def backfill_payloads(payload):
+    """
+    Job queue handler: move webhook payloads kept in message_metadata into
+    stored payloads
+
+    Every batch is committed on its own and converted messages no longer
+    match, so an interrupted job continues where it stopped when the queue
+    retries it.
+    """
+    last_id = payload.get('last_id', 0)
+    deadline = time.monotonic() + BACKFILL_SLICE_SECONDS
+    converted = 0
+    while True:
+        if job_queue.JOB_QUEUE_WORKERS > 0 and time.monotonic() >= deadline:
+            # Continue in a new queue job instead of holding this worker
+            job_queue.enqueue(BACKFILL_JOB_KIND, {'last_id': last_id})
+            break
+        batch_last_id, count = _backfill_batch(last_id)
+        if batch_last_id is None:
+            break
+        last_id = batch_last_id
+        converted += count
+    logger.info("Moved %d message payloads into stored payloads (up to message %d)", converted, last_id)
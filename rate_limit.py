@@ -0,0 +1,56 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows `rate` operations per second on average,
+    with bursts of up to `capacity` operations.
+
+    Threads and coroutines can share one bucket, so blocking and asyncio
+    callers stay within the same limit.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens=1):
+        """
+        Take tokens if they are available right now
+
+        Returns:
+            bool: True if the tokens were taken
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens=1):
+        """Get the seconds until `tokens` would be available"""
+        with self._lock:
+            self._refill(time.monotonic())
+            missing = tokens - self._tokens
+            return max(0.0, missing / self.rate) if self.rate > 0 else float('inf')
+
+    def acquire(self, tokens=1):
+        """Block until the tokens are available and take them"""
+        while not self.try_acquire(tokens):
+            time.sleep(self.wait_time(tokens))
+
+    async def acquire_async(self, tokens=1):
+        """Wait on the event loop until the tokens are available and take them"""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.wait_time(tokens))
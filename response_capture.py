@@ -0,0 +1,127 @@
+import os
+import gzip
+import queue
+import random
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 'off' (default), 'sample' (a fraction of responses plus every one that failed to parse) or 'all'
+ACPL_CAPTURE_MODE = os.environ.get('ACPL_CAPTURE_MODE', 'off').lower()
+ACPL_CAPTURE_SAMPLE_RATE = float(os.environ.get('ACPL_CAPTURE_SAMPLE_RATE', 0.01))
+# Number of recent responses kept in memory per process
+ACPL_CAPTURE_BUFFER_SIZE = int(os.environ.get('ACPL_CAPTURE_BUFFER_SIZE', 50))
+# Directory for the compressed on-disk archive; responses are only kept in memory when unset
+ACPL_CAPTURE_ARCHIVE_DIR = os.environ.get('ACPL_CAPTURE_ARCHIVE_DIR')
+# Oldest archive files are deleted beyond this count (0 disables the archive)
+ACPL_CAPTURE_ARCHIVE_MAX_FILES = int(os.environ.get('ACPL_CAPTURE_ARCHIVE_MAX_FILES', 500))
+if ACPL_CAPTURE_ARCHIVE_MAX_FILES < 0:
+    raise ValueError(f"Invalid ACPL_CAPTURE_ARCHIVE_MAX_FILES: {ACPL_CAPTURE_ARCHIVE_MAX_FILES} (expected 0 or more)")
+
+_buffer = deque(maxlen=ACPL_CAPTURE_BUFFER_SIZE)
+_archive_queue = queue.Queue(maxsize=100)
+_archive_lock = threading.Lock()
+_archive_thread = None
+
+
+def capture_enabled():
+    return ACPL_CAPTURE_MODE in ('sample', 'all')
+
+
+def _should_capture(result):
+    if ACPL_CAPTURE_MODE == 'all':
+        return True
+    if ACPL_CAPTURE_MODE != 'sample':
+        return False
+    # Responses the parser could not structure are the ones worth diagnosing
+    if result is not None and not result.get('tracking_data') and not result.get('not_found'):
+        return True
+    return random.random() < ACPL_CAPTURE_SAMPLE_RATE
+
+
+def capture_response(tracking_number, html, result=None):
+    """
+    Record a raw ACPL response if capturing is enabled and it is sampled
+
+    Args:
+        tracking_number (str): The GC number that was looked up
+        html (str): The raw response body
+        result (dict): The parsed tracking result, if any
+    """
+    if not _should_capture(result):
+        return
+
+    captured_at = datetime.utcnow()
+    _buffer.append({
+        'tracking_number': tracking_number,
+        'captured_at': captured_at.isoformat(),
+        'success': result.get('success') if result else None,
+        'size': len(html),
+        'html': html,
+    })
+
+    if ACPL_CAPTURE_ARCHIVE_DIR and ACPL_CAPTURE_ARCHIVE_MAX_FILES > 0:
+        _ensure_archive_thread()
+        try:
+            _archive_queue.put_nowait((tracking_number, captured_at, html))
+        except queue.Full:
+            logger.warning("Response archive queue is full, dropping captured response")
+
+
+def recent_responses(tracking_number=None, include_html=False):
+    """
+    Get the captured responses held in memory, newest first
+
+    Args:
+        tracking_number (str): Only return responses for this GC number
+        include_html (bool): Include the raw response bodies
+
+    Returns:
+        list: Captured response records
+    """
+    records = []
+    for record in reversed(list(_buffer)):
+        if tracking_number and record['tracking_number'] != tracking_number:
+            continue
+        if not include_html:
+            record = {k: v for k, v in record.items() if k != 'html'}
+        records.append(record)
+    return records
+
+
+def _archive_path(tracking_number, captured_at):
+    safe_number = ''.join(c for c in tracking_number if c.isalnum()) or 'unknown'
+    filename = f"{captured_at.strftime('%Y%m%dT%H%M%S%f')}_{safe_number}.html.gz"
+    return os.path.join(ACPL_CAPTURE_ARCHIVE_DIR, filename)
+
+
+def _rotate_archive():
+    files = sorted(f for f in os.listdir(ACPL_CAPTURE_ARCHIVE_DIR) if f.endswith('.html.gz'))
+    # Slice from the front: files[:-0] would keep everything
+    for filename in files[:max(len(files) - ACPL_CAPTURE_ARCHIVE_MAX_FILES, 0)]:
+        os.remove(os.path.join(ACPL_CAPTURE_ARCHIVE_DIR, filename))
+
+
+def _archive_loop():
+    while True:
+        tracking_number, captured_at, html = _archive_queue.get()
+        try:
+            os.makedirs(ACPL_CAPTURE_ARCHIVE_DIR, exist_ok=True)
+            with gzip.open(_archive_path(tracking_number, captured_at), 'wt', encoding='utf-8') as f:
+                f.write(html)
+            _rotate_archive()
+        except Exception as e:
+            logger.error(f"Error archiving captured response: {str(e)}")
+
+
+def _ensure_archive_thread():
+    global _archive_thread
+    if _archive_thread is not None and _archive_thread.is_alive():
+        return
+    with _archive_lock:
+        if _archive_thread is None or not _archive_thread.is_alive():
+            _archive_thread = threading.Thread(target=_archive_loop, name='response-archive', daemon=True)
+            _archive_thread.start()
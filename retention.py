@@ -0,0 +1,243 @@
+import os
+import gzip
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func, exists, or_, null, text
+from app import db
+from models import Contact, Message, MessagePayload, OutboxEntry, RetentionJob
+from db_utils import is_postgres
+import job_queue
+import payload_store
+
+logger = logging.getLogger(__name__)
+
+# Messages older than this many days are cleaned up daily (0 only cleans up on request)
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 0))
+# 'delete' old messages, or 'strip' their metadata and stored payload and keep the rest
+RETENTION_MODE = os.environ.get('RETENTION_MODE', 'delete')
+# Directory for gzip NDJSON archives of the cleaned up messages (unset: no archive)
+RETENTION_ARCHIVE_DIR = os.environ.get('RETENTION_ARCHIVE_DIR')
+# Message ids per batch; each batch is one short transaction
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 5000))
+# Seconds a job runs before it re-queues itself, well below JOB_LOCK_TIMEOUT
+RETENTION_SLICE_SECONDS = float(os.environ.get('RETENTION_SLICE_SECONDS', 60))
+
+# Seconds between checks whether a scheduled cleanup is due
+RETENTION_CHECK_SECONDS = 600
+RETENTION_INTERVAL = timedelta(days=1)
+# An unfinished job without progress for this long lost its queue entry and is resumed
+RETENTION_STALE_AFTER = timedelta(hours=1)
+# Key of the PostgreSQL advisory lock held while starting a job, so that
+# concurrent requests or schedulers do not start two
+RETENTION_LOCK_KEY = 7255002
+
+JOB_KIND = 'retention'
+MODES = ('delete', 'strip')
+
+
+def current_job():
+    """Get the unfinished retention job, if any"""
+    return RetentionJob.query.filter(RetentionJob.status != 'done').order_by(RetentionJob.id.desc()).first()
+
+
+def start_retention(days, mode='delete', archive=None):
+    """
+    Queue a cleanup of messages older than `days` days, unless one is running
+
+    Args:
+        days (int): Age in days of the oldest messages to keep
+        mode (str): 'delete' the messages or 'strip' their metadata
+        archive (bool): Archive the messages first; None archives when
+            RETENTION_ARCHIVE_DIR is set
+
+    Returns:
+        tuple: (job, created); job is the running job if created is False
+
+    Raises:
+        ValueError: If an argument is invalid
+    """
+    if days < 1:
+        raise ValueError(f"Invalid number of days: {days} (expected at least 1)")
+    if mode not in MODES:
+        raise ValueError(f"Invalid cleanup mode: {mode} (expected delete or strip)")
+    if archive is None:
+        archive = bool(RETENTION_ARCHIVE_DIR)
+    elif archive and not RETENTION_ARCHIVE_DIR:
+        raise ValueError("Archiving requires RETENTION_ARCHIVE_DIR to be set")
+
+    if is_postgres():
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': RETENTION_LOCK_KEY})
+    running = current_job()
+    if running is not None:
+        db.session.commit()
+        return running, False
+
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    job = RetentionJob(mode=mode, cutoff=cutoff, status='pending')
+    db.session.add(job)
+    db.session.flush()
+    if archive:
+        job.archive_path = os.path.join(RETENTION_ARCHIVE_DIR, f"messages-{cutoff:%Y%m%d}-{job.id}.ndjson.gz")
+    db.session.commit()
+
+    logger.info(f"Queued retention job {job.id}: {mode} messages before {cutoff}")
+    job_queue.enqueue(JOB_KIND, {'retention_job_id': job.id})
+    return job, True
+
+
+def _conditions(job):
+    conditions = [
+        Message.timestamp < job.cutoff,
+        # Messages still waiting in the outbox are referenced by their entry
+        ~exists().where(OutboxEntry.message_id == Message.id),
+    ]
+    if job.mode == 'strip':
+        conditions.append(or_(Message.message_metadata.is_not(None), Message.payload_id.is_not(None)))
+    return conditions
+
+
+def _begin(job):
+    # Fix the range up front, so the job ends even while new messages arrive
+    conditions = _conditions(job)
+    job.max_id = db.session.execute(select(func.max(Message.id)).where(*conditions)).scalar() or 0
+    job.total = db.session.execute(select(func.count()).select_from(Message).where(*conditions)).scalar()
+    job.status = 'running'
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def _archive_record(row):
+    record = {column.name: row._mapping[column] for column in Message.__table__.columns}
+    if row.payload_id is not None:
+        # Archive the payload as it was received, not its shared envelope
+        envelope = payload_store.load_envelope(row.payload_id)
+        if envelope is not None:
+            record['message_metadata'] = payload_store.restore_payload(
+                envelope, row, row.phone_number or '', row.profile_name
+            )
+    return record
+
+
+def _archive(path, rows):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # Every batch is appended as its own gzip member, which gzip readers
+    # read as one file; a batch interrupted before its commit is archived again
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(_archive_record(row), default=_json_default, ensure_ascii=False) + '\n')
+
+
+def _process_batch(job):
+    # Ranges of the primary key keep each statement on a short index range,
+    # so no batch holds its locks for long
+    high = min(job.last_id + RETENTION_BATCH_SIZE, job.max_id)
+    conditions = _conditions(job) + [Message.id > job.last_id, Message.id <= high]
+
+    if job.archive_path:
+        rows = db.session.execute(
+            select(Message.__table__, Contact.phone_number, Contact.profile_name)
+            .outerjoin(Contact, Message.contact_id == Contact.id)
+            .where(*conditions).order_by(Message.id)
+        ).all()
+        if rows:
+            _archive(job.archive_path, rows)
+
+    payload_ids = db.session.execute(
+        select(Message.payload_id).where(*conditions, Message.payload_id.is_not(None)).distinct()
+    ).scalars().all()
+
+    if job.mode == 'delete':
+        stmt = delete(Message).where(*conditions)
+    else:
+        stmt = update(Message).where(*conditions).values(message_metadata=null(), payload_id=None)
+    result = db.session.execute(stmt.execution_options(synchronize_session=False))
+
+    if payload_ids:
+        # Payloads are shared, so only the ones no other message uses any more go.
+        # Processes cache payload ids for a day after a message used them; the
+        # messages cleaned up here are older than that (days is at least 1).
+        db.session.execute(delete(MessagePayload).where(
+            MessagePayload.id.in_(payload_ids),
+            ~exists().where(Message.payload_id == MessagePayload.id),
+        ).execution_options(synchronize_session=False))
+
+    job.processed += result.rowcount
+    job.last_id = high
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+
+def run_retention_job(payload):
+    """
+    Job queue handler: clean up the next batches of a RetentionJob
+
+    Progress is committed after every batch, so a job that is interrupted
+    continues where it stopped when the queue retries it.
+    """
+    job = db.session.get(RetentionJob, payload['retention_job_id'])
+    if job is None or job.status == 'done':
+        return
+
+    try:
+        if job.status == 'pending':
+            _begin(job)
+
+        deadline = time.monotonic() + RETENTION_SLICE_SECONDS
+        while job.last_id < job.max_id:
+            if job_queue.JOB_QUEUE_WORKERS > 0 and time.monotonic() >= deadline:
+                # Continue in a new queue job instead of holding this worker
+                job_queue.enqueue(JOB_KIND, payload)
+                return
+            _process_batch(job)
+
+        job.status = 'done'
+        job.last_error = None
+        job.finished_at = job.updated_at = datetime.utcnow()
+        db.session.commit()
+        logger.info(f"Retention job {job.id} done: {job.mode} {job.processed} messages")
+    except Exception as e:
+        db.session.rollback()
+        db.session.execute(update(RetentionJob).where(RetentionJob.id == payload['retention_job_id']).values(
+            last_error=str(e), updated_at=datetime.utcnow()
+        ))
+        db.session.commit()
+        raise
+
+
+def schedule():
+    """Periodic task: start the daily cleanup, or resume one that stalled"""
+    job = current_job()
+    if job is not None:
+        if job.updated_at < datetime.utcnow() - RETENTION_STALE_AFTER:
+            logger.warning(f"Resuming stalled retention job {job.id}")
+            job.updated_at = datetime.utcnow()
+            db.session.commit()
+            job_queue.enqueue(JOB_KIND, {'retention_job_id': job.id})
+        return
+
+    last = RetentionJob.query.order_by(RetentionJob.id.desc()).first()
+    if last is None or last.created_at < datetime.utcnow() - RETENTION_INTERVAL:
+        start_retention(RETENTION_DAYS, RETENTION_MODE)
+
+
+def retention_job_to_dict(job):
+    """Serialize a retention job and its progress for the API"""
+    return {
+        'id': job.id,
+        'mode': job.mode,
+        'status': job.status,
+        'cutoff': job.cutoff.isoformat(),
+        'processed': job.processed or 0,
+        'total': job.total,
+        'progress': (job.processed or 0) / job.total if job.total else (1.0 if job.status == 'done' else 0.0),
+        'archive_path': job.archive_path,
+        'last_error': job.last_error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
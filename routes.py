@@ -2,17 +2,41 @@ import logging
 import json
 import os
 from datetime import datetime, timedelta
-from flask import render_template, request, jsonify, redirect, url_for, flash, session
-from sqlalchemy import func
+from flask import render_template, request, jsonify, redirect, url_for, flash, session, Response, stream_with_context
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import joinedload
 from app import app, db
-from models import User, Contact, Message, Automation, MessageStats
+from models import User, Contact, Message, Automation, MessageStats, MessageHourlyStats, RetentionJob
 from whatsapp_api import verify_whatsapp_webhook
-from twilio_api import send_whatsapp_message as send_message
+from outbound_sender import send_async as send_message_async
+import job_queue
+import outbox
+import status_buffer
+import stats_counter
+import contact_resolver
+import conversation
+import webhook_dedup
+import payload_store
+import migrations
+import retention
+import scheduler
+import shipment_watch
+from db_utils import upsert_insert
+from webhook_payload import parse_messages, message_ids as webhook_message_ids
+from message_query import parse_filters, page_messages, message_to_dict, MAX_MESSAGES_PER_PAGE
+from message_export import export_messages, file_type as export_file_type
+from automation_index import match_automations, invalidate as invalidate_automations
 
 # Initialize logger
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Maximum GC numbers looked up from a single TRACK message
+TRACK_MAX_NUMBERS = int(os.environ.get('TRACK_MAX_NUMBERS', 10))
+# Maximum GC numbers accepted by one /api/track request
+BULK_TRACK_MAX_NUMBERS = int(os.environ.get('BULK_TRACK_MAX_NUMBERS', 500))
+# Seconds /api/send_message waits for the queued message to be sent
+SEND_MESSAGE_TIMEOUT = 60
+
 # Initialize default automations
 def create_default_automations():
     """Create default automations on startup"""
@@ -29,6 +53,9 @@ Thank you for using our tracking service! Here are the available commands:
 *TRACK [number]* - Track an ACPL cargo shipment
 Example: TRACK 2504500644
 
+*SUBSCRIBE [number]* - Get a message whenever the shipment moves
+*UNSUBSCRIBE [number]* - Stop shipment updates
+
 *HELP* - Show this help message
 
 For any assistance, please contact our support team.
@@ -56,26 +83,18 @@ def index():
 
 @app.route('/dashboard')
 def dashboard():
-    # Get message statistics for the last 7 days
-    end_date = datetime.now().date()
+    # Everything on the page comes from the rollup tables (or an index), so it
+    # renders in the same time however many messages there are
+    now = datetime.utcnow()
+    end_date = now.date()
     start_date = end_date - timedelta(days=6)
     
     # This would be filtered by user_id in a real multi-user application
-    daily_stats = db.session.query(
-        func.date(Message.timestamp).label('date'),
-        func.count(Message.id).filter(Message.direction == 'incoming').label('received'),
-        func.count(Message.id).filter(Message.direction == 'outgoing').label('sent')
-    ).filter(
-        func.date(Message.timestamp) >= start_date,
-        func.date(Message.timestamp) <= end_date
-    ).group_by(
-        func.date(Message.timestamp)
+    daily_stats = MessageStats.query.filter(
+        MessageStats.date >= start_date,
+        MessageStats.date < end_date + timedelta(days=1)
     ).all()
-    
-    # Convert query result to dict for easier handling in template
-    stats_by_date = {}
-    for date, received, sent in daily_stats:
-        stats_by_date[date.strftime('%Y-%m-%d')] = {'received': received, 'sent': sent}
+    stats_by_date = {stats.date: stats for stats in daily_stats}
     
     # Ensure all dates in range are represented
     date_labels = []
@@ -84,25 +103,35 @@ def dashboard():
     
     current_date = start_date
     while current_date <= end_date:
-        date_str = current_date.strftime('%Y-%m-%d')
-        date_labels.append(date_str)
+        date_labels.append(current_date.strftime('%Y-%m-%d'))
         
-        stats = stats_by_date.get(date_str, {'received': 0, 'sent': 0})
-        received_data.append(stats['received'])
-        sent_data.append(stats['sent'])
+        stats = stats_by_date.get(current_date)
+        received_data.append((stats.messages_received or 0) if stats else 0)
+        sent_data.append((stats.messages_sent or 0) if stats else 0)
         
         current_date += timedelta(days=1)
     
-    # Get contact statistics
-    total_contacts = Contact.query.count()
+    # Totals over all days
+    incoming_messages, outgoing_messages, total_contacts = db.session.query(
+        func.coalesce(func.sum(MessageStats.messages_received), 0),
+        func.coalesce(func.sum(MessageStats.messages_sent), 0),
+        func.coalesce(func.sum(MessageStats.new_contacts), 0)
+    ).one()
+    total_messages = incoming_messages + outgoing_messages
+    
+    # Contacts seen in the last 7 days (index range scan)
     active_contacts = Contact.query.filter(
-        Contact.last_interaction >= datetime.now() - timedelta(days=7)
+        Contact.last_interaction >= now - timedelta(days=7)
     ).count()
     
-    # Get message statistics
-    total_messages = Message.query.count()
-    incoming_messages = Message.query.filter_by(direction='incoming').count()
-    outgoing_messages = Message.query.filter_by(direction='outgoing').count()
+    # Messages in the last 24 hours from the hourly rollup
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    recent_messages = db.session.query(
+        func.coalesce(func.sum(MessageHourlyStats.count), 0)
+    ).filter(
+        MessageHourlyStats.hour >= current_hour - timedelta(hours=23),
+        MessageHourlyStats.hour < current_hour + timedelta(hours=1)
+    ).scalar()
     
     return render_template(
         'dashboard.html',
@@ -113,17 +142,28 @@ def dashboard():
         active_contacts=active_contacts,
         total_messages=total_messages,
         incoming_messages=incoming_messages,
-        outgoing_messages=outgoing_messages
+        outgoing_messages=outgoing_messages,
+        recent_messages=recent_messages,
+        week_received=sum(received_data),
+        week_sent=sum(sent_data)
     )
 
 @app.route('/messages')
 def messages():
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    
-    messages = Message.query.order_by(Message.timestamp.desc()).paginate(page=page, per_page=per_page)
+    try:
+        filters = parse_filters(request.args)
+        messages, next_cursor = page_messages(filters, cursor=request.args.get('cursor'))
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('messages'))
     
-    return render_template('messages.html', messages=messages)
+    return render_template(
+        'messages.html',
+        messages=messages,
+        filters=filters,
+        next_cursor=next_cursor,
+        is_first_page=not request.args.get('cursor')
+    )
 
 @app.route('/automations')
 def automations():
@@ -144,23 +184,29 @@ def test():
 
 @app.route('/api/messages', methods=['GET'])
 def api_messages():
-    limit = request.args.get('limit', 5, type=int)
-    messages = Message.query.order_by(Message.timestamp.desc()).limit(limit).all()
-    
-    result = []
-    for message in messages:
-        result.append({
-            'id': message.id,
-            'phone_number': message.contact.phone_number,
-            'contact_name': message.contact.name,
-            'content': message.content,
-            'timestamp': message.timestamp.isoformat(),
-            'direction': message.direction,
-            'message_type': message.message_type,
-            'status': message.status
-        })
+    limit = min(max(request.args.get('limit', 5, type=int), 1), MAX_MESSAGES_PER_PAGE)
+    try:
+        filters = parse_filters(request.args)
+        messages, next_cursor = page_messages(filters, cursor=request.args.get('cursor'), limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'messages': [message_to_dict(message) for message in messages],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/messages/<int:message_id>', methods=['GET'])
+def api_message(message_id):
+    """One message with the webhook payload it was received with"""
+    message = db.session.get(Message, message_id, options=[joinedload(Message.contact)])
+    if message is None:
+        return jsonify({'error': 'Message not found'}), 404
     
-    return jsonify(result)
+    data = message_to_dict(message)
+    # Payloads are only decompressed and rebuilt here, not for the message lists
+    data['payload'] = payload_store.load_payload(message)
+    return jsonify(data)
 
 @app.route('/api/send_message', methods=['POST'])
 def api_send_message():
@@ -169,7 +215,7 @@ def api_send_message():
         return jsonify({'error': 'Missing phone or message parameter'}), 400
     
     try:
-        result = send_message(data['phone'], data['message'])
+        result = send_message_async(data['phone'], data['message']).result(timeout=SEND_MESSAGE_TIMEOUT)
         return jsonify({'success': True, 'result': result})
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
@@ -200,6 +246,7 @@ def api_automations():
             )
             db.session.add(automation)
             db.session.commit()
+            invalidate_automations()
             return jsonify({'success': True, 'id': automation.id})
         except Exception as e:
             db.session.rollback()
@@ -219,6 +266,7 @@ def api_automations():
             automation.is_active = data.get('is_active', automation.is_active)
             
             db.session.commit()
+            invalidate_automations()
             return jsonify({'success': True})
         except Exception as e:
             db.session.rollback()
@@ -233,6 +281,7 @@ def api_automations():
             
             db.session.delete(automation)
             db.session.commit()
+            invalidate_automations()
             return jsonify({'success': True})
         except Exception as e:
             db.session.rollback()
@@ -258,16 +307,63 @@ def api_settings():
 
 @app.route('/api/export/messages', methods=['GET'])
 def api_export_messages():
-    # In a real app, this would export messages to a CSV file
-    # Here we're just returning a dummy response
-    return jsonify({'success': False, 'error': 'Export feature not implemented yet'}), 501
+    """
+    Stream all matching messages as a file download. Takes the filters of
+    /api/messages plus format=csv|ndjson|parquet and gzip=1.
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    try:
+        filters = parse_filters(request.args)
+        chunks = export_messages(filters, fmt, compress)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    mimetype, extension = export_file_type(fmt, compress)
+    logger.info(f"Exporting messages as {extension} with filters {filters}")
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename="messages-{datetime.utcnow():%Y%m%d-%H%M%S}.{extension}"',
+            # Send chunks as they are produced instead of buffering the whole file in a proxy
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 @app.route('/api/cleanup', methods=['POST'])
 def api_cleanup():
+    """
+    Start a background cleanup of messages older than ?days=N. mode=strip
+    only removes their metadata; archive=0/1 overrides RETENTION_ARCHIVE_DIR.
+    """
     days = request.args.get('days', 30, type=int)
-    # In a real app, this would delete old messages
-    # Here we're just returning a dummy response
-    return jsonify({'success': False, 'error': 'Cleanup feature not implemented yet'}), 501
+    mode = request.args.get('mode', 'delete')
+    archive = request.args.get('archive')
+    if archive is not None:
+        archive = archive.lower() in ('1', 'true', 'yes')
+    try:
+        job, created = retention.start_retention(days, mode, archive)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    response = {
+        'success': created,
+        'job': retention.retention_job_to_dict(job),
+        'status_url': url_for('api_cleanup_status', job_id=job.id)
+    }
+    if not created:
+        response['error'] = 'A cleanup is already running'
+        return jsonify(response), 409
+    return jsonify(response), 202
+
+@app.route('/api/cleanup/<int:job_id>', methods=['GET'])
+def api_cleanup_status(job_id):
+    """Progress of a cleanup started by /api/cleanup"""
+    job = db.session.get(RetentionJob, job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Cleanup job not found'}), 404
+    return jsonify({'success': True, 'job': retention.retention_job_to_dict(job)})
 
 @app.route('/api/test/track', methods=['POST'])
 def api_test_track():
@@ -279,12 +375,12 @@ def api_test_track():
             
         tracking_number = data['tracking_number'].strip()
         
-        # Import the tracking function
-        from acpl_tracker import track_acpl_cargo
+        # Import the cached tracking lookup
+        from tracking_cache import get_tracking_result
         
         # Get tracking information
         logger.info(f"Testing tracking for ACPL cargo number: {tracking_number}")
-        tracking_result = track_acpl_cargo(tracking_number)
+        tracking_result = get_tracking_result(tracking_number)
         
         # Return raw tracking result
         return jsonify({
@@ -298,30 +394,92 @@ def api_test_track():
         logger.error(f"Error in test tracking: {str(e)}")
         return jsonify({'success': False, 'message': f"Error: {str(e)}"}), 500
 
+@app.route('/api/track', methods=['POST'])
+def api_track():
+    """
+    Bulk tracking endpoint. Accepts {"tracking_numbers": [...]} (a list or a
+    comma/space separated string) and streams one NDJSON line per GC number as
+    each lookup finishes.
+    """
+    data = request.json
+    if not data or 'tracking_numbers' not in data:
+        return jsonify({'success': False, 'message': 'Missing tracking_numbers'}), 400
+    
+    from acpl_tracker import parse_tracking_numbers
+    from tracking_cache import track_many
+    
+    tracking_numbers = data['tracking_numbers']
+    if isinstance(tracking_numbers, str):
+        tracking_numbers = parse_tracking_numbers(tracking_numbers)
+    elif isinstance(tracking_numbers, list):
+        tracking_numbers = parse_tracking_numbers(' '.join(str(n) for n in tracking_numbers))
+    else:
+        return jsonify({'success': False, 'message': 'tracking_numbers must be a list or a string'}), 400
+    
+    if not tracking_numbers:
+        return jsonify({'success': False, 'message': 'Missing tracking_numbers'}), 400
+    if len(tracking_numbers) > BULK_TRACK_MAX_NUMBERS:
+        return jsonify({
+            'success': False,
+            'message': f"At most {BULK_TRACK_MAX_NUMBERS} tracking numbers per request"
+        }), 400
+    
+    logger.info(f"Bulk tracking {len(tracking_numbers)} ACPL cargo numbers")
+    
+    def generate():
+        for tracking_number, result in track_many(tracking_numbers):
+            yield json.dumps({
+                'tracking_number': tracking_number,
+                'success': result.get('success', False),
+                'message': result.get('message', ''),
+                'tracking_data': result.get('tracking_data'),
+                'raw_content': result.get('raw_content')
+            }) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/tracking/cache', methods=['GET'])
+def api_tracking_cache():
+    """Hit/miss counters of the tracking result cache for this worker"""
+    from tracking_cache import cache_stats
+    return jsonify(cache_stats())
+
+@app.route('/api/webhook/dedup', methods=['GET'])
+def api_webhook_dedup():
+    """Duplicate webhook delivery counters for this worker"""
+    return jsonify(webhook_dedup.stats())
+
+@app.route('/api/debug/tracking-responses', methods=['GET'])
+def api_debug_tracking_responses():
+    """Recently captured raw ACPL responses (requires ACPL_CAPTURE_MODE=sample or all)"""
+    from response_capture import capture_enabled, recent_responses
+    
+    if not capture_enabled():
+        return jsonify({'error': 'Response capture is disabled'}), 404
+    
+    return jsonify(recent_responses(
+        tracking_number=request.args.get('tracking_number'),
+        include_html=request.args.get('include_html', 'false').lower() in ('true', '1')
+    ))
+
 # WhatsApp Webhook Endpoint
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
-    # Log all incoming requests regardless of method
-    print(f"WEBHOOK REQUEST: Method={request.method}, Headers={dict(request.headers)}")
+    # Headers and payloads hold phone numbers and message text, so only their shape is logged
+    logger.debug("Webhook %s request (%s bytes)", request.method, request.content_length or 0)
     
     if request.method == 'GET':
         # For Meta WhatsApp Business API verification
-        print(f"WEBHOOK GET: Query params={request.args}")
         return verify_whatsapp_webhook(request)
     
     elif request.method == 'POST':
         # Process incoming webhook data
         try:
-            print("WEBHOOK POST: Received webhook POST request")
-            
             # Check if this is a Twilio webhook (form data)
             if request.form:
                 # Twilio webhook data comes as form data
                 data = request.form.to_dict()
-                print(f"WEBHOOK POST: Received form data: {data}")
-                
-                if 'Body' in data:
-                    print(f"WEBHOOK POST: Message content: {data['Body']}")
+                logger.debug("Received Twilio form data")
                 
                 # Verify that this is a genuine Twilio request
                 from twilio_api import verify_twilio_webhook_signature
@@ -330,261 +488,327 @@ def webhook():
                 is_test_request = request.headers.get('X-Webhook-Simulator') == 'true'
                 
                 if not is_test_request and not verify_twilio_webhook_signature(request):
-                    print("WEBHOOK POST: Invalid Twilio webhook signature")
                     logger.warning("Invalid Twilio webhook signature")
                     return jsonify({'error': 'Invalid signature'}), 403
                     
                 if is_test_request:
-                    print("WEBHOOK POST: Test request from simulator - bypassing signature verification")
+                    logger.debug("Test request from simulator - bypassing signature verification")
                 
             else:
                 # Check if this is JSON data
                 try:
                     # Meta WhatsApp format (JSON)
                     data = request.json
-                    print(f"WEBHOOK POST: Received JSON data: {data}")
+                    logger.debug("Received JSON webhook data")
                 except:
-                    # If not JSON or form, try to get raw data
-                    print(f"WEBHOOK POST: No form or JSON data, raw data: {request.get_data()}")
+                    # Neither JSON nor form data
+                    logger.warning("Unsupported webhook data (%s)", request.content_type)
                     return jsonify({'error': 'Unsupported data format'}), 400
             
-            # Process the incoming message
-            print("WEBHOOK POST: Processing incoming message")
-            process_incoming_message(data)
+            # Twilio and Meta retry deliveries they got no timely answer for
+            message_ids = webhook_message_ids(data)
+            if webhook_dedup.is_duplicate(message_ids):
+                logger.info("Ignoring repeated delivery of messages %s", message_ids)
+            else:
+                # Persist the raw payload; a background worker processes it
+                job_queue.enqueue('webhook', {'received_at': datetime.utcnow().isoformat(), 'data': data})
+                webhook_dedup.remember(message_ids)
             
             # For Twilio, return a TwiML response (XML)
             if request.form and 'Body' in request.form:
-                print("WEBHOOK POST: Returning 204 No Content for Twilio")
                 # Return a simple 204 No Content response
-                # We'll handle responses asynchronously to avoid Twilio's 10s timeout
+                # Responses are sent by the job workers to avoid Twilio's 10s timeout
                 return ('', 204)
             else:
                 # For other webhook formats, return JSON
-                print("WEBHOOK POST: Returning success JSON response")
                 return jsonify({'success': True})
                 
         except Exception as e:
-            print(f"WEBHOOK ERROR: {str(e)}")
             logger.error(f"Error processing webhook: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
-def process_incoming_message(data):
-    """Process incoming WhatsApp message from webhook data"""
+# Twilio delivery status callbacks (TWILIO_STATUS_CALLBACK_URL)
+@app.route('/webhook/status', methods=['POST'])
+def webhook_status():
+    """Record a MessageStatus callback; statuses are buffered and written in bulk"""
+    status_buffer.record_status(request.form.get('MessageSid'), request.form.get('MessageStatus'))
+    return ('', 204)
+
+def process_incoming_message(job):
+    """
+    Store the messages of a webhook payload and queue a reply job for each.
+    
+    All messages of a (Meta) batch are written with one contact upsert, one
+    message insert and one commit; the replies are worked out in parallel
+    by the job workers.
+    
+    Args:
+        job (dict): The webhook payload ('data') and when it arrived ('received_at')
+    """
     try:
-        logger.debug(f"Processing webhook data: {data}")
+        received_at = datetime.fromisoformat(job['received_at'])
+        incoming = parse_messages(job['data'])
+        if not incoming:
+            logger.warning("No valid message found in webhook data")
+            return
         
-        # Handle Twilio WhatsApp webhook format
-        if 'Body' in data:
-            # Twilio webhook format
-            message_id = data.get('MessageSid', 'unknown')
-            from_number = data.get('From', '').replace('whatsapp:', '')
-            timestamp = datetime.utcnow()  # Twilio doesn't provide timestamp in the same way
-            message_type = 'text'
-            content = data.get('Body', '')
-            
-            logger.info(f"Received Twilio WhatsApp message: {content} from {from_number}")
-            
-        # Handle Meta WhatsApp Business API format
-        elif 'entry' in data:
-            # Meta WhatsApp Business API format
-            if 'entry' not in data:
-                logger.warning("No 'entry' in webhook data")
-                return
-            
-            for entry in data['entry']:
-                if 'changes' not in entry:
-                    continue
-                
-                for change in entry['changes']:
-                    if change.get('field') != 'messages':
-                        continue
-                    
-                    value = change.get('value', {})
-                    if 'messages' not in value:
-                        continue
-                    
-                    for msg in value['messages']:
-                        # Extract message details
-                        message_id = msg.get('id')
-                        from_number = msg.get('from')
-                        timestamp = datetime.fromtimestamp(int(msg.get('timestamp', 0)))
-                        message_type = msg.get('type', 'text')
-                        
-                        # Get message content based on type
-                        content = ""
-                        if message_type == 'text':
-                            content = msg.get('text', {}).get('body', '')
-                        elif message_type == 'image':
-                            content = "[Image]"  # In a real app, you'd process the image URL
-            
-            # Return if we didn't find a valid message
-            if not content:
-                logger.warning("No valid message found in webhook data")
-                return
-        else:
-            logger.warning("Unknown webhook format")
+        # Skip messages an earlier delivery already stored (or repeated in this one)
+        message_ids = [item['message_id'] for item in incoming if item['message_id']]
+        seen = set(db.session.execute(
+            select(Message.message_id).where(Message.message_id.in_(message_ids))
+        ).scalars()) if message_ids else set()
+        fresh = []
+        for item in incoming:
+            if item['message_id'] in seen:
+                continue
+            if item['message_id']:
+                seen.add(item['message_id'])
+            fresh.append(item)
+        webhook_dedup.record_stored_duplicates(len(incoming) - len(fresh))
+        incoming = fresh
+        if not incoming:
+            logger.info("Messages %s were already stored", message_ids)
             return
         
-        # Find or create contact
-        contact = Contact.query.filter_by(phone_number=from_number).first()
-        if not contact:
-            contact = Contact(
-                phone_number=from_number,
-                first_interaction=timestamp,
-                last_interaction=timestamp
-            )
-            db.session.add(contact)
-        else:
-            contact.last_interaction = timestamp
+        for item in incoming:
+            logger.info("Received WhatsApp %s message %s from %s",
+                        item['message_type'], item['message_id'], item['from_number'])
+            # Keep only what the columns below do not hold, stored once per distinct envelope
+            envelope, item['profile_name'] = payload_store.compact_payload(item['payload'], item['message_id'])
+            item['payload_id'] = payload_store.store_payload(envelope)
         
-        # Create message record
-        message = Message(
-            message_id=message_id,
-            contact=contact,
-            content=content,
-            timestamp=timestamp,
-            direction='incoming',
-            message_type=message_type,
-            status='received',
-            message_metadata=data
+        contact_ids, new_numbers = contact_resolver.resolve(
+            (item['from_number'], item['timestamp'], item['profile_name']) for item in incoming
         )
-        db.session.add(message)
-        db.session.commit()
         
-        # Check for tracking commands
-        if content.strip().upper().startswith('TRACK '):
-            process_tracking_command(contact, content)
-        # Check for help command
-        elif content.strip().upper() == 'HELP':
-            check_automations(contact, content)
-        else:
-            # Process automations for other messages
-            check_automations(contact, content)
+        # A concurrent delivery of the same message is left out by ON CONFLICT
+        inserted = db.session.execute(
+            upsert_insert(Message).values([
+                {
+                    'message_id': item['message_id'],
+                    'contact_id': contact_ids[item['from_number']],
+                    'content': item['content'],
+                    'timestamp': item['timestamp'],
+                    'received_at': received_at,
+                    'direction': 'incoming',
+                    'message_type': item['message_type'],
+                    'status': 'new',  # 'received' once answered
+                    'payload_id': item['payload_id']
+                }
+                for item in incoming
+            ]).on_conflict_do_nothing(index_elements=[Message.message_id]).returning(
+                Message.id, Message.message_id, Message.contact_id
+            )
+        ).all()
+        inserted_ids = {message_id for _, message_id, _ in inserted}
+        webhook_dedup.record_stored_duplicates(len(incoming) - len(inserted))
+        
+        # One reply job per contact, answering its messages in order; committed together with the messages
+        latest = {}
+        for row_id, _, contact_id in inserted:
+            latest[contact_id] = max(row_id, latest.get(contact_id, row_id))
+        job_queue.enqueue_many('reply', [
+            {'contact_id': contact_id, 'message_id': row_id} for contact_id, row_id in latest.items()
+        ])
         
         # Update statistics
-        update_stats(contact, 'incoming')
+        for item in incoming:
+            if item['message_id'] and item['message_id'] not in inserted_ids:
+                continue
+            new_contact = item['from_number'] in new_numbers
+            new_numbers.discard(item['from_number'])
+            stats_counter.record_incoming(contact_ids[item['from_number']], new_contact=new_contact)
         
-        logger.info(f"Processed incoming message {message_id} from {from_number}")
+        logger.info("Stored %d incoming messages", len(inserted))
     
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error processing message: {str(e)}")
         raise
 
+def reply_to_message(payload):
+    """
+    Answer a contact's unanswered incoming messages, oldest first, up to the
+    one in the payload.
+    
+    Each message is answered and committed on its own while holding the
+    contact's conversation lock, so a follow-up is never answered before the
+    message it follows, even when reply jobs for the contact run concurrently.
+    A retried job skips the messages it already answered.
+    """
+    try:
+        while True:
+            with conversation.contact_lock(payload['contact_id']):
+                message = db.session.execute(
+                    select(Message).options(joinedload(Message.contact)).where(
+                        Message.contact_id == payload['contact_id'],
+                        Message.direction == 'incoming',
+                        Message.status == 'new',
+                        Message.id <= payload['message_id']
+                    ).order_by(Message.id).limit(1)
+                ).scalar()
+                if message is None:
+                    db.session.commit()
+                    return
+                answer_message(message)
+    
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error replying to message: {str(e)}")
+        raise
+
+def answer_message(message):
+    """Work out the replies to a stored incoming message, queue them and mark it answered"""
+    contact = message.contact
+    
+    # Prompts, follow-ups and rate limits of the contact's conversation so far
+    command = conversation.next_command(contact.id, message.content, message.message_id or message.id)
+    
+    # Work out the replies first. Lookups run with autoflush off so no
+    # write locks are held while the tracking site is queried.
+    with db.session.no_autoflush:
+        if command.replies is not None:
+            replies = command.replies
+        # Check for tracking commands
+        elif command.name == 'TRACK':
+            replies = process_tracking_command(contact, command.text)
+        # Check for shipment watch commands
+        elif command.name in ('SUBSCRIBE', 'UNSUBSCRIBE'):
+            replies = process_subscription_command(contact, command.text)
+        else:
+            # HELP and all other messages are answered by the automations
+            replies = check_automations(contact, command.text)
+    
+    # Queue the replies in one transaction (response time is measured to the first one)
+    for i, reply in enumerate(replies):
+        notify_contact(contact, reply, reply_to=message if i == 0 else None)
+    message.status = 'received'
+    
+    db.session.commit()
+    outbox.wake()
+    
+    logger.info("Processed incoming message %s from %s", message.message_id, contact.phone_number)
+
 def check_automations(contact, message_content):
-    """Check if any automations should be triggered by this message"""
-    # Get all active keyword automations
-    keyword_automations = Automation.query.filter_by(
-        trigger_type='keyword',
-        is_active=True
-    ).all()
+    """Get the replies of the automations triggered by this message"""
+    # Match all active keyword automations in a single pass over the message
+    automations = match_automations(message_content)
+    if not automations:
+        return []
     
-    for automation in keyword_automations:
-        keywords = [k.strip().lower() for k in automation.trigger_value.split(',')]
-        if any(keyword in message_content.lower() for keyword in keywords):
-            # Trigger automation
-            try:
-                send_message(contact.phone_number, automation.response_text)
-                
-                # Update automation last triggered time
-                automation.last_triggered = datetime.utcnow()
-                db.session.commit()
-                
-                # Log outgoing message
-                message = Message(
-                    contact=contact,
-                    content=automation.response_text,
-                    direction='outgoing',
-                    message_type='text',
-                    status='sent'
-                )
-                db.session.add(message)
-                db.session.commit()
-                
-                # Update statistics
-                update_stats(contact, 'outgoing')
-                
-                logger.info(f"Triggered automation '{automation.name}' for contact {contact.phone_number}")
-            except Exception as e:
-                db.session.rollback()
-                logger.error(f"Error triggering automation: {str(e)}")
+    # Update automation last triggered time
+    db.session.execute(
+        update(Automation).where(
+            Automation.id.in_([a.id for a in automations])
+        ).values(last_triggered=datetime.utcnow())
+    )
+    
+    for automation in automations:
+        logger.info("Triggered automation '%s' for contact %s", automation.name, contact.phone_number)
+    return [automation.response_text for automation in automations]
 
 def process_tracking_command(contact, message_content):
-    """Process a tracking command from a WhatsApp message"""
+    """Get the replies to a tracking command with one or more GC numbers"""
     try:
-        # Extract the tracking number from the message
-        tracking_parts = message_content.strip().split(' ', 1)
-        if len(tracking_parts) < 2 or not tracking_parts[1].strip():
+        from acpl_tracker import parse_tracking_numbers, format_tracking_result
+        from tracking_cache import track_many
+        
+        # Extract the tracking numbers from the message, e.g. "TRACK 123 456" or "TRACK 123,456"
+        tracking_numbers = parse_tracking_numbers(message_content.strip()[len('TRACK'):])
+        if not tracking_numbers:
             # No tracking number provided
-            response = "⚠️ Please provide a tracking number. Example: TRACK 1234567890"
-        else:
-            tracking_number = tracking_parts[1].strip()
-            
-            # Import the tracking function
-            from acpl_tracker import track_acpl_cargo, format_tracking_result
-            
-            # Get tracking information
-            logger.info(f"Tracking ACPL cargo number: {tracking_number}")
-            tracking_result = track_acpl_cargo(tracking_number)
-            
-            # Format the response
-            response = format_tracking_result(tracking_result)
+            return ["⚠️ Please provide a tracking number. Example: TRACK 1234567890"]
         
-        # Send the response
-        send_message(contact.phone_number, response)
+        skipped = tracking_numbers[TRACK_MAX_NUMBERS:]
+        tracking_numbers = tracking_numbers[:TRACK_MAX_NUMBERS]
         
-        # Log the outgoing message
-        message = Message(
-            contact=contact,
-            content=response,
-            direction='outgoing',
-            message_type='text',
-            status='sent'
-        )
-        db.session.add(message)
-        db.session.commit()
+        # Look up all numbers concurrently
+        logger.info("Tracking %d ACPL cargo numbers: %s", len(tracking_numbers), tracking_numbers)
+        results = dict(track_many(tracking_numbers))
         
-        # Update statistics
-        update_stats(contact, 'outgoing')
+        # Reply in the order the numbers were sent
+        responses = [format_tracking_result(results[n]) for n in tracking_numbers]
+        if skipped:
+            responses.append(
+                f"⚠️ Only the first {TRACK_MAX_NUMBERS} tracking numbers were looked up. "
+                f"Please send the remaining {len(skipped)} in another message."
+            )
         
-        logger.info(f"Sent tracking response to {contact.phone_number}")
+        logger.info("Prepared %d tracking responses for %s", len(responses), contact.phone_number)
+        return responses
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Error processing tracking command: {str(e)}")
+        return [f"❌ Error processing tracking request: {str(e)}"]
+
+def process_subscription_command(contact, message_content):
+    """Get the replies to a SUBSCRIBE/UNSUBSCRIBE command for shipment movement updates"""
+    try:
+        from acpl_tracker import parse_tracking_numbers
         
-        # Send error message
-        try:
-            error_message = f"❌ Error processing tracking request: {str(e)}"
-            send_message(contact.phone_number, error_message)
-        except:
-            logger.error("Failed to send error message to user")
+        command, _, numbers = message_content.strip().partition(' ')
+        tracking_numbers = parse_tracking_numbers(numbers)[:TRACK_MAX_NUMBERS]
+        
+        if not tracking_numbers:
+            return [f"⚠️ Please provide a tracking number. Example: {command.upper()} 1234567890"]
+        elif command.upper() == 'SUBSCRIBE':
+            return [shipment_watch.subscribe(contact, n) for n in tracking_numbers]
+        else:
+            return [shipment_watch.unsubscribe(contact, n) for n in tracking_numbers]
+    except Exception as e:
+        logger.error(f"Error processing subscription command: {str(e)}")
+        return [f"❌ Error processing subscription request: {str(e)}"]
 
-def update_stats(contact, direction):
-    """Update message statistics"""
-    today = datetime.utcnow().date()
-    
-    # Find or create stats for today
-    stats = MessageStats.query.filter_by(date=today).first()
-    if not stats:
-        stats = MessageStats(date=today, messages_received=0, messages_sent=0, unique_contacts=0)
-        db.session.add(stats)
+def notify_contact(contact, text, reply_to=None):
+    """
+    Queue a message to a contact as an outgoing message.
     
-    # Update message counts
-    if direction == 'incoming':
-        stats.messages_received += 1
-    else:
-        stats.messages_sent += 1
-    
-    # Update unique contacts count
-    # In a real implementation, this would be more complex to accurately track daily unique contacts
-    
-    db.session.commit()
+    It is sent by the outbox dispatcher once the caller commits.
+    """
+    outbox.queue_message(contact, text, reply_to=reply_to)
+
+# Incoming webhook payloads are stored, then answered message by message, by the background job workers
+job_queue.register_handler('webhook', process_incoming_message)
+job_queue.register_handler('reply', reply_to_message)
+job_queue.start_workers(app)
+
+# Queued outgoing messages are sent by the outbox dispatcher
+outbox.start_dispatcher(app)
+
+# Delivery status callbacks are written in batches
+status_buffer.start_flusher(app)
+
+# Subscribed shipments are re-polled in the background
+scheduler.register_periodic(
+    'shipment_watch',
+    shipment_watch.WATCH_TICK_SECONDS,
+    lambda: shipment_watch.poll_due_shipments(notify_contact)
+)
+
+# Old messages are cleaned up in batches by the job workers
+job_queue.register_handler(retention.JOB_KIND, retention.run_retention_job)
+if retention.RETENTION_DAYS > 0:
+    scheduler.register_periodic('retention', retention.RETENTION_CHECK_SECONDS, retention.schedule)
+
+# Payloads stored before message_payload existed are converted in batches (migration 7)
+job_queue.register_handler(payload_store.BACKFILL_JOB_KIND, payload_store.backfill_payloads)
+# Stats of the days before the rollups existed are filled in batches (migration 5)
+job_queue.register_handler(migrations.ROLLUP_BACKFILL_JOB_KIND, migrations.backfill_rollups)
+
+# Message statistics collected in this process are written periodically
+scheduler.register_periodic('stats_flush', stats_counter.STATS_FLUSH_SECONDS, stats_counter.flush)
+stats_counter.flush_at_exit(app)
+
+# Contacts' last interaction times are coalesced and written periodically
+scheduler.register_periodic('contact_flush', contact_resolver.CONTACT_FLUSH_SECONDS, contact_resolver.flush)
+contact_resolver.flush_at_exit(app)
+
+scheduler.start_scheduler(app)
 
 # Simple test webhook endpoint
 @app.route('/webhook-test', methods=['GET', 'POST'])
 def webhook_test():
     """Simple endpoint for testing webhook connectivity"""
-    print(f"WEBHOOK-TEST: Received {request.method} request")
+    logger.debug("Webhook test %s request", request.method)
     
     if request.method == 'GET':
         return jsonify({
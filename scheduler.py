@@ -0,0 +1,57 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_tasks = []  # [name, interval, func, next_run]
+_start_lock = threading.Lock()
+_started_pid = None
+
+
+def register_periodic(name, interval, func):
+    """
+    Run a function every `interval` seconds in a background thread of each process.
+
+    Tasks run inside an app context. Every gunicorn worker runs its own copy, so
+    tasks must be safe to run concurrently (e.g. claim rows before working on them).
+
+    Args:
+        name (str): Name used in log messages
+        interval (float): Seconds between runs
+        func (callable): Called without arguments
+    """
+    _tasks.append([name, interval, func, time.monotonic() + interval])
+
+
+def _scheduler_loop(app):
+    while True:
+        now = time.monotonic()
+        for task in _tasks:
+            name, interval, func, next_run = task
+            if next_run > now:
+                continue
+            try:
+                with app.app_context():
+                    func()
+            except Exception as e:
+                logger.error(f"Periodic task '{name}' failed: {str(e)}")
+            task[3] = time.monotonic() + interval
+
+        next_due = min((task[3] for task in _tasks), default=time.monotonic() + 60)
+        time.sleep(min(max(next_due - time.monotonic(), 0.1), 60))
+
+
+def start_scheduler(app):
+    """Start the scheduler thread for this process"""
+    global _started_pid
+    with _start_lock:
+        # Threads do not survive a fork, so start again in each gunicorn worker
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        thread = threading.Thread(target=_scheduler_loop, args=(app,), name='scheduler', daemon=True)
+        thread.start()
+
+    logger.info(f"Started scheduler with {len(_tasks)} periodic tasks in process {os.getpid()}")
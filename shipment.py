@@ -0,0 +1,181 @@
+import re
+from dataclasses import dataclass, field
+
+# Keys that hold the GC number itself
+GC_NUMBER_KEYS = frozenset(["GC Number", "GCNumber"])
+# Keys never listed under "Additional Information"
+HIDDEN_KEYS = frozenset(["GC Number", "GCNumber", "GC No", "Date"])
+BOOKING_DATE_KEYS = frozenset(["booking date", "sent date", "date of booking"])
+LOCATION_KEYS = ("current location", "location", "present location", "last scan")
+# "Delivered" as a whole word, with the negation ("Not Delivered", "Non-Delivered") in group 1;
+# "Undelivered" does not match at all
+DELIVERED_PATTERN = re.compile(r"\b(?:(not|non)[\s-]+(?:yet\s+)?)?delivered\b", re.IGNORECASE)
+
+
+def _looks_like_date(text):
+    return "/" in text or "-" in text
+
+
+def date_sort_key(text):
+    """
+    Convert a DD/MM/YYYY or YYYY-MM-DD date into a sortable YYYYMMDD string
+
+    Args:
+        text (str): The date as shown by ACPL
+
+    Returns:
+        str: YYYYMMDD, or "0" if the text is not a parseable date
+    """
+    try:
+        if "/" in text:
+            day, month, year = map(int, text.split("/"))
+        elif "-" in text:
+            year, month, day = map(int, text.split("-"))
+        else:
+            return "0"
+        return f"{year:04d}{month:02d}{day:02d}"
+    except ValueError:
+        return "0"
+
+
+@dataclass(slots=True, frozen=True)
+class MovementEvent:
+    date: str  # as shown by ACPL, e.g. "02/05/2025"
+    location: str
+    sort_key: str  # YYYYMMDD, "0" when the date could not be parsed
+
+
+@dataclass(slots=True)
+class Shipment:
+    """Tracking information of one consignment, parsed once from the scraped fields"""
+    gc_number: str
+    booking_date: str = None
+    current_location: str = None
+    # Date of the newest movement when the current location was derived from it
+    current_location_as_of: str = None
+    movements: list = field(default_factory=list)  # MovementEvent, newest first
+    extra_fields: list = field(default_factory=list)  # (key, value) pairs
+
+    @classmethod
+    def from_tracking_data(cls, tracking_data):
+        """
+        Build a shipment from the key/value fields extracted by the scraper
+
+        Args:
+            tracking_data (dict): The tracking_data of a track_acpl_cargo result
+
+        Returns:
+            Shipment: The parsed shipment
+        """
+        gc_number = tracking_data.get("GC Number", tracking_data.get("GCNumber", "Unknown"))
+        shipment = cls(gc_number=gc_number)
+        items = list(tracking_data.items())
+
+        # Booking/sent date: an explicit key, or a numeric key (GC number) whose value is a date
+        for key, value in items:
+            if key.lower() in BOOKING_DATE_KEYS or (
+                key.isdigit() and isinstance(value, str) and _looks_like_date(value)
+            ):
+                shipment.booking_date = value
+                break
+
+        # Current location: an explicitly labeled field, otherwise the newest dated entry
+        for key, value in items:
+            lowered = key.lower()
+            if any(location_key in lowered for location_key in LOCATION_KEYS):
+                shipment.current_location = value
+                break
+
+        if not shipment.current_location:
+            dated = [(date_sort_key(key), key, value) for key, value in items if _looks_like_date(key)]
+            if dated:
+                _, newest_date, location = max(dated)
+                shipment.current_location = location
+                shipment.current_location_as_of = newest_date
+
+        # Movement history: date -> location fields (or location -> date), newest first
+        movements = []
+        for key, value in items:
+            if key in GC_NUMBER_KEYS or value == shipment.booking_date or value == shipment.current_location:
+                continue
+            if _looks_like_date(key):
+                movements.append((date_sort_key(key), key, value))
+            elif isinstance(value, str) and _looks_like_date(value):
+                movements.append((date_sort_key(value), value, key))
+        movements.sort(reverse=True)
+        shipment.movements = [MovementEvent(date, location, sort_key) for sort_key, date, location in movements]
+
+        # Everything not shown elsewhere
+        movement_dates = {event.date for event in shipment.movements}
+        movement_locations = {event.location for event in shipment.movements}
+        for key, value in items:
+            if key in HIDDEN_KEYS or key == gc_number or key in movement_dates:
+                continue
+            if value in movement_locations or value == shipment.current_location or value == shipment.booking_date:
+                continue
+            shipment.extra_fields.append((key, value))
+
+        return shipment
+
+    def new_movements(self, previous):
+        """
+        Get the movements that are not part of an earlier snapshot
+
+        Args:
+            previous (Shipment): The earlier snapshot, or None
+
+        Returns:
+            list: New MovementEvent entries, newest first
+        """
+        if previous is None:
+            return list(self.movements)
+        seen = {(event.date, event.location) for event in previous.movements}
+        return [event for event in self.movements if (event.date, event.location) not in seen]
+
+    @property
+    def is_delivered(self):
+        """True when any field reports the consignment as delivered, and not as undelivered"""
+        texts = [self.current_location or ""]
+        texts.extend(event.location for event in self.movements)
+        texts.extend(f"{key} {value}" for key, value in self.extra_fields)
+        return any(
+            match.group(1) is None
+            for text in texts
+            for match in DELIVERED_PATTERN.finditer(text)
+        )
+
+    def to_dict(self):
+        """Compact JSON-serializable form"""
+        return {
+            "gc": self.gc_number,
+            "booking_date": self.booking_date,
+            "location": self.current_location,
+            "as_of": self.current_location_as_of,
+            "movements": [[event.date, event.location, event.sort_key] for event in self.movements],
+            "extra": [list(pair) for pair in self.extra_fields],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            gc_number=data["gc"],
+            booking_date=data.get("booking_date"),
+            current_location=data.get("location"),
+            current_location_as_of=data.get("as_of"),
+            movements=[MovementEvent(*event) for event in data.get("movements", [])],
+            extra_fields=[tuple(pair) for pair in data.get("extra", [])],
+        )
+
+
+def result_to_json(result):
+    """Make a tracking result JSON-serializable, storing the shipment in its compact form"""
+    if isinstance(result.get("shipment"), Shipment):
+        result = dict(result, shipment=result["shipment"].to_dict())
+    return result
+
+
+def result_from_json(data):
+    """Inverse of result_to_json"""
+    if isinstance(data.get("shipment"), dict):
+        data = dict(data, shipment=Shipment.from_dict(data["shipment"]))
+    return data
@@ -0,0 +1,225 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from app import db
+from models import TrackedShipment, Subscription
+from shipment import Shipment
+from tracking_cache import track_many
+
+logger = logging.getLogger(__name__)
+
+# Seconds between polls right after a shipment moved
+WATCH_MIN_INTERVAL = int(os.environ.get('WATCH_MIN_INTERVAL', 900))
+# Polls of unchanged shipments back off (doubling) up to this many seconds
+WATCH_MAX_INTERVAL = int(os.environ.get('WATCH_MAX_INTERVAL', 6 * 3600))
+# Shipments without movement for this many days are no longer polled
+WATCH_MAX_IDLE_DAYS = int(os.environ.get('WATCH_MAX_IDLE_DAYS', 30))
+# Shipments whose lookup failed this many times in a row are no longer polled
+WATCH_MAX_FAILED_POLLS = int(os.environ.get('WATCH_MAX_FAILED_POLLS', 10))
+# Maximum shipments polled per scheduler tick and process
+WATCH_POLL_BATCH = int(os.environ.get('WATCH_POLL_BATCH', 20))
+# Seconds between scheduler ticks
+WATCH_TICK_SECONDS = int(os.environ.get('WATCH_TICK_SECONDS', 60))
+
+
+def _snapshot(result):
+    """Get the Shipment of a successful tracking result, or None"""
+    shipment = result.get('shipment')
+    if shipment is None and result.get('tracking_data'):
+        shipment = Shipment.from_tracking_data(result['tracking_data'])
+    return shipment
+
+
+def subscribe(contact, gc_number):
+    """
+    Subscribe a contact to movement updates of a shipment (committed by the caller)
+
+    Args:
+        contact (Contact): The subscribing contact
+        gc_number (str): The GC number to watch
+
+    Returns:
+        str: The reply to send to the contact
+    """
+    # Looked up on the tracking pool, whose own sessions write the shared
+    # cache, so the caller's transaction is not committed half way
+    _, result = next(track_many([gc_number]))
+    shipment = _snapshot(result) if result.get('success') else None
+    if shipment is None:
+        return f"❌ Could not subscribe to {gc_number}: {result.get('message', 'No tracking information found')}"
+    if shipment.is_delivered:
+        return f"✅ Shipment {gc_number} has already been delivered."
+
+    now = datetime.utcnow()
+    tracked = TrackedShipment.query.filter_by(gc_number=gc_number).first()
+    if tracked is None:
+        tracked = TrackedShipment(gc_number=gc_number, snapshot=shipment.to_dict(), last_polled_at=now)
+        db.session.add(tracked)
+    if tracked.status != 'active':
+        tracked.snapshot = shipment.to_dict()
+        tracked.last_polled_at = now
+    # A new subscriber restarts the polling cycle at the fastest rate
+    tracked.status = 'active'
+    tracked.last_changed_at = tracked.last_changed_at or now
+    tracked.failed_polls = 0
+    tracked.poll_interval = WATCH_MIN_INTERVAL
+    tracked.next_poll_at = now + timedelta(seconds=WATCH_MIN_INTERVAL)
+    db.session.flush()
+
+    subscription = Subscription.query.filter_by(contact_id=contact.id, shipment_id=tracked.id).first()
+    if subscription is None:
+        subscription = Subscription(contact_id=contact.id, shipment_id=tracked.id)
+        db.session.add(subscription)
+    subscription.is_active = True
+
+    location = shipment.current_location or 'unknown'
+    return (
+        f"🔔 Subscribed to shipment {gc_number}. Current location: {location}.\n"
+        f"You will get a message whenever it moves. Send UNSUBSCRIBE {gc_number} to stop."
+    )
+
+
+def unsubscribe(contact, gc_number):
+    """
+    Stop movement updates of a shipment for a contact (committed by the caller)
+
+    Returns:
+        str: The reply to send to the contact
+    """
+    subscription = Subscription.query.join(TrackedShipment).filter(
+        Subscription.contact_id == contact.id,
+        TrackedShipment.gc_number == gc_number,
+        Subscription.is_active.is_(True)
+    ).first()
+    if subscription is None:
+        return f"⚠️ You are not subscribed to shipment {gc_number}."
+
+    subscription.is_active = False
+    tracked = subscription.shipment
+    if tracked.status == 'active' and not tracked.subscriptions.filter_by(is_active=True).count():
+        # Nobody is left to notify
+        tracked.status = 'unsubscribed'
+        tracked.next_poll_at = None
+    return f"🔕 Unsubscribed from shipment {gc_number}."
+
+
+def _claim_due_shipments(now):
+    """
+    Claim due shipments by moving their next poll forward.
+
+    The UPDATE only succeeds if next_poll_at is unchanged, so when several
+    processes see the same due shipment exactly one of them polls it.
+    """
+    due = TrackedShipment.query.filter(
+        TrackedShipment.status == 'active',
+        TrackedShipment.next_poll_at <= now
+    ).order_by(TrackedShipment.next_poll_at).limit(WATCH_POLL_BATCH).all()
+
+    claimed = []
+    for tracked in due:
+        result = db.session.execute(
+            update(TrackedShipment).where(
+                TrackedShipment.id == tracked.id,
+                TrackedShipment.next_poll_at == tracked.next_poll_at
+            ).values(
+                next_poll_at=now + timedelta(seconds=tracked.poll_interval or WATCH_MIN_INTERVAL)
+            ).execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            claimed.append(tracked)
+    db.session.commit()
+    return claimed
+
+
+def _format_update(gc_number, new_events, delivered):
+    lines = [f"🚚 *Shipment Update*: {gc_number}\n"]
+    lines.extend(f"📅 *{event.date}*: {event.location}" for event in new_events)
+    if delivered:
+        lines.append("\n✅ Your shipment has been delivered. Updates for it have stopped.")
+    else:
+        lines.append(f"\nSend UNSUBSCRIBE {gc_number} to stop these updates.")
+    return "\n".join(lines)
+
+
+def poll_due_shipments(notify):
+    """
+    Re-poll subscribed shipments that are due and notify subscribers of new movements
+
+    Args:
+        notify (callable): notify(contact, text) queues a WhatsApp message to a contact
+
+    Returns:
+        int: Number of shipments polled
+    """
+    now = datetime.utcnow()
+    claimed = _claim_due_shipments(now)
+    if not claimed:
+        return 0
+
+    # Shipments whose subscribers all left are not looked up again
+    subscribed = set(db.session.execute(
+        select(Subscription.shipment_id).where(
+            Subscription.shipment_id.in_([tracked.id for tracked in claimed]),
+            Subscription.is_active.is_(True)
+        ).group_by(Subscription.shipment_id)
+    ).scalars())
+    by_number = {}
+    for tracked in claimed:
+        if tracked.id in subscribed:
+            by_number[tracked.gc_number] = tracked
+        else:
+            tracked = db.session.get(TrackedShipment, tracked.id)
+            tracked.status = 'unsubscribed'
+            tracked.next_poll_at = None
+
+    for gc_number, result in track_many(list(by_number), refresh=True):
+        tracked = db.session.get(TrackedShipment, by_number[gc_number].id)
+        tracked.last_polled_at = now
+        shipment = _snapshot(result) if result.get('success') else None
+
+        if shipment is None:
+            # Keep the snapshot and back off, giving up after too many failures in a row
+            tracked.failed_polls = (tracked.failed_polls or 0) + 1
+            logger.warning("Polling shipment %s failed (%d in a row): %s",
+                           gc_number, tracked.failed_polls, result.get('message'))
+            if tracked.failed_polls >= WATCH_MAX_FAILED_POLLS:
+                tracked.status = 'failed'
+                tracked.next_poll_at = None
+            else:
+                tracked.poll_interval = min((tracked.poll_interval or WATCH_MIN_INTERVAL) * 2, WATCH_MAX_INTERVAL)
+                tracked.next_poll_at = now + timedelta(seconds=tracked.poll_interval)
+            continue
+
+        tracked.failed_polls = 0
+
+        previous = Shipment.from_dict(tracked.snapshot) if tracked.snapshot else None
+        new_events = shipment.new_movements(previous)
+        delivered = shipment.is_delivered
+
+        if new_events or delivered:
+            tracked.snapshot = shipment.to_dict()
+            tracked.last_changed_at = now
+            tracked.poll_interval = WATCH_MIN_INTERVAL
+            text = _format_update(gc_number, new_events, delivered)
+            for subscription in tracked.subscriptions.filter_by(is_active=True):
+                try:
+                    notify(subscription.contact, text)
+                except Exception as e:
+                    logger.error(f"Error notifying subscriber of {gc_number}: {str(e)}")
+        else:
+            # Back off for shipments that are not moving
+            tracked.poll_interval = min((tracked.poll_interval or WATCH_MIN_INTERVAL) * 2, WATCH_MAX_INTERVAL)
+
+        if delivered:
+            tracked.status = 'delivered'
+            tracked.next_poll_at = None
+        elif tracked.last_changed_at and now - tracked.last_changed_at > timedelta(days=WATCH_MAX_IDLE_DAYS):
+            tracked.status = 'expired'
+            tracked.next_poll_at = None
+        else:
+            tracked.next_poll_at = now + timedelta(seconds=tracked.poll_interval)
+
+    db.session.commit()
+    logger.info("Polled %d subscribed shipments", len(by_number))
+    return len(by_number)
@@ -68,38 +68,33 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
-    // Handle search functionality
-    document.getElementById('search-button').addEventListener('click', function() {
-        const searchQuery = document.getElementById('search-input').value.trim().toLowerCase();
-        const filterValue = document.getElementById('filter-select').value;
+    // Search the messages on this page as you type; the other filters are
+    // applied by the server when the filter form is submitted
+    document.getElementById('search-input').addEventListener('keyup', function() {
+        const searchQuery = this.value.trim().toLowerCase();
         
         const rows = document.querySelectorAll('.message-row');
         rows.forEach(row => {
             const content = row.children[1].textContent.toLowerCase();
             const contact = row.children[0].textContent.toLowerCase();
-            const direction = row.classList.contains('table-success') ? 'incoming' : 'outgoing';
             
             const matchesSearch = searchQuery === '' || 
                                   content.includes(searchQuery) ||
                                   contact.includes(searchQuery);
                                   
-            const matchesFilter = filterValue === 'all' || 
-                                  (filterValue === 'incoming' && direction === 'incoming') ||
-                                  (filterValue === 'outgoing' && direction === 'outgoing');
-                                  
-            row.style.display = matchesSearch && matchesFilter ? '' : 'none';
+            row.style.display = matchesSearch ? '' : 'none';
         });
     });
     
-    // Filter select change handler
-    document.getElementById('filter-select').addEventListener('change', function() {
-        document.getElementById('search-button').click();
-    });
-    
-    // Search input keyup handler for immediate filtering
-    document.getElementById('search-input').addEventListener('keyup', function(e) {
+    // The search text only filters this page, it is not sent with the form
+    document.getElementById('search-input').addEventListener('keydown', function(e) {
         if (e.key === 'Enter') {
-            document.getElementById('search-button').click();
+            e.preventDefault();
         }
     });
+    
+    // Filter select change handler
+    document.getElementById('filter-select').addEventListener('change', function() {
+        document.getElementById('filter-form').submit();
+    });
 });
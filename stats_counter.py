@@ -0,0 +1,147 @@
+import os
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import update, func
+from app import db
+from models import MessageStats, MessageHourlyStats, DailyContact
+from db_utils import upsert_insert
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of the counters collected in this process
+STATS_FLUSH_SECONDS = float(os.environ.get('STATS_FLUSH_SECONDS', 5))
+
+DAILY_FIELDS = ('messages_received', 'messages_sent', 'new_contacts', 'response_time_total', 'response_count')
+
+_lock = threading.Lock()
+_daily = {}  # date -> Counter of DAILY_FIELDS
+_hourly = Counter()  # (hour, direction) -> messages
+_contacts = set()  # (date, contact_id) seen since the last flush
+
+
+def _record(now, direction, count, **daily):
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    with _lock:
+        _daily.setdefault(now.date(), Counter()).update(daily)
+        _hourly[(hour, direction)] += count
+
+
+def record_incoming(contact_id, new_contact=False):
+    """Count a committed incoming message"""
+    now = datetime.utcnow()
+    _record(now, 'incoming', 1, messages_received=1, new_contacts=int(new_contact))
+    with _lock:
+        _contacts.add((now.date(), contact_id))
+
+
+def record_sent(count=1, response_times=()):
+    """
+    Count outgoing messages that were sent
+
+    Args:
+        count (int): Number of messages sent
+        response_times (iterable): Seconds from an incoming message to its first reply
+    """
+    if not count:
+        return
+    now = datetime.utcnow()
+    response_times = [max(int(t), 0) for t in response_times]
+    _record(now, 'outgoing', count, messages_sent=count,
+            response_time_total=sum(response_times), response_count=len(response_times))
+
+
+def _take():
+    global _daily, _hourly, _contacts
+    with _lock:
+        taken = _daily, _hourly, _contacts
+        _daily, _hourly, _contacts = {}, Counter(), set()
+    return taken
+
+
+def _restore(daily, hourly, contacts):
+    # Put the deltas of a failed flush back so they are written next time
+    with _lock:
+        for date, counts in daily.items():
+            _daily.setdefault(date, Counter()).update(counts)
+        _hourly.update(hourly)
+        _contacts.update(contacts)
+
+
+def flush():
+    """
+    Add the counters collected in this process to the stats tables.
+
+    Each table gets one INSERT ... ON CONFLICT DO UPDATE SET x = x + delta, so
+    workers never read-modify-write a row and no increment is lost.
+
+    Returns:
+        int: Number of days updated
+    """
+    daily, hourly, contacts = _take()
+    if not daily and not contacts:
+        return 0
+
+    try:
+        # Contacts not yet counted for their date; RETURNING gives only the new rows
+        unique = Counter()
+        if contacts:
+            stmt = upsert_insert(DailyContact).values(
+                [{'date': date, 'contact_id': contact_id} for date, contact_id in contacts]
+            ).on_conflict_do_nothing().returning(DailyContact.date)
+            unique.update(db.session.execute(stmt).scalars().all())
+
+        dates = set(daily) | set(unique)
+        rows = [
+            dict({field: daily.get(date, {}).get(field, 0) for field in DAILY_FIELDS},
+                 date=date, unique_contacts=unique.get(date, 0))
+            for date in dates
+        ]
+        stmt = upsert_insert(MessageStats).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[MessageStats.date],
+            set_={
+                field: func.coalesce(getattr(MessageStats, field), 0) + getattr(stmt.excluded, field)
+                for field in DAILY_FIELDS + ('unique_contacts',)
+            }
+        )
+        db.session.execute(stmt)
+        db.session.execute(
+            update(MessageStats).where(
+                MessageStats.date.in_(dates),
+                MessageStats.response_count > 0
+            ).values(
+                response_time_avg=MessageStats.response_time_total // MessageStats.response_count
+            ).execution_options(synchronize_session=False)
+        )
+
+        if hourly:
+            stmt = upsert_insert(MessageHourlyStats).values(
+                [{'hour': hour, 'direction': direction, 'count': count} for (hour, direction), count in hourly.items()]
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[MessageHourlyStats.hour, MessageHourlyStats.direction],
+                set_={'count': MessageHourlyStats.count + stmt.excluded.count}
+            )
+            db.session.execute(stmt)
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _restore(daily, hourly, contacts)
+        raise
+
+    return len(dates)
+
+
+def flush_at_exit(app):
+    """Write the remaining counters when the process shuts down"""
+    def _flush():
+        try:
+            with app.app_context():
+                flush()
+        except Exception as e:
+            logger.error(f"Error flushing message stats at exit: {str(e)}")
+    atexit.register(_flush)
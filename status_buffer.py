@@ -0,0 +1,189 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import select, update, func
+from app import db
+from models import Message, OutboxEntry
+
+logger = logging.getLogger(__name__)
+
+# Buffered status callbacks are written at least this often (milliseconds)...
+STATUS_FLUSH_INTERVAL_MS = int(os.environ.get('STATUS_FLUSH_INTERVAL_MS', 500))
+# ...or as soon as this many messages have a pending update
+STATUS_FLUSH_MAX_ROWS = int(os.environ.get('STATUS_FLUSH_MAX_ROWS', 500))
+
+# Order of the delivery statuses; a message never moves back to a lower one
+STATUS_RANK = {
+    'queued': 0,
+    'sending': 1,
+    'sent': 2,
+    'delivered': 3,
+    'read': 4,
+    'failed': 5,
+}
+
+# Twilio statuses before 'sent' describe Twilio's own queue and are not recorded
+TWILIO_STATUSES = {
+    'sent': 'sent',
+    'delivered': 'delivered',
+    'read': 'read',
+    'failed': 'failed',
+    'undelivered': 'failed',
+}
+
+_pending = {}  # SID -> [status, when the first callback for it arrived]
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_start_lock = threading.Lock()
+_started_pid = None
+_app = None
+
+
+def record_status(message_sid, twilio_status):
+    """
+    Buffer a Twilio MessageStatus callback.
+
+    Several callbacks for the same message are coalesced to the furthest
+    status, so each message is written at most once per flush.
+
+    Returns:
+        bool: False if the status is not one that is recorded
+    """
+    status = TWILIO_STATUSES.get((twilio_status or '').lower())
+    if not message_sid or status is None:
+        return False
+
+    ensure_flusher()
+    with _lock:
+        current = _pending.get(message_sid)
+        if current is None:
+            _pending[message_sid] = [status, datetime.utcnow()]
+        elif STATUS_RANK[status] > STATUS_RANK[current[0]]:
+            current[0] = status
+        size = len(_pending)
+    if size >= STATUS_FLUSH_MAX_ROWS:
+        _wakeup.set()
+    return True
+
+
+def flush():
+    """
+    Write all buffered statuses, one UPDATE per target status.
+
+    Returns:
+        int: Number of known messages the statuses were applied to
+    """
+    global _pending
+    with _lock:
+        batch, _pending = _pending, {}
+    if not batch:
+        return 0
+
+    by_status = {}
+    for sid, (status, _) in batch.items():
+        by_status.setdefault(status, []).append(sid)
+
+    matched = set()
+    try:
+        for status, sids in by_status.items():
+            lower = [s for s, rank in STATUS_RANK.items() if rank < STATUS_RANK[status]]
+            rows = db.session.execute(
+                update(Message).where(
+                    Message.message_id.in_(sids),
+                    Message.status.in_(lower)
+                ).values(status=status).returning(
+                    Message.message_id
+                ).execution_options(synchronize_session=False)
+            ).scalars().all()
+            matched.update(rows)
+
+        # Messages that already have this status or a later one are done too
+        unmatched = [sid for sid in batch if sid not in matched]
+        if unmatched:
+            matched.update(db.session.execute(
+                select(Message.message_id).where(Message.message_id.in_(unmatched))
+            ).scalars().all())
+
+        unknown = {sid: entry for sid, entry in batch.items() if sid not in matched}
+        oldest_claim = _oldest_sending_claim() if unknown else None
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _requeue(batch)
+        raise
+
+    # The dispatcher stores a message's SID once its send returns, which can
+    # be after Twilio's first callbacks. A callback can only belong to a
+    # message claimed before it arrived, so it is kept for as long as such a
+    # message is still 'sending'.
+    keep = {}
+    for sid, (status, received_at) in unknown.items():
+        if oldest_claim is not None and oldest_claim <= received_at:
+            keep[sid] = (status, received_at)
+        else:
+            logger.warning("Dropping status '%s' for unknown message %s", status, sid)
+    _requeue(keep)
+
+    logger.debug("Flushed %d message statuses (%d for unknown messages)", len(batch), len(unknown))
+    return len(batch) - len(unknown)
+
+
+def _requeue(entries):
+    with _lock:
+        for sid, (status, received_at) in entries.items():
+            current = _pending.get(sid)
+            if current is None:
+                _pending[sid] = [status, received_at]
+            else:
+                current[1] = min(current[1], received_at)
+                if STATUS_RANK[status] > STATUS_RANK[current[0]]:
+                    current[0] = status
+
+
+def _oldest_sending_claim():
+    """When the longest-running claim of a message that is still 'sending' was made"""
+    return db.session.execute(
+        select(func.min(OutboxEntry.locked_at)).join(
+            Message, Message.id == OutboxEntry.message_id
+        ).where(Message.status == 'sending')
+    ).scalar()
+
+
+def _flusher_loop(app):
+    while True:
+        _wakeup.wait(STATUS_FLUSH_INTERVAL_MS / 1000)
+        _wakeup.clear()
+        with app.app_context():
+            try:
+                flush()
+            except Exception as e:
+                logger.error(f"Error flushing message statuses: {str(e)}")
+                time.sleep(STATUS_FLUSH_INTERVAL_MS / 1000)
+
+
+def start_flusher(app):
+    """
+    Start the status flusher thread for this process
+
+    Args:
+        app: The Flask application, used to push an app context per flush
+    """
+    global _app, _started_pid
+    _app = app
+    with _start_lock:
+        # Threads do not survive a fork, so start again in each gunicorn worker
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        thread = threading.Thread(target=_flusher_loop, args=(app,), name='status-flusher', daemon=True)
+        thread.start()
+
+    logger.info(f"Started message status flusher in process {os.getpid()}")
+
+
+def ensure_flusher():
+    """Make sure the flusher is running in the current process"""
+    if _app is not None and _started_pid != os.getpid():
+        start_flusher(_app)
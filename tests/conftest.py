@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# The app connects to DATABASE_URL when it is imported
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+os.environ.setdefault('JOB_QUEUE_WORKERS', '0')
+os.environ.setdefault('ACPL_ASYNC', 'off')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+
+from acpl_parser import (
+    parse_tracking_html_legacy, parse_tracking_html_lxml, page_text_legacy, page_text_lxml, lxml_html
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(lxml_html is None, reason="lxml is not installed")
+
+# Responses on which both parsers must extract the same fields and page text
+PARITY_CASES = [
+    '<p><b>Status:</b><script>x</script> Delivered</p>',
+    '<p><b>Status:</b><style>p { color: red }</style>Delivered</p>',
+    '<p><b>Status:</b><!-- note --> Delivered</p>',
+    '<p><b>Status:</b><!----> Delivered</p>',
+    '<p><strong>Status:</strong>   <i>Delivered</i></p>',
+    '<table><tr><td>From<script>s()</script></td><td>VASAI<!-- hub --> HUB</td></tr></table>',
+    '<div class="info"><span class="label">Weight</span><style>.x{}</style><span class="value">190</span></div>',
+    '<dl><dt>Pieces<!-- n --></dt><dd><script>1</script>4</dd></dl>',
+    '<div><style>a {}</style>No<script>1</script> Record<!-- c --> Found</div>',
+]
+
+
+@pytest.mark.parametrize('html', PARITY_CASES)
+def test_lxml_parser_matches_legacy(html):
+    assert parse_tracking_html_lxml(html, '2504500644') == parse_tracking_html_legacy(html, '2504500644')
+    assert page_text_lxml(html) == page_text_legacy(html)
+
+
+def test_lxml_parser_matches_legacy_on_saved_response():
+    with open(os.path.join(REPO_ROOT, 'tracking_response.html'), encoding='utf-8') as f:
+        html = f.read()
+    legacy = parse_tracking_html_legacy(html, '2504500644')
+    assert list(parse_tracking_html_lxml(html, '2504500644')[0].items()) == list(legacy[0].items())
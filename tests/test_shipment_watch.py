@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import app, db
+from models import Contact, Subscription, TrackedShipment
+import shipment_watch
+
+
+@pytest.fixture
+def session():
+    with app.app_context():
+        yield db.session
+        db.session.rollback()
+        Subscription.query.delete()
+        TrackedShipment.query.delete()
+        Contact.query.delete()
+        db.session.commit()
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Tracking numbers looked up by the poller; every lookup fails"""
+    looked_up = []
+
+    def track_many(numbers, refresh=False):
+        for number in numbers:
+            looked_up.append(number)
+            yield number, {"success": False, "message": "Error connecting to ACPL tracking: timed out"}
+
+    monkeypatch.setattr(shipment_watch, 'track_many', track_many)
+    return looked_up
+
+
+def _watched_shipment(session, subscribed=True):
+    contact = Contact(phone_number='+911234500001')
+    tracked = TrackedShipment(
+        gc_number='2504500644', status='active', poll_interval=shipment_watch.WATCH_MIN_INTERVAL,
+        next_poll_at=datetime.utcnow() - timedelta(seconds=1), last_changed_at=datetime.utcnow()
+    )
+    session.add_all([contact, tracked])
+    session.flush()
+    session.add(Subscription(contact_id=contact.id, shipment_id=tracked.id, is_active=subscribed))
+    session.commit()
+    return tracked.id
+
+
+def _make_due(session, tracked_id):
+    tracked = session.get(TrackedShipment, tracked_id)
+    tracked.next_poll_at = datetime.utcnow() - timedelta(seconds=1)
+    session.commit()
+
+
+def test_failed_lookups_back_off_and_expire(session, lookups, monkeypatch):
+    monkeypatch.setattr(shipment_watch, 'WATCH_MAX_FAILED_POLLS', 3)
+    tracked_id = _watched_shipment(session)
+
+    shipment_watch.poll_due_shipments(lambda contact, text: None)
+    tracked = session.get(TrackedShipment, tracked_id)
+    assert tracked.failed_polls == 1
+    assert tracked.poll_interval == 2 * shipment_watch.WATCH_MIN_INTERVAL
+    assert tracked.next_poll_at > datetime.utcnow() + timedelta(seconds=shipment_watch.WATCH_MIN_INTERVAL)
+
+    # Not due again until the longer interval has passed
+    assert shipment_watch.poll_due_shipments(lambda contact, text: None) == 0
+
+    for _ in range(2):
+        _make_due(session, tracked_id)
+        shipment_watch.poll_due_shipments(lambda contact, text: None)
+    tracked = session.get(TrackedShipment, tracked_id)
+    assert tracked.status == 'failed'
+    assert tracked.next_poll_at is None
+    assert len(lookups) == 3
+
+
+def test_shipment_without_subscribers_is_not_polled(session, lookups):
+    tracked_id = _watched_shipment(session, subscribed=False)
+
+    assert shipment_watch.poll_due_shipments(lambda contact, text: None) == 0
+    tracked = session.get(TrackedShipment, tracked_id)
+    assert tracked.status == 'unsubscribed'
+    assert tracked.next_poll_at is None
+    assert lookups == []
+
+
+def test_last_unsubscribe_stops_polling(session, lookups):
+    tracked_id = _watched_shipment(session)
+    contact = Contact.query.filter_by(phone_number='+911234500001').one()
+
+    shipment_watch.unsubscribe(contact, '2504500644')
+    session.commit()
+    tracked = session.get(TrackedShipment, tracked_id)
+    assert tracked.status == 'unsubscribed'
+    assert tracked.next_poll_at is None
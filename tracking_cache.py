@@ -0,0 +1,247 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import delete
+from app import db
+from models import TrackingCacheEntry
+from acpl_tracker import track_acpl_cargo
+import acpl_async
+from db_utils import upsert_insert
+from shipment import result_to_json, result_from_json
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Seconds a successful tracking result is reused
+TRACKING_CACHE_TTL = int(os.environ.get('TRACKING_CACHE_TTL', 600))
+# Seconds a "No Record Found" result is reused
+TRACKING_CACHE_NEGATIVE_TTL = int(os.environ.get('TRACKING_CACHE_NEGATIVE_TTL', 120))
+# Maximum number of results kept in memory per process
+TRACKING_CACHE_MAX_ENTRIES = int(os.environ.get('TRACKING_CACHE_MAX_ENTRIES', 1000))
+# 'memory' keeps results per process, 'db' also shares them between workers
+TRACKING_CACHE_BACKEND = os.environ.get('TRACKING_CACHE_BACKEND', 'memory').lower()
+# Concurrent ACPL lookups per process for batch tracking (without the async client, see ACPL_ASYNC)
+TRACKING_WORKERS = int(os.environ.get('TRACKING_WORKERS', 8))
+
+# Expired rows in the shared table are purged after this many writes
+_PURGE_EVERY = 500
+
+
+_cache = TTLCache(TRACKING_CACHE_MAX_ENTRIES)
+_counters_lock = threading.Lock()
+_counters = {
+    'hits': 0,
+    'negative_hits': 0,
+    'shared_hits': 0,
+    'misses': 0,
+}
+_shared_writes = 0
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _ttl_for(result):
+    """Get how long a tracking result may be cached, or 0 if it must not be"""
+    if result.get('success'):
+        return TRACKING_CACHE_TTL
+    if result.get('not_found'):
+        return TRACKING_CACHE_NEGATIVE_TTL
+    # Connection and parsing errors are never cached
+    return 0
+
+
+def _shared_get(tracking_number):
+    entry = db.session.get(TrackingCacheEntry, tracking_number)
+    if entry is None or entry.expires_at <= datetime.utcnow():
+        return None, 0
+    remaining = (entry.expires_at - datetime.utcnow()).total_seconds()
+    return result_from_json(entry.result), remaining
+
+
+def _shared_set(tracking_number, result, ttl):
+    global _shared_writes
+    now = datetime.utcnow()
+    values = {
+        'gc_number': tracking_number,
+        'result': result_to_json(result),
+        'expires_at': now + timedelta(seconds=ttl),
+        'updated_at': now,
+    }
+    stmt = upsert_insert(TrackingCacheEntry).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TrackingCacheEntry.gc_number],
+        set_={
+            'result': stmt.excluded.result,
+            'expires_at': stmt.excluded.expires_at,
+            'updated_at': stmt.excluded.updated_at,
+        }
+    )
+    db.session.execute(stmt)
+
+    with _counters_lock:
+        _shared_writes += 1
+        purge = _shared_writes % _PURGE_EVERY == 0
+    if purge:
+        db.session.execute(delete(TrackingCacheEntry).where(TrackingCacheEntry.expires_at <= now))
+
+    db.session.commit()
+
+
+def _cached_result(tracking_number):
+    """Get a cached tracking result, or None"""
+    result = _cache.get(tracking_number)
+    if result is not None:
+        _count('hits' if result.get('success') else 'negative_hits')
+        return result
+
+    if TRACKING_CACHE_BACKEND == 'db':
+        try:
+            result, remaining = _shared_get(tracking_number)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error reading shared tracking cache: {str(e)}")
+            result = None
+        if result is not None:
+            _count('shared_hits')
+            _cache.set(tracking_number, result, remaining)
+            return result
+    return None
+
+
+def _store_result(tracking_number, result):
+    """Cache a freshly scraped tracking result for as long as it may be reused"""
+    ttl = _ttl_for(result)
+    if ttl > 0:
+        _cache.set(tracking_number, result, ttl)
+        if TRACKING_CACHE_BACKEND == 'db':
+            try:
+                _shared_set(tracking_number, result, ttl)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error writing shared tracking cache: {str(e)}")
+
+
+def get_tracking_result(tracking_number, refresh=False):
+    """
+    Get the tracking result for a GC number, scraping ACPL only on a cache miss
+
+    Args:
+        tracking_number (str): The GC number to look up
+        refresh (bool): Skip cached results and scrape a fresh one
+
+    Returns:
+        dict: The tracking result in the format returned by track_acpl_cargo
+    """
+    tracking_number = tracking_number.strip()
+
+    if not refresh:
+        result = _cached_result(tracking_number)
+        if result is not None:
+            return result
+
+    _count('misses')
+    result = track_acpl_cargo(tracking_number)
+    _store_result(tracking_number, result)
+    return result
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=TRACKING_WORKERS, thread_name_prefix='tracking')
+    return _executor
+
+
+def track_many(tracking_numbers, refresh=False):
+    """
+    Look up several GC numbers concurrently on a bounded worker pool.
+
+    Repeated numbers are looked up once and every lookup goes through the cache.
+    Must be called with an app context; results are yielded as each lookup finishes.
+
+    Args:
+        tracking_numbers (list): The GC numbers to look up
+        refresh (bool): Skip cached results and scrape fresh ones
+
+    Yields:
+        tuple: (tracking_number, result) in completion order
+    """
+    app = current_app._get_current_object()
+    unique_numbers = list(dict.fromkeys(n.strip() for n in tracking_numbers if n and n.strip()))
+    if acpl_async.enabled():
+        yield from _track_many_async(app, unique_numbers, refresh)
+        return
+
+    def lookup(tracking_number):
+        with app.app_context():
+            return get_tracking_result(tracking_number, refresh=refresh)
+
+    executor = _get_executor()
+    futures = {executor.submit(lookup, n): n for n in unique_numbers}
+    try:
+        for future in as_completed(futures):
+            tracking_number = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.error(f"Error tracking {tracking_number}: {str(e)}")
+                result = {"success": False, "message": f"Unexpected error: {str(e)}"}
+            yield tracking_number, result
+    finally:
+        # Drop lookups that have not started yet if the caller stops early
+        for future in futures:
+            future.cancel()
+
+
+def _track_many_async(app, tracking_numbers, refresh):
+    # The cache is read and written in an app context of its own, so its
+    # commits and rollbacks never touch the caller's session
+    misses = []
+    for tracking_number in tracking_numbers:
+        result = None
+        if not refresh:
+            with app.app_context():
+                result = _cached_result(tracking_number)
+        if result is not None:
+            yield tracking_number, result
+        else:
+            _count('misses')
+            misses.append(tracking_number)
+
+    # Scraped on the shared event loop instead of a thread per lookup
+    for tracking_number, result in acpl_async.lookup_many(misses):
+        with app.app_context():
+            _store_result(tracking_number, result)
+        yield tracking_number, result
+
+
+def cache_stats():
+    """
+    Get the hit/miss counters of the tracking cache for this process
+
+    Returns:
+        dict: Counters plus the current size and hit ratio
+    """
+    with _counters_lock:
+        stats = dict(_counters)
+    lookups = stats['hits'] + stats['negative_hits'] + stats['shared_hits'] + stats['misses']
+    stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 3) if lookups else 0.0
+    stats['entries'] = len(_cache)
+    stats['evictions'] = _cache.evictions
+    stats['backend'] = TRACKING_CACHE_BACKEND
+    return stats
+
+
+def clear_cache():
+    """Drop all in-memory results of this process"""
+    _cache.clear()
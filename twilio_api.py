@@ -1,6 +1,8 @@
 import os
 import logging
+import threading
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 from twilio.base.exceptions import TwilioRestException
 from urllib.parse import quote
 
@@ -10,6 +12,82 @@ logger = logging.getLogger(__name__)
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.environ.get('TWILIO_PHONE_NUMBER', '+14155238886')  # Default Twilio WhatsApp Sandbox number
+TWILIO_TIMEOUT = float(os.environ.get('TWILIO_TIMEOUT', 15))
+# Public URL of /webhook/status; Twilio posts delivery status changes there
+TWILIO_STATUS_CALLBACK_URL = os.environ.get('TWILIO_STATUS_CALLBACK_URL')
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(account_sid=None, auth_token=None):
+    """
+    Get the long-lived Twilio client for a credential set.
+
+    Clients are created once and reused, so every message after the first is sent
+    over the client's pooled keep-alive HTTPS connection.
+
+    Args:
+        account_sid (str): Twilio Account SID, defaults to TWILIO_ACCOUNT_SID
+        auth_token (str): Twilio Auth Token, defaults to TWILIO_AUTH_TOKEN
+
+    Returns:
+        Client: The shared Twilio REST client
+    """
+    key = (account_sid or TWILIO_ACCOUNT_SID, auth_token or TWILIO_AUTH_TOKEN)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = Client(*key, http_client=TwilioHttpClient(pool_connections=True, timeout=TWILIO_TIMEOUT))
+                _clients[key] = client
+    return client
+
+
+def normalize_phone_number(phone_number):
+    """Ensure a phone number is in international format with a leading +"""
+    if not phone_number.startswith('+'):
+        phone_number = f"+{phone_number}"
+    return phone_number
+
+
+def create_message(to_phone_number, message_text):
+    """
+    Send a WhatsApp message through Twilio, raising on failure
+
+    Args:
+        to_phone_number (str): The recipient's phone number in international format with +
+        message_text (str): The message text to send
+
+    Returns:
+        dict: Status information about the message
+
+    Raises:
+        TwilioRestException: If Twilio rejects the request
+    """
+    to_phone_number = normalize_phone_number(to_phone_number)
+    logger.debug("Sending WhatsApp message via Twilio to %s (%d chars)", to_phone_number, len(message_text))
+
+    # Prepend 'whatsapp:' to both phone numbers
+    params = {
+        'from_': f"whatsapp:{TWILIO_PHONE_NUMBER}",
+        'body': message_text,
+        'to': f"whatsapp:{to_phone_number}",
+    }
+    if TWILIO_STATUS_CALLBACK_URL:
+        params['status_callback'] = TWILIO_STATUS_CALLBACK_URL
+    message = get_client().messages.create(**params)
+
+    logger.info("WhatsApp message sent with SID: %s", message.sid)
+
+    return {
+        "success": True,
+        "message_sid": message.sid,
+        "to": to_phone_number,
+        "status": message.status
+    }
+
 
 def send_whatsapp_message(to_phone_number, message_text):
     """
@@ -23,8 +101,7 @@ def send_whatsapp_message(to_phone_number, message_text):
         dict: Status information about the message
     """
     # Ensure phone number is in proper format
-    if not to_phone_number.startswith('+'):
-        to_phone_number = f"+{to_phone_number}"
+    to_phone_number = normalize_phone_number(to_phone_number)
     
     try:
         # Check if we have Twilio credentials
@@ -33,35 +110,7 @@ def send_whatsapp_message(to_phone_number, message_text):
             logger.warning("Twilio credentials not found. Generating WhatsApp URL instead.")
             return generate_whatsapp_url(to_phone_number, message_text)
         
-        # Log the message
-        logger.info(f"SENDING WHATSAPP MESSAGE via Twilio:")
-        logger.info(f"From: {TWILIO_PHONE_NUMBER}")
-        logger.info(f"To: {to_phone_number}")
-        logger.info(f"Message: {message_text}")
-        
-        # Initialize Twilio client
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        
-        # Prepend 'whatsapp:' to both phone numbers
-        from_whatsapp = f"whatsapp:{TWILIO_PHONE_NUMBER}"
-        to_whatsapp = f"whatsapp:{to_phone_number}"
-        
-        # Send the message
-        message = client.messages.create(
-            from_=from_whatsapp,
-            body=message_text,
-            to=to_whatsapp
-        )
-        
-        logger.info(f"WhatsApp message sent with SID: {message.sid}")
-        
-        # Return message details
-        return {
-            "success": True,
-            "message_sid": message.sid,
-            "to": to_phone_number,
-            "status": message.status
-        }
+        return create_message(to_phone_number, message_text)
     
     except TwilioRestException as e:
         logger.error(f"Twilio API error: {str(e)}")
@@ -96,7 +145,7 @@ def generate_whatsapp_url(to_phone_number, message_text):
         encoded_message = quote(message_text)
         demo_link = f"{whatsapp_url}?text={encoded_message}"
         
-        logger.info(f"Generated WhatsApp URL: {demo_link}")
+        logger.debug(f"Generated WhatsApp URL for {to_phone_number}")
         
         return {
             "success": True,
@@ -0,0 +1,73 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Message ids of recent webhooks remembered per process
+WEBHOOK_DEDUP_SIZE = int(os.environ.get('WEBHOOK_DEDUP_SIZE', 10000))
+
+_lock = threading.Lock()
+_seen = OrderedDict()  # message id -> None, least recently seen first
+_counters = {
+    'messages': 0,  # message ids received by the webhook
+    'duplicates': 0,  # ids answered from memory, before any database work
+    'stored_duplicates': 0,  # ids another delivery had already stored (ON CONFLICT)
+}
+
+
+def is_duplicate(message_ids):
+    """
+    Check the message ids of a webhook delivery against the recently seen ones
+
+    Args:
+        message_ids (list): Ids of the messages in the delivery
+
+    Returns:
+        bool: True if every message was seen before, so the delivery is a retry
+    """
+    with _lock:
+        seen = 0
+        for message_id in message_ids:
+            if message_id in _seen:
+                _seen.move_to_end(message_id)
+                seen += 1
+        duplicate = bool(message_ids) and seen == len(message_ids)
+        _counters['messages'] += len(message_ids)
+        if duplicate:
+            # Partly new deliveries are processed, their duplicates are counted when stored
+            _counters['duplicates'] += seen
+    return duplicate
+
+
+def remember(message_ids):
+    """Remember the ids of a delivery once it is safely queued"""
+    with _lock:
+        for message_id in message_ids:
+            _seen[message_id] = None
+            _seen.move_to_end(message_id)
+        while len(_seen) > WEBHOOK_DEDUP_SIZE:
+            _seen.popitem(last=False)
+
+
+def record_stored_duplicates(count):
+    """Count messages skipped because they were already stored"""
+    if count:
+        with _lock:
+            _counters['stored_duplicates'] += count
+
+
+def stats():
+    """
+    Get the deduplication counters of this process
+
+    Returns:
+        dict: Counters, remembered ids and the share of duplicate messages
+    """
+    with _lock:
+        counters = dict(_counters)
+        counters['remembered'] = len(_seen)
+    duplicates = counters['duplicates'] + counters['stored_duplicates']
+    counters['duplicate_rate'] = round(duplicates / counters['messages'], 3) if counters['messages'] else 0.0
+    return counters
@@ -0,0 +1,95 @@
+import logging
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def _meta_content(msg):
+    message_type = msg.get('type', 'text')
+    if message_type == 'text':
+        return msg.get('text', {}).get('body', '')
+    if message_type == 'image':
+        return "[Image]"  # In a real app, you'd process the image URL
+    return ""
+
+
+def _single_message_payload(data, entry, change, value, msg, contact):
+    # The payload as Meta would have sent it for this message alone
+    value = dict(value, messages=[msg])
+    if 'contacts' in value:
+        value['contacts'] = [contact] if contact is not None else []
+    change = dict(change, value=value)
+    entry = dict(entry, changes=[change])
+    return dict(data, entry=[entry])
+
+
+def parse_messages(data):
+    """
+    Get the incoming messages of a webhook payload
+
+    Twilio posts one message per request. Meta batches several messages, from
+    one or more senders, into the entry -> changes -> messages arrays.
+
+    Args:
+        data (dict): Twilio form fields or a Meta webhook body
+
+    Returns:
+        list: One dict per message with message_id, from_number, timestamp,
+            message_type, content and payload (the part of data describing
+            only this message)
+    """
+    # Handle Twilio WhatsApp webhook format
+    if 'Body' in data:
+        return [{
+            'message_id': data.get('MessageSid'),
+            'from_number': data.get('From', '').replace('whatsapp:', ''),
+            'timestamp': datetime.utcnow(),  # Twilio doesn't provide timestamp in the same way
+            'message_type': 'text',
+            'content': data.get('Body', ''),
+            'payload': data,
+        }]
+
+    # Handle Meta WhatsApp Business API format
+    if 'entry' in data:
+        messages = []
+        for entry in data['entry']:
+            for change in entry.get('changes', []):
+                if change.get('field') != 'messages':
+                    continue
+
+                value = change.get('value', {})
+                contacts = {contact.get('wa_id'): contact for contact in value.get('contacts', [])}
+                for msg in value.get('messages', []):
+                    content = _meta_content(msg)
+                    if not content:
+                        logger.warning("Skipping %s message %s without content", msg.get('type'), msg.get('id'))
+                        continue
+                    messages.append({
+                        'message_id': msg.get('id'),
+                        'from_number': msg.get('from'),
+                        # Naive UTC, like the datetime.utcnow() used everywhere else
+                        'timestamp': datetime.fromtimestamp(int(msg.get('timestamp', 0)), timezone.utc).replace(tzinfo=None),
+                        'message_type': msg.get('type', 'text'),
+                        'content': content,
+                        'payload': _single_message_payload(
+                            data, entry, change, value, msg, contacts.get(msg.get('from'))
+                        ),
+                    })
+        return messages
+
+    logger.warning("Unknown webhook format")
+    return []
+
+
+def message_ids(data):
+    """Get the ids of the messages in a webhook payload, without parsing them"""
+    if 'Body' in data:
+        return [data['MessageSid']] if data.get('MessageSid') else []
+    return [
+        msg['id']
+        for entry in data.get('entry', [])
+        for change in entry.get('changes', [])
+        if change.get('field') == 'messages'
+        for msg in change.get('value', {}).get('messages', [])
+        if msg.get('id')
+    ]